@@ -0,0 +1,18 @@
+#!/bin/bash
+set -e
+
+# Usage: ./bench.sh <codon|pypy|python> <benchmark> [args...]
+impl=$1
+shift
+
+if [ "$impl" == "codon" ]; then
+    python preprocess.py codon
+    codon build --release rtow_codon/bench.py 2> >(grep -v '^ld: warning')
+    ./rtow_codon/bench "$@"
+elif [ "$impl" == "pypy" ]; then
+    python preprocess.py python
+    pypy3 -m rtow_python.bench "$@"
+else
+    python preprocess.py python
+    python3 -m rtow_python.bench "$@"
+fi
@@ -38,7 +38,9 @@ def pythonize(lines):
     for i, line in enumerate(lines):
         # Remove codon types
         # TODO: More thorough
-        lines[i] = line.replace("UInt[8]", "int")
+        line = line.replace("UInt[8]", "int")
+        line = re.sub(r"\bfloat32\b", "float", line)
+        lines[i] = line
 
         # If a new block starts with no indentation, it means we left the class
         if len(line) > 0 and not re.match("\s", line[0]):
@@ -1,15 +1,39 @@
 #!/bin/bash
 set -e
 
-python preprocess.py codon
-codon build --debug rtow_codon/__main__.py
-sudo dtrace -c './rtow_codon/__main__ large-file' -o out.stacks -n 'profile-997 /execname == "__main__"/ { @[ustack(100)] = count(); }'
-./flamegraph/stackcollapse.pl out.stacks |
-    ./flamegraph/flamegraph.pl \
-        --title "Ray Tracing in One Weekend" \
-        --subtitle "Codon build flame graph" \
-        --width 1536 \
-        --height 32 \
-        --fonttype monospace \
-        > rtow_codon.svg
-python -c "import webbrowser as w; b = w.get('chrome'); b.open_new('file://$(pwd)/rtow_codon.svg')"
+# Usage: ./profile.sh <codon|pypy|python> [scene]
+# Writes the stacks sampled during a render to renders/profile_<impl>.folded, as collapsed
+# stacks (see rtow/profiler.py), and a flame graph next to it if flamegraph.pl is found
+impl=${1:-codon}
+scene=${2:-perlin_spheres}
+stacks=renders/profile_$impl.folded
+mkdir -p renders
+
+# The perf output of Codon is collapsed by the Python build of the profiler
+python preprocess.py python
+if [ "$impl" == "codon" ]; then
+    # Codon code has no Python frames to sample, perf samples the native stacks instead
+    python preprocess.py codon
+    codon build --debug rtow_codon/__main__.py
+    perf record -F 997 -g -o renders/perf.data ./rtow_codon/__main__ "$scene" --profile
+    perf script -i renders/perf.data | python3 -m rtow_python.profiler > "$stacks"
+elif [ "$impl" == "pypy" ]; then
+    pypy3 -m rtow_python "$scene" --profile --stacks "$stacks"
+else
+    python3 -m rtow_python "$scene" --profile --stacks "$stacks"
+fi
+
+flamegraph=$(command -v flamegraph.pl || ls ./flamegraph/flamegraph.pl 2> /dev/null || true)
+if [ -z "$flamegraph" ]; then
+    echo "Collapsed stacks in $stacks, for flamegraph.pl, inferno-flamegraph or speedscope"
+    exit 0
+fi
+
+"$flamegraph" "$stacks" \
+    --title "Ray Tracing in One Weekend" \
+    --subtitle "$impl flame graph" \
+    --width 1536 \
+    --height 32 \
+    --fonttype monospace \
+    > renders/profile_$impl.svg
+python3 -c "import webbrowser; webbrowser.open('file://$(pwd)/renders/profile_$impl.svg')"
@@ -4,3 +4,4 @@ from .interval import Interval
 from .aabb import AABB
 from .image import Image
 from .perlin import Perlin
+from .mipmap import MipTexture
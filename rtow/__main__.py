@@ -1,139 +1,47 @@
 import os
+import sys
 from datetime import datetime
-from random import random, uniform
+from time import time
 
-from .tracer import Tracer, Camera
-from .vec3 import Vec3, Point3, Color
-from .objects import Sphere, HittableList
-from .materials import Lambertian, Metal, Dielectric
-from .textures import Checker, ImageTexture, NoiseTexture
+from .tracer import Tracer
+from .scenes import load_scene
+from .stats import save_heatmaps
+from .profiler import phases
+# <python-only>
+from .profiler import StackSampler
+# </python-only>
 
 
-def bouncing_spheres():
-    world = HittableList()
-
-    checker = Checker.from_colors(0.32, Color(0.2, 0.3, 0.1), Color.all(0.9))
-    world.add(Sphere(1000, Lambertian(checker), Point3(0, -1000, 0)))
-
-    for a in range(-11, 11):
-        for b in range(-11, 11):
-            choose_mat = random()
-            center = Point3(a + 0.9 * random(), 0.2, b + 0.9 * random())
-
-            if (center - Point3(4, 0.2, 0)).length() > 0.9:
-                if choose_mat < 0.8:
-                    # diffuse
-                    albedo = Color.random() * Color.random()
-                    sphere_material = Lambertian.from_color(albedo)
-                    center2 = center + Vec3(0, uniform(0, 0.5), 0)
-                    world.add(Sphere(0.2, sphere_material, center, center2))
-                elif choose_mat < 0.95:
-                    # metal
-                    albedo = Color.random(0.5, 1)
-                    fuzz = uniform(0, 0.5)
-                    sphere_material = Metal(albedo, fuzz)
-                    world.add(Sphere(0.2, sphere_material, center))
-                else:
-                    # glass
-                    sphere_material = Dielectric(1.5)
-                    world.add(Sphere(0.2, sphere_material, center))
-
-    material1 = Dielectric(1.5)
-    world.add(Sphere(1.0, material1, Point3(0, 1, 0)))
-
-    material2 = Lambertian.from_color(Color(0.4, 0.2, 0.1))
-    world.add(Sphere(1.0, material2, Point3(-4, 1, 0)))
-
-    material3 = Metal(Color(0.7, 0.6, 0.5), 0.0)
-    world.add(Sphere(1.0, material3, Point3(4, 1, 0)))
-
-    camera = Camera(
-        vfov=20,
-        lookfrom=Point3(13, 2, 3),
-        lookat=Point3(0, 0, 0),
-        vup=Vec3(0, 1, 0),
-
-        defocus_angle=0.6,
-        focus_dist=10.0,
-    )
-
-    return world, camera
-
-
-def bouncing_spheres_ortho():
-    world, camera = bouncing_spheres()
-    camera.mode = "orthographic"
-    return world, camera
-
-
-def checkered_spheres():
-    world = HittableList()
-
-    checker = Checker.from_colors(0.32, Color(0.2, 0.3, 0.1), Color.all(0.9))
-
-    world.add(Sphere(10, Lambertian(checker), Point3(0, -10, 0)))
-    world.add(Sphere(10, Lambertian(checker), Point3(0,  10, 0)))
-
-    camera = Camera(
-        vfov=20,
-        lookfrom=Point3(13, 2, 3),
-        lookat=Point3(0, 0, 0),
-        vup=Vec3(0, 1, 0),
-
-        defocus_angle=0,
-    )
-
-    return world, camera
-
-
-def earth():
-    world = HittableList()
-
-    earth_texture = ImageTexture("images/earthmap.jpg")
-    earth_surface = Lambertian(earth_texture)
-    globe = Sphere(2, earth_surface, Point3(0, 0, 0))
-
-    world.add(globe)
-
-    camera = Camera(
-        vfov=20,
-        lookfrom=Point3(0, 0, 12),
-        lookat=Point3(0, 0, 0),
-        vup=Vec3(0, 1, 0),
-
-        defocus_angle=0,
-    )
-
-    return world, camera
-
-
-def perlin_spheres():
-    world = HittableList()
-
-    perlin_texture = Lambertian(NoiseTexture(4))
-    world.add(Sphere(1000, perlin_texture, Point3(0, -1000, 0)))
-    world.add(Sphere(2, perlin_texture, Point3(0, 2, 0)))
-
-    camera = Camera(
-        vfov=20,
-        lookfrom=Point3(13, 2, 3),
-        lookat=Point3(0, 0, 0),
-        vup=Vec3(0, 1, 0),
-
-        defocus_angle=0,
-    )
-
-    return world, camera
+if __name__ == "__main__":
+    # Not in book: options after the scene, see profiler.py
+    #   --profile        time every tile, print rays per second and save a heatmap of tile times
+    #   --stats          count rays, BVH work and texture tiles, print them and save heatmaps (see stats.py)
+    #   --stacks <path>  sample the stacks of the run into path as collapsed stacks (CPython and PyPy)
+    options = sys.argv[2:]
+    profile = "--profile" in options
+    stats = "--stats" in options
+    stacks = ""
+    if "--stacks" in options:
+        i = options.index("--stacks")
+        assert i + 1 < len(options), "Expected: --stacks <path>"
+        stacks = options[i + 1]
+
+    # <python-only>
+    sampler = StackSampler()
+    if stacks != "":
+        sampler.start()
+    # </python-only>
+    # <codon-only>
+    assert stacks == "", "Codon code has no Python stacks to sample, profile it with perf (see profile.sh)"
+    # </codon-only>
 
+    start = datetime.now()
+    start_time = time()
 
-if __name__ == "__main__":
-    world, camera = (
-        bouncing_spheres,
-        bouncing_spheres_ortho,
-        checkered_spheres,
-        earth,
-        perlin_spheres,
-    )[4]()
+    # Not in book: a scene name of scenes.py or the path of a scene file (.scene, .rtowscene)
+    phases.start("scene")
+    world, camera = load_scene(sys.argv[1] if len(sys.argv) > 1 else "perlin_spheres")
+    phases.stop("scene")
 
     tracer = Tracer(
         camera=camera,
@@ -141,16 +49,36 @@ if __name__ == "__main__":
         image_width=400,
         samples_per_pixel=100,
         max_depth=50,
+        profile=profile,
+        stats=stats,
     )
 
-    start = datetime.now()
     buffer = tracer.render(world)
-    end = datetime.now()
 
-    duration = (end - start).seconds
+    # Not in book: the duration in hundredths of seconds, of the scene and BVH builds too
+    duration = time() - start_time
     timestamp = start.isoformat().replace("T", "-").replace(":", "").split(".")[0]
-    filename = f"{timestamp}_ssp={tracer.samples_per_pixel}_md={tracer.max_depth}_t={duration}s"
+    filename = f"{timestamp}_ssp={tracer.samples_per_pixel}_md={tracer.max_depth}_t={duration:.2f}s"
+
+    phases.start("encode")
     buffer.save_ppm(filename)
+    # Not in book: linear colors too, to change the exposure or tonemapping later (see output.py)
+    buffer.save(filename, "pfm")
+    if tracer.adaptive:
+        buffer.sample_heatmap(tracer.samples_per_pixel).save_ppm(f"{filename}_samples")
+    if tracer.stats:
+        save_heatmaps(tracer.stats_maps, filename)
+    if tracer.profile:
+        tracer.tile_times.heatmap(tracer.image_width, tracer.image_height).save_ppm(f"{filename}_tiles")
+    phases.stop("encode")
+
+    print()
+    phases.report()
+    # <python-only>
+    if stacks != "":
+        sampler.stop()
+        sampler.save(stacks)
+    # </python-only>
 
     try:
         print()
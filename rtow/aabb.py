@@ -60,6 +60,10 @@ class AABB:
 
         return True
     
+    def surface_area(self) -> float:
+        dx, dy, dz = self.x.size(), self.y.size(), self.z.size()
+        return 2 * (dx * dy + dy * dz + dz * dx)
+
     def longest_axis(self):
         # Returns the index of the longest axis of the bounding box.
         if self.x.size() > self.y.size():
@@ -0,0 +1,1122 @@
+import os
+import sys
+from math import sqrt
+from time import time
+from typing import List, Optional, Tuple
+
+from random import Random
+
+from .tracer import Tracer
+from .bvh import BVHNode
+from .flat_bvh import FlatBVH
+from .wide_bvh import WideBVH
+from .bvh_cache import cached_build, scene_key, memo, cache_dir
+from .buffer import Buffer
+from .mapped_buffer import MappedBuffer
+from .output import image_formats, save_image, to_bytes
+from .binio import BinaryReader
+from .interval import Interval
+from .ray import Ray
+from .aabb import AABB
+from .objects import Hittable, HitRecord, HittableList, Sphere
+from .materials import Lambertian
+from .textures import MipmapTexture, Texture
+from .vec3 import Color, Point3, Vec3
+from .perlin import Perlin
+from .image import Image
+from .mipmap import MipTexture, tile_bytes
+from .camera import Camera
+from .rng import Rng
+from .sampler import sampler_names
+from .scenes import bouncing_spheres, earth, sphere_field, load_scene, scene_names
+from .scene_file import read_text, read_binary
+from .tiles import make_tiles
+from .stats import RenderStats
+
+
+# Not in book: benchmarks used to measure the performance additions, run them with bench.sh
+
+
+class RayCounter(Hittable):
+    """Counts the rays traced against the wrapped world."""
+
+    world: Hittable
+    count: int
+
+    def __init__(self, world: Hittable):
+        self.world = world
+        self.count = 0
+
+    def hit(self, r: Ray, ray_t: Interval) -> Optional[HitRecord]:
+        self.count += 1
+        return self.world.hit(r, ray_t)
+
+    def bounding_box(self) -> AABB:
+        return self.world.bounding_box()
+
+
+class PrimitiveCounter(Hittable):
+    """Counts the intersection tests, candidate hits and hit records of the wrapped primitive."""
+
+    primitive: Hittable
+    tests: int
+    hits: int
+    records: int
+
+    def __init__(self, primitive: Hittable):
+        self.primitive = primitive
+        self.tests = 0
+        self.hits = 0
+        self.records = 0
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        self.tests += 1
+        t, _ = self.primitive.intersect(r, t_min, t_max)
+        if t < t_max:
+            self.hits += 1
+        primitive: Hittable = self
+        return t, primitive
+
+    def surface(self, r: Ray, t: float) -> HitRecord:
+        self.records += 1
+        return self.primitive.surface(r, t)
+
+    def bounding_box(self) -> AABB:
+        return self.primitive.bounding_box()
+
+
+class LookupCounter(Texture):
+    """Counts the lookups of the wrapped texture."""
+
+    texture: Texture
+    count: int
+
+    def __init__(self, texture: Texture):
+        self.texture = texture
+        self.count = 0
+
+    def value(self, u: float, v: float, p: Point3) -> Color:
+        self.count += 1
+        return self.texture.value(u, v, p)
+
+    def filtered_value(self, u: float, v: float, p: Point3, footprint: float, stats: Optional[RenderStats]) -> Color:
+        self.count += 1
+        return self.texture.filtered_value(u, v, p, footprint, stats)
+
+    def needs_uv(self) -> bool:
+        return self.texture.needs_uv()
+
+
+class TouchRecorder(Hittable):
+    """Appends the index of the wrapped primitive to a shared log every time it is tested."""
+
+    primitive: Hittable
+    index: int
+    log: List[int]
+
+    def __init__(self, primitive: Hittable, index: int, log: List[int]):
+        self.primitive = primitive
+        self.index = index
+        self.log = log
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        self.log.append(self.index)
+        return self.primitive.intersect(r, t_min, t_max)
+
+    def bounding_box(self) -> AABB:
+        return self.primitive.bounding_box()
+
+
+def cache_hit_rate(log: List[int], lines: int) -> float:
+    # Direct-mapped cache of one primitive per line: a test hits if the previous primitive
+    # mapped to its line was the same one
+    cached = [-1 for _ in range(lines)]
+    hits = 0
+    for index in log:
+        line = index % lines
+        if cached[line] == index:
+            hits += 1
+        cached[line] = index
+    return hits / max(1, len(log))
+
+
+def checksum(b: Buffer) -> int:
+    # Position-dependent sum of the 8-bit pixel values, enough to tell two renders apart
+    pixels = to_bytes(b.rgb())
+    total = 0
+    for y in range(b.h):
+        for x in range(b.w):
+            k = 3 * (y * b.w + x)
+            for c in range(3):
+                total = (total * 31 + int(pixels[k + c]) + x + y) & 0xffffffff
+    return total
+
+
+def mean_color(b: Buffer) -> Color:
+    total = Color(0, 0, 0)
+    for y in range(b.h):
+        for x in range(b.w):
+            total += b.color(x, y)
+    return total / (b.w * b.h)
+
+
+def speedup(max_workers: int):
+    """Render the same scene with 1 to max_workers workers and print the speedup curve."""
+    world, camera = bouncing_spheres()
+
+    times: List[float] = []
+    identical = True
+    reference = 0
+
+    for workers in range(1, max_workers + 1):
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=200,
+            samples_per_pixel=10,
+            max_depth=10,
+            workers=workers,
+            verbose=False,
+        )
+
+        start = time()
+        image = tracer.render(world)
+        times.append(time() - start)
+
+        if workers == 1:
+            reference = checksum(image)
+        elif checksum(image) != reference:
+            identical = False
+
+        print(f"{workers} worker(s): {times[-1]:.2f}s", file=sys.stderr)
+
+    print("| Workers | Render time | Speedup | Efficiency |")
+    print("| ------: | ----------: | ------: | ---------: |")
+    for n, t in enumerate(times):
+        s = times[0] / t
+        print(f"| {n + 1:7d} | {t:10.2f}s | {s:6.2f}x | {100 * s / (n + 1):9.1f}% |")
+    print()
+    print(f"Identical images for every worker count: {'yes' if identical else 'NO'}")
+
+
+def bvh_strategies():
+    """Compare the BVH builders and layouts on every scene, in rays traced per second."""
+    print("| Scene                  | Layout | BVH    | Build  | Depth | Nodes | Leaves | SAH cost |   Rays/s |")
+    print("| ---------------------- | ------ | ------ | -----: | ----: | ----: | -----: | -------: | -------: |")
+
+    for name in scene_names:
+        world, camera = load_scene(name)
+
+        for layout, strategy in [("tree", "median"), ("tree", "sah"), ("flat", "median"), ("flat", "sah")]:
+            tracer = Tracer(
+                camera=camera,
+                aspect_ratio=16.0 / 9.0,
+                image_width=100,
+                samples_per_pixel=4,
+                max_depth=10,
+                verbose=False,
+                bvh_layout=layout,
+                bvh_strategy=strategy,
+                bvh_cache="off",
+            )
+
+            start = time()
+            bvh, stats = tracer.build_bvh(world)
+            build = time() - start
+
+            counter = RayCounter(bvh)
+
+            start = time()
+            tracer.render_tiles(counter)
+            rays_per_second = counter.count / (time() - start)
+
+            print(
+                f"| {name:22} | {layout:6} | {strategy:6} | {build:5.3f}s | {stats.depth:5d} | {stats.nodes:5d} | "
+                f"{stats.leaves:6d} | {stats.cost:8.2f} | {rays_per_second:8.0f} |"
+            )
+
+
+def wide_bvh(count: int):
+    """Compare the binary and 4-wide BVHs in node visits per ray and render time."""
+    print("| Scene                  | BVH          | Build  | Nodes/ray |  Render |   Rays/s |")
+    print("| ---------------------- | ------------ | -----: | --------: | ------: | -------: |")
+
+    scenes = [("bouncing_spheres", bouncing_spheres()), (f"sphere_field({count})", sphere_field(count))]
+    for name, scene in scenes:
+        world, camera = scene
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=4,
+            max_depth=10,
+            verbose=False,
+        )
+        # Node visits are counted by the stats of a second render
+        counting = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=4,
+            max_depth=10,
+            verbose=False,
+            stats=True,
+        )
+
+        for layout in ["binary", "wide", "wide-q8"]:
+            start = time()
+            flat, _ = FlatBVH.build(world, "sah", 4)
+            wide = WideBVH.from_flat(flat, layout == "wide-q8")
+            build = time() - start
+
+            bvh: Hittable = flat if layout == "binary" else wide
+            counter = RayCounter(bvh)
+
+            start = time()
+            tracer.render_tiles(counter)
+            render = time() - start
+
+            counting.ray_stats = RenderStats(counting.max_depth)
+            counting.stats_maps = Buffer(counting.image_width, counting.image_height)
+            counting.render_tiles(bvh)
+            visits = counting.ray_stats.node_visits
+            print(
+                f"| {name:22} | {layout:12} | {build:5.2f}s | {visits / counter.count:9.2f} | "
+                f"{render:6.2f}s | {counter.count / render:8.0f} |"
+            )
+
+
+def build_time(count: int, workers: int):
+    """Compare the BVH build times of the object tree and array builders."""
+    start = time()
+    world, _ = sphere_field(count)
+    print(f"Scene with {len(world.objects)} spheres generated in {time() - start:.2f}s")
+    print()
+    print("| Builder                | BVH    | Workers |   Build |")
+    print("| ---------------------- | ------ | ------: | ------: |")
+
+    for strategy in ["median", "sah"]:
+        start = time()
+        BVHNode.from_list(world, strategy, 4)
+        print(f"| {'objects (tree)':22} | {strategy:6} | {1:7d} | {time() - start:6.2f}s |")
+
+        for n in [1, workers]:
+            start = time()
+            FlatBVH.build(world, strategy, 4, n)
+            print(f"| {'arrays (flat)':22} | {strategy:6} | {n:7d} | {time() - start:6.2f}s |")
+
+
+def cache(count: int):
+    """Compare building a BVH with loading it from the cache file, and reusing it in memory."""
+    start = time()
+    world, _ = sphere_field(count)
+    print(f"Scene with {len(world.objects)} spheres generated in {time() - start:.2f}s")
+    print()
+    print("| BVH                    |    Time |")
+    print("| ---------------------- | ------: |")
+
+    start = time()
+    scene_key(world, "sah", 4, False)
+    print(f"| {'scene hash':22} | {time() - start:6.2f}s |")
+
+    start = time()
+    FlatBVH.build(world, "sah", 4)
+    print(f"| {'build':22} | {time() - start:6.2f}s |")
+
+    # The first one builds and writes the cache file if it does not exist yet
+    for step in ["build or load + save", "load cache file", "reuse in memory"]:
+        if step != "reuse in memory":
+            memo.clear()
+        start = time()
+        cached_build(world, "sah", 4, 1, True)
+        print(f"| {step:22} | {time() - start:6.2f}s |")
+
+
+def write_sphere_field(path: str, count: int, seed: int = 0):
+    """Write the scene of scenes.sphere_field to a text scene file."""
+    rng = Rng(seed)
+    half_size = 0.5 * sqrt(count)
+    with open(path, "w") as f:
+        f.write(f"camera vfov 40 lookfrom {half_size + 4} 6 {half_size + 4} lookat 0 0 0 vup 0 1 0 defocus_angle 0\n")
+        f.write("texture green solid 0.2 0.3 0.1\n")
+        f.write("texture white solid 0.9 0.9 0.9\n")
+        f.write("texture checker checker 0.32 green white\n")
+        f.write("material ground lambertian checker\n")
+        f.write("sphere ground 0 -1000 0 1000\n")
+
+        # Same draws as sphere_field
+        for i in range(12):
+            c = Color.random(rng) * Color.random(rng)
+            f.write(f"material m{i} lambertian {c.x} {c.y} {c.z}\n")
+        for i in range(12, 16):
+            c = Color.random(rng, 0.5, 1)
+            f.write(f"material m{i} metal {c.x} {c.y} {c.z} {rng.uniform(0, 0.3)}\n")
+
+        for _ in range(count):
+            x, y, z = rng.uniform(-half_size, half_size), rng.uniform(0.2, 3.0), rng.uniform(-half_size, half_size)
+            f.write(f"sphere m{rng.randrange(16)} {x} {y} {z} 0.2\n")
+
+
+def scene_file(count: int):
+    """Compare building a sphere field in code, and loading it from text and binary scene files."""
+    text_path = f"{cache_dir}/sphere_field_{count}.scene"
+    binary_path = f"{cache_dir}/sphere_field_{count}.rtowscene"
+    os.system(f"mkdir -p {cache_dir}")
+    write_sphere_field(text_path, count)
+
+    print("| Scene                  |    Time |   Spheres/s |")
+    print("| ---------------------- | ------: | ----------: |")
+
+    start = time()
+    world, _ = sphere_field(count)
+    elapsed = time() - start
+    print(f"| {'sphere_field()':22} | {elapsed:6.2f}s | {count / elapsed:11.0f} |")
+
+    start = time()
+    scene = read_text(text_path)
+    elapsed = time() - start
+    print(f"| {'parse text':22} | {elapsed:6.2f}s | {count / elapsed:11.0f} |")
+
+    scene.save_binary(binary_path)
+    start = time()
+    scene = read_binary(binary_path)
+    elapsed = time() - start
+    print(f"| {'map binary':22} | {elapsed:6.2f}s | {count / elapsed:11.0f} |")
+
+    start = time()
+    loaded = scene.world()
+    elapsed = time() - start
+    print(f"| {'create spheres':22} | {elapsed:6.2f}s | {count / elapsed:11.0f} |")
+
+    same = scene_key(world, "sah", 4, False) == scene_key(loaded, "sah", 4, False)
+    print()
+    print(f"Same spheres as sphere_field(): {same}")
+
+
+def rng(count: int):
+    """Compare the draws per second of the random module's generator and of Rng."""
+    print("| Generator              |   Time |     Draws/s |")
+    print("| ---------------------- | -----: | ----------: |")
+
+    gen = Random(1)
+    total = 0.0
+    start = time()
+    for _ in range(count):
+        total += gen.random()
+    elapsed = time() - start
+    print(f"| {'random.Random':22} | {elapsed:5.2f}s | {count / elapsed:11.0f} |")
+
+    r = Rng(1)
+    total = 0.0
+    start = time()
+    for _ in range(count):
+        total += r.random()
+    elapsed = time() - start
+    print(f"| {'Rng':22} | {elapsed:5.2f}s | {count / elapsed:11.0f} |")
+
+
+def rmse(a: Buffer, b: Buffer) -> float:
+    total = 0.0
+    for y in range(a.h):
+        for x in range(a.w):
+            d = a.color(x, y) - b.color(x, y)
+            total += d.dot(d) / 3
+    return sqrt(total / (a.w * a.h))
+
+
+def render_with_sampler(world: HittableList, camera: Camera, sampler: str, samples_per_pixel: int, seed: int, image_width: int = 64) -> Buffer:
+    tracer = Tracer(
+        camera=camera,
+        aspect_ratio=16.0 / 9.0,
+        image_width=image_width,
+        samples_per_pixel=samples_per_pixel,
+        max_depth=10,
+        verbose=False,
+        sampler=sampler,
+        seed=seed,
+    )
+    bvh, _ = tracer.build_bvh(world)
+    return tracer.render_tiles(bvh)
+
+
+def samplers(name: str, max_samples: int):
+    """
+    Compare the RMS error of the samplers against a reference rendered with 4 times the samples,
+    for 1 to max_samples samples per pixel, and the samples each sampler needs to be as close as
+    the independent sampler with max_samples.
+    """
+
+    world, camera = load_scene(name)
+    # Another seed for the reference, so that its samples are not the same as the renders'
+    reference = render_with_sampler(world, camera, "sobol", 4 * max_samples, 2)
+
+    counts: List[int] = []
+    n = 1
+    while n <= max_samples:
+        counts.append(n)
+        n *= 2
+
+    header = "".join(f" {f'{n} spp':>9} |" for n in counts)
+    print(f"| Sampler     |{header} Same error at |")
+    print(f"| ----------- |{' --------: |' * len(counts)} ------------: |")
+
+    target = 0.0
+    for sampler in sampler_names:
+        errors = [rmse(render_with_sampler(world, camera, sampler, n, 1), reference) for n in counts]
+        if sampler == "independent":
+            target = errors[-1]
+        same = "-"
+        for n, error in zip(counts, errors):
+            if error <= target:
+                same = f"{n} spp"
+                break
+        row = "".join(f" {error:9.5f} |" for error in errors)
+        print(f"| {sampler:11} |{row} {same:>13} |")
+
+
+def trilinear(kernel: List[List[List[Vec3]]], dx: float, dy: float, dz: float) -> float:
+    # Hermite cubic smoothing
+    dx_h = dx * dx * (3 - 2 * dx)
+    dy_h = dy * dy * (3 - 2 * dy)
+    dz_h = dz * dz * (3 - 2 * dz)
+
+    accu = 0.0
+    for i in range(2):
+        for j in range(2):
+            for k in range(2):
+                weight_v = Vec3(dx - i, dy - j, dz - k)
+                accu += (
+                    (i * dx_h + (1 - i) * (1 - dx_h)) *
+                    (j * dy_h + (1 - j) * (1 - dy_h)) *
+                    (k * dz_h + (1 - k) * (1 - dz_h)) *
+                    kernel[i][j][k].dot(weight_v)
+                )
+    return accu
+
+
+def book_noise(perlin: Perlin, randvec: List[Vec3], p: Point3) -> float:
+    """Perlin.noise as written in the book, with nested lists of Vec3."""
+    xx, dx = divmod(p.x, 1)
+    yy, dy = divmod(p.y, 1)
+    zz, dz = divmod(p.z, 1)
+
+    kernel = [
+        [
+            [
+                randvec[
+                    perlin.perm_x[int(xx + i) & 255] ^
+                    perlin.perm_y[int(yy + j) & 255] ^
+                    perlin.perm_z[int(zz + k) & 255]
+                ]
+                for k in range(2)
+            ]
+            for j in range(2)
+        ]
+        for i in range(2)
+    ]
+
+    return trilinear(kernel, dx, dy, dz)
+
+
+def perlin(count: int):
+    """Compare the noise lookups per second of the book's Perlin noise and of the flat one."""
+    noise = Perlin()
+    g = noise.gradients
+    randvec = [Vec3(g[3 * n], g[3 * n + 1], g[3 * n + 2]) for n in range(len(g) // 3)]
+
+    # Points spread over many lattice cells, on both sides of 0
+    points: List[float] = []
+    for n in range(count):
+        points.extend([0.37 * n % 97 - 48.5, 0.59 * n % 89 - 44.5, 0.23 * n % 83 - 41.5])
+    vectors = [Point3(points[3 * n], points[3 * n + 1], points[3 * n + 2]) for n in range(count)]
+
+    print("| Perlin noise           |   Time |   Lookups/s |")
+    print("| ---------------------- | -----: | ----------: |")
+
+    start = time()
+    reference = [book_noise(noise, randvec, p) for p in vectors]
+    elapsed = time() - start
+    print(f"| {'book':22} | {elapsed:5.2f}s | {count / elapsed:11.0f} |")
+
+    start = time()
+    values = [noise.noise(p) for p in vectors]
+    elapsed = time() - start
+    print(f"| {'flat':22} | {elapsed:5.2f}s | {count / elapsed:11.0f} |")
+
+    start = time()
+    batch = noise.noise_batch(points)
+    elapsed = time() - start
+    print(f"| {'flat, batch':22} | {elapsed:5.2f}s | {count / elapsed:11.0f} |")
+
+    print()
+    print(f"Same values: {'yes' if values == reference and batch == reference else 'NO'}")
+
+
+def texture(image_filename: str):
+    """Compare loading a texture by decoding its image, and from its cache file."""
+    os.system(f"rm -f {image_filename}.rtowtex")
+
+    print("| Texture load           |   Time |")
+    print("| ---------------------- | -----: |")
+
+    start = time()
+    image = Image(image_filename)
+    print(f"| {'decode + save cache':22} | {time() - start:5.3f}s |")
+
+    start = time()
+    image = Image(image_filename)
+    print(f"| {'cache file':22} | {time() - start:5.3f}s |")
+
+    size = len(image.texels)
+    print()
+    print(f"{image.width} x {image.height} texels, {size / 1e6:.1f} MB (3 bytes per texel)")
+
+
+def texture_error(image: Image, mip: MipTexture, texels: int, filtered: bool) -> float:
+    """
+    RMS error of lookups at a random point of pixels covering texels x texels texels each,
+    against the mean of the texels of the pixel.
+    """
+
+    rng = Rng(0)
+    total = 0.0
+    count = 0
+    for y in range(image.height // texels):
+        for x in range(image.width // texels):
+            reference = Color(0, 0, 0)
+            for j in range(texels):
+                for i in range(texels):
+                    reference += image[x * texels + i, y * texels + j]
+            reference = reference / (texels * texels)
+
+            u = (x + rng.random()) * texels / image.width
+            v = (y + rng.random()) * texels / image.height
+            if filtered:
+                c = mip.lookup(u, v, texels / image.height)
+            else:
+                c = image[int(u * image.width), int(v * image.height)]
+
+            d = c - reference
+            total += d.dot(d) / 3
+            count += 1
+    return sqrt(total / count)
+
+
+def mipmap(image_filename: str):
+    """
+    Compare unfiltered and mipmapped lookups of a minified texture in error and render time,
+    and the tile cache of the mip pyramid for several cache sizes.
+    """
+
+    os.system(f"rm -f {image_filename}.rtowmip")
+    start = time()
+    mip = MipTexture(image_filename)
+    print(f"Mip pyramid built in {time() - start:.3f}s, {len(mip.widths)} levels, {len(mip.tiles) / 1e6:.1f} MB")
+    print()
+
+    image = Image(image_filename)
+    print("| Texels per pixel | Nearest RMSE | Mipmapped RMSE |")
+    print("| ---------------: | -----------: | -------------: |")
+    for texels in [1, 2, 4, 8, 16]:
+        nearest = texture_error(image, mip, texels, False)
+        filtered = texture_error(image, mip, texels, True)
+        print(f"| {texels:>16} | {nearest:12.4f} | {filtered:14.4f} |")
+
+    print()
+    print("| Earth render           |  Render |")
+    print("| ---------------------- | ------: |")
+    for name, use_mipmap in [("nearest texel", False), ("mipmapped", True)]:
+        world, camera = earth(use_mipmap)
+        start = time()
+        render_with_sampler(world, camera, "independent", 16, 0)
+        print(f"| {name:22} | {time() - start:6.2f}s |")
+
+    print()
+    print("| Cache size | Lookups | Tile hits |  Misses | Evictions | Hit rate |")
+    print("| ---------: | ------: | --------: | ------: | --------: | -------: |")
+    _, camera = earth(False)
+    for tiles in [4, 16, 64, 1024]:
+        texture = MipmapTexture(image_filename, tiles * 8 * tile_bytes)
+        counter = LookupCounter(texture)
+        world = HittableList()
+        world.add(Sphere(2, Lambertian(counter), Point3(0, 0, 0)))
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=400,
+            samples_per_pixel=1,
+            max_depth=10,
+            verbose=False,
+            stats=True,
+        )
+        tracer.render(world)
+        stats = tracer.ray_stats
+        rate = stats.texture_hits / max(1, stats.texture_hits + stats.texture_misses)
+        print(
+            f"| {tiles:4} tiles | {counter.count:7} | {stats.texture_hits:9} | {stats.texture_misses:7} | "
+            f"{stats.texture_evictions:9} | {100 * rate:7.2f}% |"
+        )
+
+
+def book_gamma_8bit(linear: float) -> UInt[8]:
+    linear = sqrt(linear) if linear > 0 else 0
+    return UInt[8](256 * Interval(0.000, 0.999).clamp(linear))
+
+
+def book_save_ppm(b: Buffer, path: str) -> List[UInt[8]]:
+    """The book's output: a square root per channel, then one line of text per pixel (P3)."""
+    colors = [[b.color(x, y) for x in range(b.w)] for y in range(b.h)]
+    raw = [[(book_gamma_8bit(c.x), book_gamma_8bit(c.y), book_gamma_8bit(c.z)) for c in row] for row in colors]
+    with open(path, "w") as f:
+        f.write("P3\n")
+        f.write(f"{b.w} {b.h} 255\n")
+        for row in raw:
+            for pixel in row:
+                f.write(" ".join(str(c) for c in pixel) + "\n")
+    return [c for row in raw for pixel in row for c in pixel]
+
+
+def output(width: int):
+    """Compare the time and size of the book's text PPM and of the output formats."""
+    height = width * 9 // 16
+    b = Buffer(width, height)
+    for y in range(height):
+        for x in range(width):
+            # Smooth gradients with some values over 1, like the sky and highlights of a render
+            t = x / width
+            b.add(x, y, Color(1.5 * t * t, 0.7 * y / height, 0.25 + 0.5 * ((x // 16 + y // 16) % 2) * t), 1)
+
+    os.system("mkdir -p renders")
+    print("| Output                 |    Time |     Size |")
+    print("| ---------------------- | ------: | -------: |")
+
+    path = "renders/output_book.ppm"
+    start = time()
+    book = book_save_ppm(b, path)
+    print(f"| {'book (P3 text)':22} | {time() - start:6.2f}s | {BinaryReader(path).size() / 1e6:6.2f}MB |")
+
+    for format in image_formats:
+        start = time()
+        b.save("output", format)
+        print(f"| {format:22} | {time() - start:6.2f}s | {BinaryReader(f'renders/output.{format}').size() / 1e6:6.2f}MB |")
+
+    different = 0
+    for x, y in zip(book, to_bytes(b.rgb())):
+        if int(x) != int(y):
+            different += 1
+    print()
+    print(f"{width} x {height} pixels, bytes different from the book's gamma: {different}")
+
+
+def roulette(name: str, samples_per_pixel: int):
+    """
+    Compare the recursive and iterative integrators, with and without Russian roulette, in
+    render time, rays per camera ray and mean color of the image, which must not change.
+    """
+
+    world, camera = load_scene(name)
+
+    print("| Integrator             |  Render | Rays/path | Mean R | Mean G | Mean B |")
+    print("| ---------------------- | ------: | --------: | -----: | -----: | -----: |")
+
+    reference = 0
+    identical = True
+    for integrator, roulette_depth in [("recursive", 0), ("iterative", 0), ("iterative", 5), ("iterative", 3)]:
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=samples_per_pixel,
+            max_depth=50,
+            verbose=False,
+            integrator=integrator,
+            roulette_depth=roulette_depth,
+        )
+        bvh, _ = tracer.build_bvh(world)
+        counter = RayCounter(bvh)
+
+        start = time()
+        image = tracer.render_tiles(counter)
+        render = time() - start
+
+        label = integrator if roulette_depth == 0 else f"{integrator}, roulette {roulette_depth}"
+        paths = tracer.image_width * tracer.image_height * samples_per_pixel
+        mean = mean_color(image)
+        print(
+            f"| {label:22} | {render:6.2f}s | {counter.count / paths:9.2f} | "
+            f"{mean.x:6.4f} | {mean.y:6.4f} | {mean.z:6.4f} |"
+        )
+
+        if integrator == "recursive":
+            reference = checksum(image)
+        elif roulette_depth == 0 and checksum(image) != reference:
+            identical = False
+
+    print()
+    print(f"Same image with both integrators without roulette: {'yes' if identical else 'NO'}")
+
+
+def wavefront(name: str, samples_per_pixel: int):
+    """
+    Compare the depth-first integrators with the wavefront one in rays traced per second, and
+    in locality of the primitives tested by consecutive rays: the rate of hits of a small
+    simulated cache of primitives, fed with every primitive test in order.
+    """
+
+    world, camera = load_scene(name)
+    log: List[int] = []
+    recorders: List[Hittable] = [TouchRecorder(o, k, log) for k, o in enumerate(world.objects)]
+    recorded = HittableList(recorders)
+
+    print("| Integrator             |  Render |   Rays/s | Tests/ray | Cache 64 | Cache 256 | Mean R | Mean G | Mean B |")
+    print("| ---------------------- | ------: | -------: | --------: | -------: | --------: | -----: | -----: | -----: |")
+
+    for integrator in ["recursive", "iterative", "wavefront"]:
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=samples_per_pixel,
+            max_depth=50,
+            workers=1,
+            verbose=False,
+            bvh_cache="off",
+            integrator=integrator,
+        )
+        bvh, _ = tracer.build_bvh(recorded)
+        counter = RayCounter(bvh)
+        log.clear()
+
+        start = time()
+        image = tracer.render_tiles(counter)
+        render = time() - start
+
+        mean = mean_color(image)
+        print(
+            f"| {integrator:22} | {render:6.2f}s | {counter.count / render:8.0f} | "
+            f"{len(log) / counter.count:9.2f} | {100 * cache_hit_rate(log, 64):7.1f}% | "
+            f"{100 * cache_hit_rate(log, 256):8.1f}% | {mean.x:6.4f} | {mean.y:6.4f} | {mean.z:6.4f} |"
+        )
+
+
+def ray_stats(name: str, samples_per_pixel: int):
+    """
+    Render with and without stats for every BVH layout: the cost of counting, and the work
+    done per ray, which does not depend on the machine.
+    """
+
+    world, camera = load_scene(name)
+
+    print("| Layout          |  Render | With stats | Nodes/ray | Boxes/ray | Spheres/ray | Rays/path |")
+    print("| --------------- | ------: | ---------: | --------: | --------: | ----------: | --------: |")
+
+    for layout, packed in [("tree", False), ("flat", False), ("flat", True), ("wide", False), ("wide", True)]:
+        times: List[float] = []
+        for stats in [False, True]:
+            tracer = Tracer(
+                camera=camera,
+                aspect_ratio=16.0 / 9.0,
+                image_width=100,
+                samples_per_pixel=samples_per_pixel,
+                max_depth=50,
+                verbose=False,
+                bvh_layout=layout,
+                bvh_strategy="sah",
+                bvh_packed=packed,
+                stats=stats,
+            )
+            start = time()
+            tracer.render(world)
+            times.append(time() - start)
+
+        s = tracer.ray_stats
+        rays = max(1, s.rays)
+        label = f"{layout}, packed" if packed else layout
+        print(
+            f"| {label:15} | {times[0]:6.2f}s | {times[1]:9.2f}s | {s.node_visits / rays:9.2f} | "
+            f"{s.box_tests / rays:9.2f} | {s.primitive_tests / rays:11.2f} | {s.rays / max(1, s.camera_rays):9.2f} |"
+        )
+
+
+def deferred(count: int):
+    """
+    Count the primitive tests, candidate hits and hit records built per ray, and measure the
+    time per ray. Before hit records were deferred, every candidate hit built a record.
+    """
+
+    print("| Scene                  | Tests/ray | Hits/ray | Records/ray | Time/ray |")
+    print("| ---------------------- | --------: | -------: | ----------: | -------: |")
+
+    scenes = [("bouncing_spheres", bouncing_spheres()), (f"sphere_field({count})", sphere_field(count))]
+    for name, scene in scenes:
+        world, camera = scene
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=4,
+            max_depth=10,
+            verbose=False,
+            bvh_cache="off",
+        )
+
+        counters = [PrimitiveCounter(o) for o in world.objects]
+        counted = HittableList()
+        for c in counters:
+            counted.add(c)
+        bvh, _ = tracer.build_bvh(counted)
+        counter = RayCounter(bvh)
+        tracer.render_tiles(counter)
+
+        tests, hits, records = 0, 0, 0
+        for c in counters:
+            tests, hits, records = tests + c.tests, hits + c.hits, records + c.records
+
+        bvh, _ = tracer.build_bvh(world)
+        rays = RayCounter(bvh)
+        start = time()
+        tracer.render_tiles(rays)
+        per_ray = (time() - start) / rays.count
+
+        n = counter.count
+        print(
+            f"| {name:22} | {tests / n:9.2f} | {hits / n:8.2f} | {records / n:11.2f} | "
+            f"{1e6 * per_ray:6.2f}us |"
+        )
+
+
+def packed(count: int):
+    """Compare BVH leaves of single spheres with leaves packed in SphereSets, on a sphere field."""
+    world, camera = sphere_field(count)
+
+    print("| BVH                    | Leaves | Build  |  Render |   Rays/s | Same image |")
+    print("| ---------------------- | -----: | -----: | ------: | -------: | ---------- |")
+
+    reference = 0
+    configs = [("flat", False, 4), ("flat", True, 4), ("flat", True, 8), ("flat", True, 16), ("wide", True, 8)]
+    for layout, packed, leaf_size in configs:
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=4,
+            max_depth=10,
+            verbose=False,
+            bvh_layout=layout,
+            bvh_strategy="sah",
+            bvh_leaf_size=leaf_size,
+            bvh_packed=packed,
+            bvh_cache="off",
+        )
+
+        start = time()
+        bvh, stats = tracer.build_bvh(world)
+        build = time() - start
+
+        counter = RayCounter(bvh)
+        start = time()
+        image = tracer.render_tiles(counter)
+        render = time() - start
+
+        if reference == 0:
+            reference = checksum(image)
+        label = f"{layout}, " + (f"packed {leaf_size}" if packed else f"leaves <= {leaf_size}")
+        same = "yes" if checksum(image) == reference else "NO"
+        print(
+            f"| {label:22} | {stats.leaves:6d} | {build:5.2f}s | {render:6.2f}s | "
+            f"{counter.count / render:8.0f} | {same:10} |"
+        )
+
+
+# <python-only>
+def framebuffer(width: int):
+    """
+    Measure the memory per pixel of the book's buffer (a list of rows of Color, and a list of
+    sample counts) and of Buffer, extrapolated to a 4K image.
+    """
+    import tracemalloc
+
+    height = width * 9 // 16
+    pixels = width * height
+
+    print("| Framebuffer            | Bytes/pixel |    4K image |")
+    print("| ---------------------- | ----------: | ----------: |")
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    rows = [[Color(x, y, 0.5) for x in range(width)] for y in range(height)]
+    samples = [x + y for y in range(height) for x in range(width)]
+    size = (tracemalloc.get_traced_memory()[0] - start) / pixels
+    print(f"| {'book (rows of Color)':22} | {size:11.1f} | {size * 3840 * 2160 / 1e6:8.0f} MB |")
+    del rows, samples
+
+    start = tracemalloc.get_traced_memory()[0]
+    b = Buffer(width, height)
+    for y in range(height):
+        for x in range(width):
+            b.add(x, y, Color(x, y, 0.5), x + y)
+    size = (tracemalloc.get_traced_memory()[0] - start) / pixels
+    print(f"| {'Buffer':22} | {size:11.1f} | {size * 3840 * 2160 / 1e6:8.0f} MB |")
+    tracemalloc.stop()
+
+
+def out_of_core_run(width: int, variant: str, results):
+    """Fill a buffer tile by tile then save it, and report the growth of the peak resident memory."""
+    import resource
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    height = width * 9 // 16
+    path = "renders/out_of_core.rtowfb"
+    b = MappedBuffer(path, width, height) if variant == "MappedBuffer" else Buffer(width, height)
+
+    start = time()
+    for tile in make_tiles(width, height, 32, 0):
+        pixels: List[float] = []
+        for y in range(tile.y0, tile.y1):
+            for x in range(tile.x0, tile.x1):
+                t = x / width
+                pixels.extend([1.5 * t * t, 0.7 * y / height, 0.25 + 0.5 * ((x // 16 + y // 16) % 2) * t, 1.0])
+        b.paste(tile, pixels)
+    fill = time() - start
+
+    start = time()
+    if variant == "Buffer, encoded at once":
+        save_image("renders/out_of_core.png", width, height, b.rgb())
+    else:
+        b.save("out_of_core", "png")
+    save = time() - start
+
+    # Kilobytes on Linux
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 1024
+    if variant == "MappedBuffer":
+        b.close()
+        os.remove(path)
+    results.put((fill, save, peak))
+
+
+def out_of_core(width: int):
+    """
+    Compare the peak resident memory of rendering tiles into a Buffer and a MappedBuffer then
+    saving them as PNG, each in a new process.
+    """
+    import multiprocessing
+
+    os.system("mkdir -p renders")
+    height = width * 9 // 16
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    print(f"{width} x {height} pixels, tiles of 32 x 32")
+    print()
+    print("| Framebuffer             |   Tiles |    Save | Peak memory |")
+    print("| ----------------------- | ------: | ------: | ----------: |")
+    for variant in ["Buffer, encoded at once", "Buffer", "MappedBuffer"]:
+        process = context.Process(target=out_of_core_run, args=(width, variant, results))
+        process.start()
+        fill, save, peak = results.get()
+        process.join()
+        print(f"| {variant:23} | {fill:6.2f}s | {save:6.2f}s | {peak:8.0f} MB |")
+
+
+def numpy_backend(name: str, samples_per_pixel: int):
+    """
+    Compare the scalar and NumPy backends in render time and mean color of the image, and
+    give the RMS difference of their pixels (both are noisy, it shrinks with the samples).
+    """
+
+    world, camera = load_scene(name)
+
+    print("| Backend |  Render | Mean R | Mean G | Mean B |")
+    print("| ------- | ------: | -----: | -----: | -----: |")
+
+    images: List[Buffer] = []
+    for backend in ["scalar", "numpy"]:
+        tracer = Tracer(
+            camera=camera,
+            aspect_ratio=16.0 / 9.0,
+            image_width=100,
+            samples_per_pixel=samples_per_pixel,
+            max_depth=50,
+            verbose=False,
+            bvh_cache="memory",
+            backend=backend,
+        )
+
+        start = time()
+        image = tracer.render(world)
+        render = time() - start
+        images.append(image)
+
+        mean = mean_color(image)
+        print(f"| {backend:7} | {render:6.2f}s | {mean.x:6.4f} | {mean.y:6.4f} | {mean.z:6.4f} |")
+
+    print()
+    print(f"RMS difference per channel: {rmse(images[0], images[1]):.4f}")
+# </python-only>
+
+
+if __name__ == "__main__":
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else "speedup"
+
+    if benchmark == "speedup":
+        speedup(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    elif benchmark == "bvh":
+        bvh_strategies()
+    elif benchmark == "build":
+        build_time(
+            int(sys.argv[2]) if len(sys.argv) > 2 else 1000000,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+        )
+    elif benchmark == "wide":
+        wide_bvh(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    elif benchmark == "scene_file":
+        scene_file(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif benchmark == "rng":
+        rng(int(sys.argv[2]) if len(sys.argv) > 2 else 10000000)
+    elif benchmark == "samplers":
+        samplers(
+            sys.argv[2] if len(sys.argv) > 2 else "bouncing_spheres",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 64,
+        )
+    elif benchmark == "perlin":
+        perlin(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    elif benchmark == "texture":
+        texture(sys.argv[2] if len(sys.argv) > 2 else "images/earthmap.jpg")
+    elif benchmark == "mipmap":
+        mipmap(sys.argv[2] if len(sys.argv) > 2 else "images/earthmap.jpg")
+    elif benchmark == "output":
+        output(int(sys.argv[2]) if len(sys.argv) > 2 else 1920)
+    elif benchmark == "roulette":
+        roulette(
+            sys.argv[2] if len(sys.argv) > 2 else "bouncing_spheres",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+        )
+    elif benchmark == "wavefront":
+        wavefront(
+            sys.argv[2] if len(sys.argv) > 2 else "bouncing_spheres",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+        )
+    elif benchmark == "stats":
+        ray_stats(
+            sys.argv[2] if len(sys.argv) > 2 else "bouncing_spheres",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+        )
+    elif benchmark == "deferred":
+        deferred(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    elif benchmark == "packed":
+        packed(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif benchmark == "cache":
+        cache(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    # <python-only>
+    elif benchmark == "framebuffer":
+        framebuffer(int(sys.argv[2]) if len(sys.argv) > 2 else 640)
+    elif benchmark == "out_of_core":
+        out_of_core(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    elif benchmark == "numpy":
+        numpy_backend(
+            sys.argv[2] if len(sys.argv) > 2 else "bouncing_spheres",
+            int(sys.argv[3]) if len(sys.argv) > 3 else 16,
+        )
+    # </python-only>
+    else:
+        print(f"Unknown benchmark: {benchmark}")
@@ -0,0 +1,197 @@
+from typing import List
+
+# <python-only>
+import mmap
+from array import array
+# </python-only>
+
+
+# Not in book: reading and writing flat arrays of 64-bit ints and floats, and of bytes, to
+# binary files.
+# Values are stored in the machine's byte order, files are caches that are not meant to be
+# moved to another machine.
+
+
+class BinaryWriter:
+    path: str
+    # <codon-only>
+    f: File
+    # </codon-only>
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, "wb")
+
+    def write_magic(self, magic: str):
+        # Magic strings are padded to 8 bytes so that the arrays after them stay aligned
+        assert len(magic) == 8, "Magic strings are 8 characters long"
+        # <python-only>
+        self.f.write(magic.encode("latin-1"))
+        # </python-only>
+        # <codon-only>
+        self.f.write(magic)
+        # </codon-only>
+
+    def write_ints(self, values: List[int]):
+        # <python-only>
+        array("q", values).tofile(self.f)
+        # </python-only>
+        # <codon-only>
+        self.f.write(str(values.arr.ptr.as_byte(), 8 * len(values)))
+        # </codon-only>
+
+    def write_floats(self, values: List[float]):
+        # <python-only>
+        array("d", values).tofile(self.f)
+        # </python-only>
+        # <codon-only>
+        self.f.write(str(values.arr.ptr.as_byte(), 8 * len(values)))
+        # </codon-only>
+
+    def write_floats32(self, values: List[float]):
+        # Not aligned with the other arrays, for file formats that store 32-bit floats
+        # <python-only>
+        array("f", values).tofile(self.f)
+        # </python-only>
+        # <codon-only>
+        singles = [float32(v) for v in values]
+        self.f.write(str(singles.arr.ptr.as_byte(), 4 * len(singles)))
+        # </codon-only>
+
+    def write_singles(self, values: List[float32]):
+        # Same, for arrays that already are 32-bit floats (not aligned either)
+        # <python-only>
+        array("f", values).tofile(self.f)
+        # </python-only>
+        # <codon-only>
+        self.f.write(str(values.arr.ptr.as_byte(), 4 * len(values)))
+        # </codon-only>
+
+    def write_bytes(self, values: List[UInt[8]]):
+        # <python-only>
+        array("B", values).tofile(self.f)
+        # </python-only>
+        # <codon-only>
+        self.f.write(str(values.arr.ptr.as_byte(), len(values)))
+        # </codon-only>
+
+    def write_string(self, value: str):
+        # Length first, then the characters padded to a multiple of 8 bytes to keep alignment
+        # <python-only>
+        data = value.encode("utf-8")
+        self.write_ints([len(data)])
+        self.f.write(data + b"\0" * ((8 - len(data) % 8) % 8))
+        # </python-only>
+        # <codon-only>
+        self.write_ints([len(value)])
+        self.f.write(value + "\0" * ((8 - len(value) % 8) % 8))
+        # </codon-only>
+
+    def seek(self, offset: int):
+        # Position of the next write, in bytes from the start of the file
+        self.f.seek(offset, 0)
+
+    def close(self):
+        self.f.close()
+
+
+class BinaryReader:
+    """
+    Reads arrays in place from a memory-mapped file: the arrays returned are views of the
+    file, not copies. Codon has no mmap module, there the file is read in one block and the
+    arrays are views of that block.
+    """
+
+    path: str
+    data: str
+    offset: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+        # <python-only>
+        with open(path, "rb") as f:
+            # Empty files can't be mapped
+            empty = f.seek(0, 2) == 0
+            self.data = b"" if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # </python-only>
+        # <codon-only>
+        with open(path, "rb") as f:
+            self.data = f.read()
+        # </codon-only>
+
+    def size(self) -> int:
+        return len(self.data)
+
+    def read_magic(self) -> str:
+        # <python-only>
+        magic = self.data[self.offset:self.offset + 8].decode("latin-1")
+        # </python-only>
+        # <codon-only>
+        magic = self.data[self.offset:self.offset + 8]
+        # </codon-only>
+        self.offset += 8
+        return magic
+
+    def read_ints(self, n: int) -> List[int]:
+        start = self.offset
+        self.offset += 8 * n
+        assert self.offset <= len(self.data), f"Truncated file: {self.path}"
+
+        # <python-only>
+        return memoryview(self.data)[start:self.offset].cast("q")
+        # </python-only>
+        # <codon-only>
+        return List[int](Array[int](Ptr[int]((self.data.ptr + start).as_byte()), n), n)
+        # </codon-only>
+
+    def read_floats(self, n: int) -> List[float]:
+        start = self.offset
+        self.offset += 8 * n
+        assert self.offset <= len(self.data), f"Truncated file: {self.path}"
+
+        # <python-only>
+        return memoryview(self.data)[start:self.offset].cast("d")
+        # </python-only>
+        # <codon-only>
+        return List[float](Array[float](Ptr[float]((self.data.ptr + start).as_byte()), n), n)
+        # </codon-only>
+
+    def read_string(self) -> str:
+        n = self.read_ints(1)[0]
+        start = self.offset
+        self.offset += n + (8 - n % 8) % 8
+        assert self.offset <= len(self.data), f"Truncated file: {self.path}"
+
+        # <python-only>
+        return bytes(self.data[start:start + n]).decode("utf-8")
+        # </python-only>
+        # <codon-only>
+        return self.data[start:start + n]
+        # </codon-only>
+
+    def read_floats32(self, n: int) -> List[float32]:
+        start = self.offset
+        self.offset += 4 * n
+        assert self.offset <= len(self.data), f"Truncated file: {self.path}"
+
+        # <python-only>
+        return memoryview(self.data)[start:self.offset].cast("f")
+        # </python-only>
+        # <codon-only>
+        return List[float32](Array[float32](Ptr[float32]((self.data.ptr + start).as_byte()), n), n)
+        # </codon-only>
+
+    def read_bytes(self, n: int) -> List[UInt[8]]:
+        # Bytes are read last, the arrays after them would not be aligned
+        start = self.offset
+        self.offset += n
+        assert self.offset <= len(self.data), f"Truncated file: {self.path}"
+
+        # <python-only>
+        return memoryview(self.data)[start:self.offset]
+        # </python-only>
+        # <codon-only>
+        return List[UInt[8]](Array[UInt[8]](Ptr[UInt[8]]((self.data.ptr + start).as_byte()), n), n)
+        # </codon-only>
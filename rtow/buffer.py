@@ -1,58 +1,171 @@
-from math import sqrt
-from typing import List, Tuple
+import os
+from typing import List
 
-from .ppm import save
-from .interval import Interval
+# <python-only>
+from array import array
+# </python-only>
+
+from .output import ImageWriter
+from .tiles import Tile
 from .vec3 import Color
 
 
-intensity = Interval(0.000, 0.999)
+# Not in book: floats per pixel, the sums of the red, green and blue of its samples, then the
+# count of samples. They are 32-bit: sums are rounded once per pixel and pass, after samples
+# are added up in 64-bit floats, which is far below what 8-bit or even 16-bit output shows
+pixel_floats = 4
+
 
-def linear_to_gamma_8bit(linear: float) -> UInt[8]:
-    linear = sqrt(linear) if linear > 0 else 0
-    return UInt[8](256 * intensity.clamp(linear))
+def heat(t: float) -> Color:
+    """Not in book: color of t in [0, 1] for heatmaps, from black to red, yellow then white."""
+    t *= 3.0
+    r, g, b = min(1.0, t), max(0.0, min(1.0, t - 1)), max(0.0, min(1.0, t - 2))
+    # Squared to cancel the gamma applied when saving
+    return Color(r * r, g * g, b * b)
 
 
 class Buffer:
+    """
+    Not in book: the image as one flat array of 32-bit floats, pixel_floats per pixel in row-major
+    order, instead of a list of rows of Color. Pixels hold sums, so buffers rendered
+    separately (tiles, passes, workers) are merged by adding them, and the color of a pixel
+    is the mean of its samples.
+    """
+
     w: int
     h: int
-    buffer: List[List[Color]]
+    data: List[float32]
 
     def __init__(self, w: int, h: int):
         self.w = w
         self.h = h
-        self.buffer = [[Color() for x in range(w)] for y in range(h)]
+        # <python-only>
+        # 4 bytes per float, instead of a float object and a pointer to it in a list
+        self.data = array("f", bytes(4 * pixel_floats * w * h))
+        # </python-only>
+        # <codon-only>
+        self.data = [float32(0.0) for _ in range(pixel_floats * w * h)]
+        # </codon-only>
 
-    def save_ppm(self, name: str):
-        save(self.raw_buffer(), name)
+    def offset(self, x: int, y: int) -> int:
+        return pixel_floats * (y * self.w + x)
+
+    def add(self, x: int, y: int, c: Color, samples: int):
+        """Add the sum c of samples samples to pixel x, y."""
+        k = self.offset(x, y)
+        data = self.data
+        data[k] += float32(c.x)
+        data[k + 1] += float32(c.y)
+        data[k + 2] += float32(c.z)
+        data[k + 3] += float32(float(samples))
+
+    def color(self, x: int, y: int) -> Color:
+        """Mean color of the samples of pixel x, y, black if there are none."""
+        k = self.offset(x, y)
+        n = float(self.data[k + 3])
+        if n <= 0:
+            return Color(0, 0, 0)
+        return Color(float(self.data[k]), float(self.data[k + 1]), float(self.data[k + 2])) / n
+
+    def samples(self, x: int, y: int) -> int:
+        return int(self.data[self.offset(x, y) + 3])
+
+    def mean_samples(self) -> float:
+        total = 0.0
+        for y in range(self.h):
+            row = self.row(y)
+            for k in range(3, len(row), pixel_floats):
+                total += float(row[k])
+        return total / (self.w * self.h)
 
-    def __getitem__(self, i: int) -> List[Color]:
-        return self.buffer[i]
+    def row(self, y: int) -> List[float32]:
+        """Floats of row y (a copy, or a view of a mapped buffer)."""
+        return self.data[self.offset(0, y):self.offset(0, y + 1)]
 
-    def __setitem__(self, xy: Tuple[int, int], c: Color):
-        self.buffer[xy[1]][xy[0]] = c
+    def tile(self, tile: Tile) -> List[float]:
+        """Copy of the floats of the pixels of a tile, row-major, in the layout paste takes."""
+        pixels: List[float] = []
+        for y in range(tile.y0, tile.y1):
+            for k in range(self.offset(tile.x0, y), self.offset(tile.x1, y)):
+                pixels.append(float(self.data[k]))
+        return pixels
 
-    def __setitem__(self, y: int, row: List[Color]):
-        assert len(row) == self.w, "Invalid row length"
-        self.buffer[y] = row
+    def paste(self, tile: Tile, pixels: List[float], offset: int = 0):
+        """
+        Add the pixels rendered for a tile, starting at offset, to the buffer. Every pixel is
+        pixel_floats floats, as in the buffer.
+        """
+        data = self.data
+        k = offset
+        for y in range(tile.y0, tile.y1):
+            start = self.offset(tile.x0, y)
+            for i in range(pixel_floats * tile.width()):
+                data[start + i] += float32(pixels[k + i])
+            k += pixel_floats * tile.width()
+
+    def merge(self, other: Buffer):
+        """Add the samples of a buffer of the same size, like another pass over the image."""
+        assert self.w == other.w and self.h == other.h, "Merging buffers of different sizes"
+        data, other_data = self.data, other.data
+        for k in range(len(data)):
+            data[k] += other_data[k]
+
+    def load(self, values: List[float32]):
+        """Replace the floats of the buffer, in its layout."""
+        assert len(values) == len(self.data), "Loading floats for a buffer of another size"
+        data = self.data
+        for k in range(len(values)):
+            data[k] = values[k]
+
+    def rgb_row(self, y: int) -> List[float]:
+        """Mean colors of the pixels of row y, 3 floats per pixel."""
+        values: List[float] = []
+        row = self.row(y)
+        for k in range(0, len(row), pixel_floats):
+            n = float(row[k + 3])
+            # Same as dividing a Color, which multiplies by the inverse
+            scale = 1 / n if n > 0 else 0.0
+            values.append(scale * float(row[k]))
+            values.append(scale * float(row[k + 1]))
+            values.append(scale * float(row[k + 2]))
+        return values
+
+    def rgb(self) -> List[float]:
+        """Mean colors of the pixels, 3 floats per pixel, row-major."""
+        values: List[float] = []
+        for y in range(self.h):
+            values.extend(self.rgb_row(y))
+        return values
+
+    def save(self, name: str, format: str = "ppm"):
+        """
+        Not in book: write the image to renders/<name>.<format>, see output.py for the
+        formats. Rows are converted and written one at a time.
+        """
+        os.system("mkdir -p renders")
+        writer = ImageWriter(f"renders/{name}.{format}", self.w, self.h)
+        for y in writer.rows():
+            writer.write_row(self.rgb_row(y))
+        writer.close()
+
+    def save_ppm(self, name: str):
+        self.save(name, "ppm")
 
-    def raw_buffer(self):
-        return [
-            [
-                (
-                    linear_to_gamma_8bit(c.x),
-                    linear_to_gamma_8bit(c.y),
-                    linear_to_gamma_8bit(c.z),
-                )
-                for c in row
-            ]
-            for row in self.buffer
-        ]
+    def sample_heatmap(self, max_samples: int):
+        """
+        Not in book: image of the count of samples taken for every pixel, from black for none
+        to red, yellow then white for max_samples.
+        """
+        heatmap = Buffer(self.w, self.h)
+        for y in range(self.h):
+            for x in range(self.w):
+                heatmap.add(x, y, heat(self.samples(x, y) / max_samples), 1)
+        return heatmap
 
 
 if __name__ == "__main__":
     b = Buffer(256, 256)
     for y in range(b.h):
         for x in range(b.w):
-            b[x, y] = Color(x / (b.w - 1), y / (b.h - 1), 0)
+            b.add(x, y, Color(x / (b.w - 1), y / (b.h - 1), 0), 1)
     b.save_ppm("test2")
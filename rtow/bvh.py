@@ -1,9 +1,160 @@
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, List, Tuple
 
 from .aabb import AABB, empty
 from .interval import Interval
 from .ray import Ray
-from .objects import HitRecord, Hittable, HittableList
+from .util import p_inf
+from .objects import Hittable, HittableList
+
+
+# Not in book: surface area heuristic (SAH), costs are relative to one ray/object intersection
+traversal_cost = 1.0
+intersection_cost = 1.0
+sah_bins = 12
+
+
+class BVHStats:
+    """Not in book: shape and quality of a built BVH, for the render report."""
+
+    depth: int        # Depth of the deepest interior node
+    nodes: int        # Count of interior nodes
+    leaves: int       # Count of leaves (a single object, or a list of objects)
+    cost: float       # SAH cost of the tree for a ray that hits the root box
+    root_area: float  # Surface area of the root box
+
+    def __init__(self, root_area: float = 0.0):
+        self.depth = 0
+        self.nodes = 0
+        self.leaves = 0
+        self.cost = 0.0
+        self.root_area = root_area
+
+    def relative_area(self, area: float) -> float:
+        # The first box added is the root
+        if self.nodes == 0 and self.leaves == 0 and self.root_area == 0:
+            self.root_area = area
+        return area / self.root_area if self.root_area > 0 else 1.0
+
+    def add_node(self, box: AABB, depth: int):
+        self.add_node_bounds(box.surface_area(), depth)
+
+    def add_node_bounds(self, area: float, depth: int):
+        self.cost += traversal_cost * self.relative_area(area)
+        self.nodes += 1
+        self.depth = max(self.depth, depth)
+
+    def add_leaf(self, box: AABB, count: int):
+        self.add_leaf_bounds(box.surface_area(), count)
+
+    def add_leaf_bounds(self, area: float, count: int):
+        self.cost += intersection_cost * count * self.relative_area(area)
+        self.leaves += 1
+
+    def merge(self, other: BVHStats):
+        """Add the nodes of a subtree built separately with the same root area."""
+        self.depth = max(self.depth, other.depth)
+        self.nodes += other.nodes
+        self.leaves += other.leaves
+        self.cost += other.cost
+
+
+def centroid(box: AABB, axis: int) -> float:
+    ax = box.axis_interval(axis)
+    return 0.5 * (ax.min + ax.max)
+
+
+def median_split(objects: List[Hittable], start: int, end: int, bbox: AABB) -> Tuple[int, int]:
+    """Sort the span along the longest axis of its box, returns the index and axis of the cut."""
+    axis = bbox.longest_axis()
+    sort_key: Callable[[Hittable], float] = lambda a: -a.bounding_box().axis_interval(axis).min
+
+    objects[start:end] = sorted(objects[start:end], key=sort_key)
+    return start + (end - start) // 2, axis
+
+
+def sah_split(objects: List[Hittable], start: int, end: int, bbox: AABB, leaf_size: int) -> Tuple[int, int]:
+    """
+    Not in book: binned surface area heuristic. Object centroids are dropped into `sah_bins`
+    buckets along each axis, and the span is cut at the bucket boundary that minimizes the
+    expected cost of tracing through both halves.
+
+    Returns the index and axis of the cut, or -1 as index when a leaf is cheaper than any cut,
+    which is only allowed for spans of at most `leaf_size` objects.
+    """
+
+    object_span = end - start
+    if object_span == 1:
+        return -1, 0
+
+    best_cost = p_inf
+    best_axis = -1
+    best_bin = -1
+    best_lo = 0.0
+    best_scale = 0.0
+
+    for axis in range(3):
+        lo, hi = p_inf, -p_inf
+        for i in range(start, end):
+            c = centroid(objects[i].bounding_box(), axis)
+            lo, hi = min(lo, c), max(hi, c)
+        if hi <= lo:
+            continue
+
+        scale = sah_bins / (hi - lo)
+        counts = [0 for _ in range(sah_bins)]
+        boxes = [empty for _ in range(sah_bins)]
+        for i in range(start, end):
+            box = objects[i].bounding_box()
+            b = min(int((centroid(box, axis) - lo) * scale), sah_bins - 1)
+            counts[b] += 1
+            boxes[b] = AABB.from_aabbs(boxes[b], box)
+
+        # Sweep from the right to get the area and count on the right side of every boundary
+        right_areas = [0.0 for _ in range(sah_bins)]
+        right_counts = [0 for _ in range(sah_bins)]
+        box, count = empty, 0
+        for b in range(sah_bins - 1, 0, -1):
+            box = AABB.from_aabbs(box, boxes[b])
+            count += counts[b]
+            right_areas[b] = box.surface_area()
+            right_counts[b] = count
+
+        # Then from the left, cutting between bins b - 1 and b
+        box, count = empty, 0
+        for b in range(1, sah_bins):
+            box = AABB.from_aabbs(box, boxes[b - 1])
+            count += counts[b - 1]
+            if count == 0 or right_counts[b] == 0:
+                continue
+            cost = box.surface_area() * count + right_areas[b] * right_counts[b]
+            if cost < best_cost:
+                best_cost, best_axis, best_bin = cost, axis, b
+                best_lo, best_scale = lo, scale
+
+    area = bbox.surface_area()
+    leaf_cost = intersection_cost * object_span
+    if best_axis < 0:
+        # All centroids are at the same place, no cut can separate the objects
+        return (-1, 0) if object_span <= leaf_size else median_split(objects, start, end, bbox)
+
+    split_cost = traversal_cost + intersection_cost * best_cost / area if area > 0 else p_inf
+    if object_span <= leaf_size and leaf_cost <= split_cost:
+        return -1, 0
+
+    axis, cut, lo, scale = best_axis, best_bin, best_lo, best_scale
+    in_left: Callable[[Hittable], bool] = (
+        lambda a: min(int((centroid(a.bounding_box(), axis) - lo) * scale), sah_bins - 1) < cut
+    )
+    left = [o for o in objects[start:end] if in_left(o)]
+    right = [o for o in objects[start:end] if not in_left(o)]
+    objects[start:end] = left + right
+    return start + len(left), axis
+
+
+def make_leaf(objects: List[Hittable], start: int, end: int) -> Hittable:
+    if end - start == 1:
+        return objects[start]
+    return HittableList(objects[start:end])
 
 
 class BVHNode(Hittable):
@@ -19,51 +170,71 @@ class BVHNode(Hittable):
         self.depth = depth
 
     @staticmethod
-    def from_list(list: HittableList) -> Tuple[BVHNode, int]:
-        return BVHNode.make_node(list.objects, 0, len(list.objects), 0)
+    def from_list(list: HittableList, strategy: str = "median", leaf_size: int = 4) -> Tuple[Hittable, BVHStats]:
+        # Book addition: statistics about the tree are also returned for debugging purposes
+        stats = BVHStats()
+        root = BVHNode.make_node(list.objects, 0, len(list.objects), 0, strategy, leaf_size, stats)
+        return root, stats
 
     @staticmethod
-    def make_node(objects: List[Hittable], start: int, end: int, depth: int) -> Tuple[BVHNode, int]:
-        # Book addition: total depth below the current node is also returned for debugging purposes
+    def make_node(
+            objects: List[Hittable],
+            start: int,
+            end: int,
+            depth: int,
+            strategy: str,
+            leaf_size: int,
+            stats: BVHStats,
+        ) -> Hittable:
 
         # Build the bounding box of the span of source objects
         bbox = empty
         for i in range(start, end):
             bbox = AABB.from_aabbs(bbox, objects[i].bounding_box())
 
-        axis = bbox.longest_axis()
-        sort_key: Callable[[Hittable], float] = lambda a: -a.bounding_box().axis_interval(axis).min
-
         object_span = end - start
-        child_depth1 = child_depth2 = depth
+
+        if strategy == "sah":
+            mid, _ = sah_split(objects, start, end, bbox, leaf_size)
+            if mid < 0:
+                stats.add_leaf(bbox, object_span)
+                return make_leaf(objects, start, end)
+
+            stats.add_node(bbox, depth)
+            left = BVHNode.make_node(objects, start, mid, depth + 1, strategy, leaf_size, stats)
+            right = BVHNode.make_node(objects, mid, end, depth + 1, strategy, leaf_size, stats)
+            return BVHNode(left, right, bbox, depth)
+
+        stats.add_node(bbox, depth)
 
         if object_span == 1:
             left = right = objects[start]
+            stats.add_leaf(left.bounding_box(), 2)
         elif object_span == 2:
             left = objects[start]
             right = objects[start + 1]
+            stats.add_leaf(left.bounding_box(), 1)
+            stats.add_leaf(right.bounding_box(), 1)
         else:
-            objects[start:end] = sorted(objects[start:end], key=sort_key)
-            mid = start + object_span // 2
-            left, child_depth1 = BVHNode.make_node(objects, start, mid, depth + 1)
-            right, child_depth2 = BVHNode.make_node(objects, mid, end, depth + 1)
-
-        return BVHNode(left, right, bbox, depth), max(child_depth1, child_depth2)
-
-    def hit(self, r: Ray, ray_t: Interval) -> Optional[HitRecord]:
-        if not self.bbox.hit(r, ray_t):
-            return None
+            mid, _ = median_split(objects, start, end, bbox)
+            left = BVHNode.make_node(objects, start, mid, depth + 1, strategy, leaf_size, stats)
+            right = BVHNode.make_node(objects, mid, end, depth + 1, strategy, leaf_size, stats)
+
+        return BVHNode(left, right, bbox, depth)
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        if r.stats:
+            r.stats.add_traversal(1, 1)
+        if not self.bbox.hit(r, Interval(t_min, t_max)):
+            primitive: Hittable = self
+            return p_inf, primitive
         else:
-            hit_left = self.left.hit(r, ray_t)
-            if hit_left:
-                hit_right = self.right.hit(r, Interval(ray_t.min, hit_left.hit.t))
-            else:
-                hit_right = self.right.hit(r, ray_t)
-
-            if hit_left and hit_right:
-                return hit_left if hit_left.hit.t < hit_right.hit.t else hit_right
+            t_left, hit_left = self.left.intersect(r, t_min, t_max)
+            t_right, hit_right = self.right.intersect(r, t_min, min(t_left, t_max))
 
-            return hit_left if hit_left else hit_right
+            if t_right < t_left:
+                return t_right, hit_right
+            return t_left, hit_left
 
     def bounding_box(self) -> AABB:
         return self.bbox
@@ -0,0 +1,331 @@
+from math import log2
+from typing import List, Tuple
+
+from .objects import Hittable
+from .util import p_inf, m_inf
+from .bvh import BVHStats, traversal_cost, intersection_cost, sah_bins
+
+
+# Not in book: BVH builder working on flat arrays of precomputed bounds and centroids, that
+# partitions spans in place instead of sorting them, and can build subtrees in parallel.
+
+# Smallest span worth handing to a parallel build task
+min_task_span = 1024
+
+
+class PrimitiveArrays:
+    """Bounds and centroids of the objects to build a BVH over, computed once."""
+
+    bounds: List[float]     # 6 per object: min x, y, z then max x, y, z
+    centroids: List[float]  # 3 per object
+    order: List[int]        # Object indices, partitioned in place by the build
+
+    def __init__(self, objects: List[Hittable]):
+        self.bounds = []
+        self.centroids = []
+        for o in objects:
+            box = o.bounding_box()
+            self.bounds.extend([box.x.min, box.y.min, box.z.min, box.x.max, box.y.max, box.z.max])
+            self.centroids.extend([
+                0.5 * (box.x.min + box.x.max),
+                0.5 * (box.y.min + box.y.max),
+                0.5 * (box.z.min + box.z.max),
+            ])
+        self.order = [i for i in range(len(objects))]
+
+    def span_bounds(self, start: int, end: int) -> List[float]:
+        bounds = self.bounds
+        x0, y0, z0, x1, y1, z1 = p_inf, p_inf, p_inf, m_inf, m_inf, m_inf
+        for i in range(start, end):
+            b = 6 * self.order[i]
+            x0, y0, z0 = min(x0, bounds[b]), min(y0, bounds[b + 1]), min(z0, bounds[b + 2])
+            x1, y1, z1 = max(x1, bounds[b + 3]), max(y1, bounds[b + 4]), max(z1, bounds[b + 5])
+        return [x0, y0, z0, x1, y1, z1]
+
+    def select(self, start: int, end: int, k: int, axis: int):
+        """
+        Reorder the span so that the object at k is the one that would be there if the span
+        was sorted by centroid along axis, with smaller ones before and larger ones after.
+        """
+
+        order, centroids = self.order, self.centroids
+        lo, hi = start, end - 1
+        while lo < hi:
+            pivot = centroids[3 * order[(lo + hi) // 2] + axis]
+            i, j = lo, hi
+            while i <= j:
+                while centroids[3 * order[i] + axis] < pivot:
+                    i += 1
+                while centroids[3 * order[j] + axis] > pivot:
+                    j -= 1
+                if i <= j:
+                    order[i], order[j] = order[j], order[i]
+                    i += 1
+                    j -= 1
+            if k <= j:
+                hi = j
+            elif k >= i:
+                lo = i
+            else:
+                break
+
+
+def area(box: List[float]) -> float:
+    dx, dy, dz = box[3] - box[0], box[4] - box[1], box[5] - box[2]
+    return 2 * (dx * dy + dy * dz + dz * dx)
+
+
+def longest_axis(box: List[float]) -> int:
+    dx, dy, dz = box[3] - box[0], box[4] - box[1], box[5] - box[2]
+    if dx > dy:
+        return 0 if dx > dz else 2
+    return 1 if dy > dz else 2
+
+
+def median_split(prims: PrimitiveArrays, start: int, end: int, box: List[float]) -> Tuple[int, int]:
+    """Cut the span in two halves along the longest axis of its box, lower half first."""
+    axis = longest_axis(box)
+    mid = start + (end - start) // 2
+    prims.select(start, end, mid, axis)
+    return mid, axis
+
+
+def sah_split(prims: PrimitiveArrays, start: int, end: int, box: List[float], leaf_size: int) -> Tuple[int, int]:
+    """
+    Binned SAH split like bvh.sah_split, over the precomputed arrays: the span is partitioned
+    in place, bins on the low side of the cut first. Returns -1 as index for a leaf.
+    """
+
+    object_span = end - start
+    if object_span == 1:
+        return -1, 0
+
+    order, bounds, centroids = prims.order, prims.bounds, prims.centroids
+
+    best_cost = p_inf
+    best_axis = -1
+    best_bin = -1
+    best_lo = 0.0
+    best_scale = 0.0
+
+    for axis in range(3):
+        lo, hi = p_inf, m_inf
+        for i in range(start, end):
+            c = centroids[3 * order[i] + axis]
+            lo, hi = min(lo, c), max(hi, c)
+        if hi <= lo:
+            continue
+
+        scale = sah_bins / (hi - lo)
+        counts = [0 for _ in range(sah_bins)]
+        boxes = [p_inf, p_inf, p_inf, m_inf, m_inf, m_inf] * sah_bins
+        for i in range(start, end):
+            o = order[i]
+            b = min(int((centroids[3 * o + axis] - lo) * scale), sah_bins - 1)
+            counts[b] += 1
+            b, o = 6 * b, 6 * o
+            boxes[b] = min(boxes[b], bounds[o])
+            boxes[b + 1] = min(boxes[b + 1], bounds[o + 1])
+            boxes[b + 2] = min(boxes[b + 2], bounds[o + 2])
+            boxes[b + 3] = max(boxes[b + 3], bounds[o + 3])
+            boxes[b + 4] = max(boxes[b + 4], bounds[o + 4])
+            boxes[b + 5] = max(boxes[b + 5], bounds[o + 5])
+
+        # Sweep from the right to get the area and count on the right side of every boundary
+        right_areas = [0.0 for _ in range(sah_bins)]
+        right_counts = [0 for _ in range(sah_bins)]
+        acc = [p_inf, p_inf, p_inf, m_inf, m_inf, m_inf]
+        count = 0
+        for b in range(sah_bins - 1, 0, -1):
+            for a in range(3):
+                acc[a] = min(acc[a], boxes[6 * b + a])
+                acc[a + 3] = max(acc[a + 3], boxes[6 * b + a + 3])
+            count += counts[b]
+            right_areas[b] = area(acc) if count > 0 else 0.0
+            right_counts[b] = count
+
+        # Then from the left, cutting between bins b - 1 and b
+        acc = [p_inf, p_inf, p_inf, m_inf, m_inf, m_inf]
+        count = 0
+        for b in range(1, sah_bins):
+            for a in range(3):
+                acc[a] = min(acc[a], boxes[6 * (b - 1) + a])
+                acc[a + 3] = max(acc[a + 3], boxes[6 * (b - 1) + a + 3])
+            count += counts[b - 1]
+            if count == 0 or right_counts[b] == 0:
+                continue
+            cost = area(acc) * count + right_areas[b] * right_counts[b]
+            if cost < best_cost:
+                best_cost, best_axis, best_bin = cost, axis, b
+                best_lo, best_scale = lo, scale
+
+    if best_axis < 0:
+        # All centroids are at the same place, no cut can separate the objects
+        return (-1, 0) if object_span <= leaf_size else median_split(prims, start, end, box)
+
+    node_area = area(box)
+    split_cost = traversal_cost + intersection_cost * best_cost / node_area if node_area > 0 else p_inf
+    if object_span <= leaf_size and intersection_cost * object_span <= split_cost:
+        return -1, 0
+
+    # Partition in place: objects in the bins below the cut go first
+    i, j = start, end - 1
+    while i <= j:
+        if min(int((centroids[3 * order[i] + best_axis] - best_lo) * best_scale), sah_bins - 1) < best_bin:
+            i += 1
+        else:
+            order[i], order[j] = order[j], order[i]
+            j -= 1
+
+    if i == start or i == end:
+        # Rounding put every object on one side of the cut
+        return median_split(prims, start, end, box)
+    return i, best_axis
+
+
+class NodeArrays:
+    """
+    Nodes of a BVH in depth-first order, in the layout of FlatBVH. While building in
+    parallel, a node with a count of -1 stands for the subtree of the task at its offset.
+    """
+
+    bounds: List[float]
+    offsets: List[int]
+    counts: List[int]
+    axes: List[int]
+
+    def __init__(self):
+        self.bounds = []
+        self.offsets = []
+        self.counts = []
+        self.axes = []
+
+    def add(self, box: List[float], offset: int, count: int, axis: int) -> int:
+        self.bounds.extend(box)
+        self.offsets.append(offset)
+        self.counts.append(count)
+        self.axes.append(axis)
+        return len(self.counts) - 1
+
+
+class BuildTask:
+    start: int
+    end: int
+    depth: int
+
+    def __init__(self, start: int, end: int, depth: int):
+        self.start = start
+        self.end = end
+        self.depth = depth
+
+
+def build_node(
+        prims: PrimitiveArrays,
+        nodes: NodeArrays,
+        start: int,
+        end: int,
+        depth: int,
+        strategy: str,
+        leaf_size: int,
+        packed: bool,
+        stats: BVHStats,
+        task_depth: int,
+        tasks: List[BuildTask],
+    ) -> int:
+
+    box = prims.span_bounds(start, end)
+    object_span = end - start
+
+    if depth == task_depth and object_span >= min_task_span:
+        node = nodes.add(box, len(tasks), -1, 0)
+        tasks.append(BuildTask(start, end, depth))
+        return node
+
+    if packed and object_span <= leaf_size:
+        # Packed leaves are intersected in one loop, they are always filled up to leaf_size
+        mid, axis = -1, 0
+    elif strategy == "sah":
+        mid, axis = sah_split(prims, start, end, box, leaf_size)
+    elif object_span <= 2:
+        mid, axis = -1, 0
+    else:
+        mid, axis = median_split(prims, start, end, box)
+
+    if mid < 0:
+        stats.add_leaf_bounds(area(box), object_span)
+        return nodes.add(box, start, object_span, 0)
+
+    stats.add_node_bounds(area(box), depth)
+    node = nodes.add(box, 0, 0, axis)
+    build_node(prims, nodes, start, mid, depth + 1, strategy, leaf_size, packed, stats, task_depth, tasks)
+    nodes.offsets[node] = build_node(
+        prims, nodes, mid, end, depth + 1, strategy, leaf_size, packed, stats, task_depth, tasks,
+    )
+    return node
+
+
+def linearize(source: NodeArrays, node: int, fragments: List[NodeArrays], out: NodeArrays) -> int:
+    """Copy a subtree to out in depth-first order, replacing task nodes by their subtree."""
+    if source.counts[node] < 0:
+        return linearize(fragments[source.offsets[node]], 0, fragments, out)
+
+    b = 6 * node
+    copy = out.add(source.bounds[b:b + 6], source.offsets[node], source.counts[node], source.axes[node])
+    if source.counts[node] == 0:
+        linearize(source, node + 1, fragments, out)
+        out.offsets[copy] = linearize(source, source.offsets[node], fragments, out)
+    return copy
+
+
+def build(
+        objects: List[Hittable],
+        strategy: str,
+        leaf_size: int,
+        workers: int = 1,
+        packed: bool = False,
+    ) -> Tuple[NodeArrays, List[int], BVHStats]:
+    """
+    Build the nodes of a BVH over objects, returns them with the order the objects must be
+    stored in for the leaves to be contiguous spans.
+
+    With several workers in Codon, the top of the tree is built first down to a depth that
+    leaves a few independent subtrees per worker, and these subtrees are then built in parallel
+    threads. Python and PyPy build the whole tree in this process, whatever the workers.
+
+    When packed, every span of at most leaf_size objects becomes a leaf.
+    """
+
+    prims = PrimitiveArrays(objects)
+    stats = BVHStats()
+
+    top = NodeArrays()
+    tasks: List[BuildTask] = []
+    # <python-only>
+    # There are no threads to build the subtrees on, splitting them off would only add a copy
+    workers = 1
+    # </python-only>
+    task_depth = int(log2(4 * workers)) if workers > 1 else -1
+    build_node(prims, top, 0, len(objects), 0, strategy, leaf_size, packed, stats, task_depth, tasks)
+
+    if len(tasks) == 0:
+        return top, prims.order, stats
+
+    fragments = [NodeArrays() for _ in range(len(tasks))]
+    fragment_stats = [BVHStats(stats.root_area) for _ in range(len(tasks))]
+    no_tasks: List[List[BuildTask]] = [[] for _ in range(len(tasks))]
+
+    # Every task partitions its own span of the order, and writes to its own arrays
+    @par(schedule="dynamic", chunk_size=1, num_threads=workers)
+    for k in range(len(tasks)):
+        task = tasks[k]
+        build_node(
+            prims, fragments[k], task.start, task.end, task.depth,
+            strategy, leaf_size, packed, fragment_stats[k], -1, no_tasks[k],
+        )
+
+    nodes = NodeArrays()
+    linearize(top, 0, fragments, nodes)
+    for s in fragment_stats:
+        stats.merge(s)
+
+    return nodes, prims.order, stats
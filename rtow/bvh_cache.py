@@ -0,0 +1,169 @@
+import os
+from typing import List, Optional, Tuple
+
+from .aabb import AABB
+from .interval import Interval
+from .objects import HittableList
+from .bvh import BVHStats
+from .flat_bvh import FlatBVH
+from .tiles import hash32
+from .binio import BinaryReader, BinaryWriter
+
+
+# Not in book: built BVHs are kept in memory and in cache files, keyed by a hash of the
+# scene, so that rendering the same scene again (at another resolution, with more samples,
+# in another run...) does not build the BVH again
+
+cache_dir = "cache"
+magic = "RTOWBVH1"
+
+# Part of the key: bump it when the builder changes the trees it makes, so that cache files
+# written by an older builder are not loaded
+builder_version = 2
+
+# Magic, 5 ints and 2 floats
+header_size = 64
+
+# Built BVHs kept in memory
+max_memo_entries = 4
+
+
+class CacheEntry:
+    world: HittableList
+    key: str
+    bvh: FlatBVH
+    stats: BVHStats
+
+    def __init__(self, world: HittableList, key: str, bvh: FlatBVH, stats: BVHStats):
+        self.world = world
+        self.key = key
+        self.bvh = bvh
+        self.stats = stats
+
+
+memo: List[CacheEntry] = []
+
+
+def scene_key(world: HittableList, strategy: str, leaf_size: int, packed: bool) -> str:
+    """
+    Hash of everything a BVH depends on: the boxes of the objects, in order, the build
+    parameters and the version of the builder. Two 32-bit hashes are combined into a 64-bit key.
+    """
+
+    h1 = hash32(hash32(len(world.objects)) + (1 if strategy == "sah" else 0))
+    h2 = hash32(hash32(hash32(h1 + leaf_size) + (1 if packed else 0)) + builder_version)
+
+    for o in world.objects:
+        box = o.bounding_box()
+        x = hash((box.x.min, box.y.min, box.z.min, box.x.max, box.y.max, box.z.max))
+        h1 = hash32(h1 ^ x)
+        h2 = hash32(h2 ^ (x >> 32))
+
+    return f"{h1:08x}{h2:08x}"
+
+
+def save(path: str, bvh: FlatBVH, stats: BVHStats):
+    """
+    Write a BVH to path. Primitives are stored as their index in the scene, they are linked
+    back to the objects of the scene when loading.
+    """
+
+    n_nodes = len(bvh.counts)
+    n_primitives = len(bvh.order)
+
+    # <python-only>
+    os.makedirs(cache_dir, exist_ok=True)
+    # </python-only>
+    # <codon-only>
+    os.system(f"mkdir -p '{cache_dir}'")
+    # </codon-only>
+    writer = BinaryWriter(path)
+    writer.write_magic(magic)
+    writer.write_ints([n_nodes, n_primitives, stats.depth, stats.nodes, stats.leaves])
+    writer.write_floats([stats.cost, stats.root_area])
+    writer.write_floats(bvh.bounds)
+    writer.write_ints(bvh.offsets)
+    writer.write_ints(bvh.counts)
+    writer.write_ints(bvh.axes)
+    writer.write_ints(bvh.order)
+    writer.close()
+
+
+def load(path: str, world: HittableList, key: str) -> Optional[CacheEntry]:
+    """Map the BVH stored in path, returns None if there is none or if it is not valid."""
+
+    try:
+        reader = BinaryReader(path)
+    except IOError:
+        return None
+
+    if reader.size() < header_size or reader.read_magic() != magic:
+        return None
+
+    header = reader.read_ints(5)
+    floats = reader.read_floats(2)
+    n_nodes, n_primitives = header[0], header[1]
+    if n_primitives != len(world.objects) or reader.size() != header_size + 8 * (9 * n_nodes + n_primitives):
+        # Written by an interrupted run
+        return None
+
+    stats = BVHStats(floats[1])
+    stats.depth, stats.nodes, stats.leaves, stats.cost = header[2], header[3], header[4], floats[0]
+
+    bvh = FlatBVH()
+    bvh.bounds = reader.read_floats(6 * n_nodes)
+    bvh.offsets = reader.read_ints(n_nodes)
+    bvh.counts = reader.read_ints(n_nodes)
+    bvh.axes = reader.read_ints(n_nodes)
+    bvh.order = reader.read_ints(n_primitives)
+    bvh.primitives = [world.objects[i] for i in bvh.order]
+    bvh.stack_size = stats.depth + 1
+    bvh.bbox = AABB(
+        Interval(bvh.bounds[0], bvh.bounds[3]),
+        Interval(bvh.bounds[1], bvh.bounds[4]),
+        Interval(bvh.bounds[2], bvh.bounds[5]),
+    )
+
+    return CacheEntry(world, key, bvh, stats)
+
+
+def cached_build(
+        world: HittableList,
+        strategy: str,
+        leaf_size: int,
+        workers: int,
+        use_disk: bool,
+        packed: bool = False,
+    ) -> Tuple[FlatBVH, BVHStats]:
+    """
+    Returns the BVH of world, built with FlatBVH.build. It is reused if the same scene was
+    already built in this run, or loaded from the cache directory if use_disk is set and
+    another run built it before. A BVH that had to be built is written there.
+    """
+
+    key = scene_key(world, strategy, leaf_size, packed)
+
+    for entry in memo:
+        if entry.world is world and entry.key == key:
+            # The key only covers the boxes: objects replaced by others with the same box are
+            # linked again, the packed leaves are made from them by FlatBVH.pack
+            entry.bvh.primitives = [world.objects[i] for i in entry.bvh.order]
+            return entry.bvh, entry.stats
+
+    path = f"{cache_dir}/bvh-{key}.bin"
+    loaded: Optional[CacheEntry] = None
+    if use_disk:
+        loaded = load(path, world, key)
+
+    if loaded is None:
+        bvh, stats = FlatBVH.build(world, strategy, leaf_size, workers, packed)
+        if use_disk:
+            save(path, bvh, stats)
+    else:
+        bvh, stats = loaded.bvh, loaded.stats
+
+    if len(memo) == max_memo_entries:
+        memo.pop(0)
+    memo.append(CacheEntry(world, key, bvh, stats))
+
+    return bvh, stats
@@ -0,0 +1,199 @@
+from typing import List, Tuple
+
+from .aabb import AABB, empty
+from .interval import Interval
+from .ray import Ray
+from .util import p_inf
+from .objects import Hittable, HittableList, SphereSet
+from .bvh import BVHStats
+from .bvh_build import build as build_nodes
+
+
+def inverse(d: float) -> float:
+    # A zero direction component makes the ray parallel to the slabs on that axis, a huge
+    # inverse gives the same result as the infinity Codon would compute
+    return 1.0 / d if d != 0 else 1e300
+
+
+class FlatBVH(Hittable):
+    """
+    Not in book: BVH stored as flat arrays in depth-first order instead of a tree of objects,
+    traversed in a loop with an explicit stack.
+
+    The first child of an interior node is always the next node, and it is the child on the
+    low side of the split axis, so the ray's direction sign tells which child is nearer.
+    """
+
+    bounds: List[float]          # Min x, y, z and max x, y, z of every node box
+    offsets: List[int]           # Interior node: index of the second child, leaf: first primitive
+    counts: List[int]            # Interior node: 0, leaf: count of primitives
+    axes: List[int]              # Split axis of interior nodes
+    primitives: List[Hittable]   # Objects, ordered so that every leaf is a contiguous span
+    order: List[int]             # Index in the scene list of every primitive
+    bbox: AABB
+    stack_size: int              # Most nodes the traversal stack holds: one per interior node on the deepest path
+
+    def __init__(self):
+        self.bounds = []
+        self.offsets = []
+        self.counts = []
+        self.axes = []
+        self.primitives = []
+        self.order = []
+        self.bbox = empty
+        self.stack_size = 1
+
+    @staticmethod
+    def from_list(
+            list: HittableList,
+            strategy: str = "median",
+            leaf_size: int = 4,
+            workers: int = 1,
+            packed: bool = False,
+        ) -> Tuple[Hittable, BVHStats]:
+
+        bvh, stats = FlatBVH.build(list, strategy, leaf_size, workers, packed)
+        root: Hittable = bvh.pack() if packed else bvh
+        return root, stats
+
+    @staticmethod
+    def build(
+            list: HittableList,
+            strategy: str,
+            leaf_size: int,
+            workers: int = 1,
+            packed: bool = False,
+        ) -> Tuple[FlatBVH, BVHStats]:
+        """
+        Build the BVH of list. When packed, the leaves are sized to be packed with pack(),
+        but they still hold one primitive per object.
+        """
+
+        nodes, order, stats = build_nodes(list.objects, strategy, leaf_size, workers, packed)
+
+        bvh = FlatBVH()
+        bvh.bounds = nodes.bounds
+        bvh.offsets = nodes.offsets
+        bvh.counts = nodes.counts
+        bvh.axes = nodes.axes
+        bvh.order = order
+        bvh.primitives = [list.objects[i] for i in order]
+        bvh.stack_size = stats.depth + 1
+        bvh.bbox = AABB(
+            Interval(bvh.bounds[0], bvh.bounds[3]),
+            Interval(bvh.bounds[1], bvh.bounds[4]),
+            Interval(bvh.bounds[2], bvh.bounds[5]),
+        )
+
+        return bvh, stats
+
+    def pack(self):
+        """
+        Returns a copy of this BVH where the spheres of every leaf are packed in a SphereSet,
+        leaves holding a single sphere or other objects are kept as they are.
+        """
+
+        bvh = FlatBVH()
+        bvh.bounds = self.bounds
+        bvh.offsets = list(self.offsets)
+        bvh.counts = list(self.counts)
+        bvh.axes = self.axes
+        bvh.order = self.order
+        bvh.bbox = self.bbox
+        bvh.stack_size = self.stack_size
+
+        for node in range(len(bvh.counts)):
+            count = bvh.counts[node]
+            if count == 0:
+                continue
+
+            first = bvh.offsets[node]
+            leaf = self.primitives[first:first + count]
+            bvh.offsets[node] = len(bvh.primitives)
+            if count > 1 and SphereSet.can_pack(leaf):
+                bvh.counts[node] = 1
+                packed: Hittable = SphereSet(leaf)
+                bvh.primitives.append(packed)
+            else:
+                bvh.primitives.extend(leaf)
+
+        return bvh
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        bounds = self.bounds
+        offsets = self.offsets
+        counts = self.counts
+        axes = self.axes
+
+        ox, oy, oz = r.origin.x, r.origin.y, r.origin.z
+        ix, iy, iz = inverse(r.direction.x), inverse(r.direction.y), inverse(r.direction.z)
+
+        # Offsets of the near and far planes of a box along each axis
+        nx = 3 if ix < 0 else 0
+        ny = 4 if iy < 0 else 1
+        nz = 5 if iz < 0 else 2
+        fx, fy, fz = 3 - nx, 5 - ny, 7 - nz
+        negative_x, negative_y, negative_z = ix < 0, iy < 0, iz < 0
+
+        closest = t_max
+        primitive: Hittable = self
+        found = False
+
+        stack = [0 for _ in range(self.stack_size)]
+        sp = 0
+        node = 0
+        visits = 0
+
+        while True:
+            visits += 1
+
+            # Slab test against the node box, clipped to the closest hit found so far: a node
+            # whose entry distance is beyond it is skipped with its whole subtree
+            b = 6 * node
+            t0 = max(t_min, (bounds[b + nx] - ox) * ix, (bounds[b + ny] - oy) * iy, (bounds[b + nz] - oz) * iz)
+            t1 = min(closest, (bounds[b + fx] - ox) * ix, (bounds[b + fy] - oy) * iy, (bounds[b + fz] - oz) * iz)
+
+            if t0 < t1:
+                count = counts[node]
+                if count > 0:
+                    first = offsets[node]
+                    for i in range(first, first + count):
+                        t, candidate = self.primitives[i].intersect(r, t_min, closest)
+                        if t < closest:
+                            closest = t
+                            primitive = candidate
+                            found = True
+                else:
+                    # Visit the near child now, and the far one later
+                    axis = axes[node]
+                    if negative_x if axis == 0 else (negative_y if axis == 1 else negative_z):
+                        stack[sp] = node + 1
+                        node = offsets[node]
+                    else:
+                        stack[sp] = offsets[node]
+                        node = node + 1
+                    sp += 1
+                    continue
+
+            if sp == 0:
+                break
+            sp -= 1
+            node = stack[sp]
+
+        if r.stats:
+            # A slab test per node visited
+            r.stats.add_traversal(visits, visits)
+        return (closest if found else p_inf), primitive
+
+    def bounding_box(self) -> AABB:
+        return self.bbox
+
+    # <python-only>
+    def __getstate__(self):
+        # Arrays mapped from a BVH cache file can't be pickled and sent to worker processes
+        state = dict(self.__dict__)
+        for name, value in state.items():
+            if isinstance(value, memoryview):
+                state[name] = value.tolist()
+        return state
+    # </python-only>
@@ -1,6 +1,8 @@
 from typing import List, Tuple
 
 from .vec3 import Color
+from .tiles import hash32
+from .binio import BinaryReader
 
 
 @python # type: ignore
@@ -15,6 +17,34 @@ def load_image(image_filename: str) -> List[List[Tuple[int, int, int]]]:
     return pixels
 
 
+@python # type: ignore
+def decode_to_file(image_filename: str, path: str, magic: str, size: int, h: int) -> bool:
+    """
+    Not in book: decode the image into a texture cache file (see Image) a band of rows at a
+    time, so that only PIL holds the whole image, at 3 bytes per texel. Returns False if the
+    file can't be written.
+    """
+    from array import array
+    from PIL import Image
+
+    # Textures are local files, and the large ones are what the cache is for
+    Image.MAX_IMAGE_PIXELS = None
+    image = Image.open(image_filename)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+
+    try:
+        with open(path, "wb") as f:
+            f.write(magic.encode("latin-1"))
+            array("q", [width, height, size, h]).tofile(f)
+            for y in range(0, height, 64):
+                f.write(image.crop((0, y, width, min(height, y + 64))).tobytes())
+    except IOError:
+        return False
+    return True
+
+
 def clamp(x: int, low: int, high: int):
     # Return the value clamped to the range [low, high)
     if x < low: return low
@@ -26,29 +56,105 @@ def linearize(x: int) -> float:
     return (x / 255.0)**2.2
 
 
+# Not in book: decoded textures are cached next to their image, in a file of 8-bit texels
+# memory-mapped by later runs (read in one block by Codon), which then skip PIL and Python
+magic = "RTOWTEX1"
+
+# Bytes at the start and at the end of the image hashed to tell when a cached texture is stale
+key_bytes = 4096
+
+
+def source_key(image_filename: str) -> Tuple[int, int]:
+    """Size of the image file, and hash of its first and last bytes, the only ones read."""
+    with open(image_filename, "rb") as f:
+        f.seek(0, 2)
+        n = f.tell()
+        head = min(n, key_bytes)
+        tail = max(head, n - key_bytes)
+        f.seek(0)
+        chunks = [f.read(head)]
+        f.seek(tail)
+        chunks.append(f.read(n - tail))
+
+    h = hash32(n)
+    for data in chunks:
+        for i in range(len(data)):
+            # <python-only>
+            h = hash32(h ^ data[i])
+            # </python-only>
+            # <codon-only>
+            h = hash32(h ^ int(data.ptr[i]))
+            # </codon-only>
+    return n, h
+
+
 class Image:
     width: int
     height: int
-    colors: List[List[Color]]
+    texels: List[UInt[8]]  # Not in book: 3 bytes per texel, row-major, as stored in the image
+    lut: List[float]       # Linear value of each byte
 
     def __init__(self, image_filename):
+        self.lut = [linearize(x) for x in range(256)]
+
+        # TODO: Might need to do gamma correction
+
+        path = f"{image_filename}.rtowtex"
+        size, h = source_key(image_filename)
+        if self.load(path, size, h):
+            return
+
+        # Decoded into the cache file, then mapped from it like a cached texture
+        if decode_to_file(image_filename, path, magic, size, h) and self.load(path, size, h):
+            return
+
+        # The cache is only an optimization, images in read-only directories are decoded every time
         pixels = load_image(image_filename)
         self.height = len(pixels)
         self.width = len(pixels[0])
 
-        # TODO: Might need to do gamma correction
-
-        self.colors = [
-            [Color(linearize(pixel[0]), linearize(pixel[1]), linearize(pixel[2])) for pixel in row]
-            for row in pixels
-        ]
+        self.texels = []
+        for row in pixels:
+            for pixel in row:
+                self.texels.append(UInt[8](pixel[0]))
+                self.texels.append(UInt[8](pixel[1]))
+                self.texels.append(UInt[8](pixel[2]))
+
+    def load(self, path: str, size: int, h: int) -> bool:
+        """Use the texels cached at path, if they were decoded from the same image."""
+        try:
+            reader = BinaryReader(path)
+        except IOError:
+            return False
+
+        if reader.size() < 40 or reader.read_magic() != magic:
+            return False
+        header = reader.read_ints(4)
+        if header[2] != size or header[3] != h or reader.size() != 40 + 3 * header[0] * header[1]:
+            return False
+
+        self.width = header[0]
+        self.height = header[1]
+        self.texels = reader.read_bytes(3 * self.width * self.height)
+        return True
 
     def __getitem__(self, xy: Tuple[int, int]) -> Color:
         x, y = xy
         x = clamp(x, 0, self.width)
         y = clamp(y, 0, self.height)
 
-        return self.colors[y][x]
+        k = 3 * (y * self.width + x)
+        lut = self.lut
+        return Color(lut[int(self.texels[k])], lut[int(self.texels[k + 1])], lut[int(self.texels[k + 2])])
+
+    # <python-only>
+    def __getstate__(self):
+        # Texels mapped from the cache file can't be pickled and sent to worker processes
+        state = dict(self.__dict__)
+        if isinstance(self.texels, memoryview):
+            state["texels"] = self.texels.tolist()
+        return state
+    # </python-only>
 
 
 if __name__ == "__main__":
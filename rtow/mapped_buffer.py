@@ -0,0 +1,150 @@
+from typing import List
+
+# <python-only>
+import mmap
+# </python-only>
+
+from .buffer import Buffer, pixel_floats
+from .binio import BinaryWriter
+from .tiles import Tile
+from .vec3 import Color
+
+# <codon-only>
+from C import mmap(cobj, int, i32, i32, i32, int) -> cobj
+from C import msync(cobj, int, i32) -> i32
+from C import madvise(cobj, int, i32) -> i32
+from C import munmap(cobj, int) -> i32
+from C import fileno(cobj) -> i32
+from C import ftruncate(i32, int) -> i32
+from C import uname(cobj) -> i32
+# </codon-only>
+
+
+# Not in book: framebuffers for images larger than memory. The floats of the Buffer are a
+# file mapped in memory: tiles are added straight into it, and the image is encoded from it
+# row by row (Buffer.save). Pages are written back to the file and dropped from memory once
+# max_resident bytes have been touched since the last time, so that what the render holds is
+# bounded by the tiles in flight, not by the size of the image.
+
+magic = "RTOWFBF1"
+
+# Image width and height
+header_ints = 2
+header_bytes = 8 * (1 + header_ints)
+
+# Memory is mapped by pages of at least 4 KB, touching a float keeps its whole page resident
+page_size = 4096
+
+# <codon-only>
+def system_name() -> str:
+    """Name of the kernel, "Linux" or "Darwin": sysname, the first field of struct utsname."""
+    utsname = Ptr[byte](4096)
+    assert uname(utsname) == i32(0), "Could not get the name of the system"
+    return str.from_ptr(utsname)
+
+
+# Flags of mmap, msync and madvise, from <sys/mman.h>. Linux and macOS share their values but
+# for MS_SYNC, which is 0x10 on macOS (where 4 is MS_KILLPAGES, dropping the pages unwritten).
+# These bindings have not been compiled yet, Tracer rejects framebuffer files in Codon builds
+PROT_READ = i32(0x1)
+PROT_WRITE = i32(0x2)
+MAP_SHARED = i32(0x1)
+MS_SYNC_LINUX = i32(0x4)
+MS_SYNC_MACOS = i32(0x10)
+MADV_DONTNEED = i32(0x4)
+
+# Address returned by mmap when it fails, (void *) -1
+MAP_FAILED = -1
+# </codon-only>
+
+
+class MappedBuffer(Buffer):
+    """
+    Buffer whose floats are mapped from a file: a header (magic, width, height), then the
+    floats in the layout of Buffer. The file is left on disk when the render is done.
+    """
+
+    path: str
+    size: int           # Size of the file in bytes
+    max_resident: int   # Bytes touched between two releases of the mapped pages
+    touched: int        # Bytes of the pages touched since the last release
+    # <python-only>
+    mapping: mmap.mmap
+    # </python-only>
+    # <codon-only>
+    mapping: cobj
+    # </codon-only>
+
+    def __init__(self, path: str, w: int, h: int, max_resident: int = 64 << 20):
+        self.w = w
+        self.h = h
+        self.path = path
+        self.size = header_bytes + 4 * pixel_floats * w * h
+        self.max_resident = max_resident
+        self.touched = 0
+
+        writer = BinaryWriter(path)
+        writer.write_magic(magic)
+        writer.write_ints([w, h])
+        writer.close()
+
+        # The rest of the file is extended with zeros, which take no space on disk until written
+        # <python-only>
+        with open(path, "r+b") as f:
+            f.truncate(self.size)
+            self.mapping = mmap.mmap(f.fileno(), self.size)
+        self.data = memoryview(self.mapping)[header_bytes:].cast("f")
+        # </python-only>
+        # <codon-only>
+        with open(path, "r+b") as f:
+            fd = fileno(f.fp)
+            assert ftruncate(fd, self.size) == i32(0), f"Could not extend {path}"
+            self.mapping = mmap(cobj(), self.size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0)
+        assert int(self.mapping) != MAP_FAILED, f"Could not map {path}"
+        n = pixel_floats * w * h
+        self.data = List[float32](Array[float32](Ptr[float32](self.mapping + header_bytes), n), n)
+        # </codon-only>
+
+    def touch(self, n: int):
+        """Count n bytes of pages touched, they are released once they add up to max_resident."""
+        self.touched += n
+        if self.touched >= self.max_resident:
+            self.release()
+
+    def release(self):
+        """Write the pages back to the file and drop them from memory, they are read again when touched."""
+        # <python-only>
+        self.mapping.flush()
+        self.mapping.madvise(mmap.MADV_DONTNEED)
+        # </python-only>
+        # <codon-only>
+        ms_sync = MS_SYNC_MACOS if system_name() == "Darwin" else MS_SYNC_LINUX
+        assert msync(self.mapping, self.size, ms_sync) == i32(0), f"Could not write back {self.path}"
+        madvise(self.mapping, self.size, MADV_DONTNEED)
+        # </codon-only>
+        self.touched = 0
+
+    def add(self, x: int, y: int, c: Color, samples: int):
+        super().add(x, y, c, samples)
+        # Pixels are added in order, a page is touched again and again before the next
+        self.touch(4 * pixel_floats)
+
+    def row(self, y: int) -> List[float32]:
+        self.touch(4 * pixel_floats * self.w + page_size)
+        return super().row(y)
+
+    def paste(self, tile: Tile, pixels: List[float], offset: int = 0):
+        super().paste(tile, pixels, offset)
+        # Every row of the tile is in pages of its own
+        self.touch(tile.height() * (4 * pixel_floats * tile.width() + page_size))
+
+    def close(self):
+        """Write the floats back to the file and unmap it, the buffer can't be used after."""
+        self.release()
+        # <python-only>
+        self.data.release()
+        self.mapping.close()
+        # </python-only>
+        # <codon-only>
+        munmap(self.mapping, self.size)
+        # </codon-only>
@@ -1,10 +1,10 @@
 from math import sqrt
-from random import random
 from typing import Optional
 
 from .. import Ray, Color
 from ..objects import Hit
-from ..materials import Material, Scatter
+from ..rng import Rng
+from .material import Material, Scatter, dielectric
 
 
 def reflectance(cosine: float, refractive_index: float):
@@ -22,7 +22,7 @@ class Dielectric(Material):
     def __init__(self, refractive_index: float):
         self.refractive_index = refractive_index
 
-    def scatter(self, r_in: Ray, hit: Hit) -> Optional[Scatter]:
+    def scatter(self, r_in: Ray, hit: Hit, rng: Rng) -> Optional[Scatter]:
         index_ratio = (1.0 / self.refractive_index) if hit.front_face else self.refractive_index
 
         unit_direction = r_in.direction.unit()
@@ -31,7 +31,7 @@ class Dielectric(Material):
 
         cannot_refract = index_ratio * sin_theta > 1.0
 
-        if cannot_refract or reflectance(cos_theta, index_ratio) > random():
+        if cannot_refract or reflectance(cos_theta, index_ratio) > rng.random():
             direction = unit_direction.reflect(hit.normal)
         else:
             direction = unit_direction.refract(hit.normal, index_ratio)
@@ -40,3 +40,6 @@ class Dielectric(Material):
             scattered=Ray(hit.p, direction, r_in.time),
             attenuation=Color(1.0, 1.0, 1.0),
         )
+
+    def kind(self) -> int:
+        return dielectric
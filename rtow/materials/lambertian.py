@@ -3,8 +3,9 @@ from typing import Optional
 
 from .. import Ray, Color, Vec3
 from ..objects import Hit
+from ..rng import Rng
 from ..textures import Texture, SolidColor
-from .material import Material, Scatter
+from .material import Material, Scatter, lambertian
 
 
 class Lambertian(Material):
@@ -17,15 +18,18 @@ class Lambertian(Material):
     def from_color(albedo: Color = Color(0, 0, 0)):
         return Lambertian(SolidColor(albedo))
 
-    def scatter(self, r_in: Ray, hit: Hit) -> Optional[Scatter]:
-        scatter_direction = hit.normal + Vec3.random_unit()
-
-        # Catch degenerate scatter direction: rare case when the random direction
-        # is exactly opposite of the normal, which results in a zero length vector
-        if scatter_direction.near_zero():
-            scatter_direction = hit.normal
+    def scatter(self, r_in: Ray, hit: Hit, rng: Rng) -> Optional[Scatter]:
+        # Not in book: sampled directly with the cosine distribution of normal + random_unit,
+        # which also never gives the degenerate zero length direction
+        scatter_direction = Vec3.random_cosine_direction(hit.normal, rng)
 
         return Scatter(
             scattered=Ray(hit.p, scatter_direction, r_in.time),
-            attenuation=self.texture.value(hit.u, hit.v, hit.p),
+            attenuation=self.texture.filtered_value(hit.u, hit.v, hit.p, hit.footprint, r_in.stats),
         )
+
+    def needs_uv(self) -> bool:
+        return self.texture.needs_uv()
+
+    def kind(self) -> int:
+        return lambertian
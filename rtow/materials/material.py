@@ -2,6 +2,7 @@ from typing import Optional
 
 from .. import Ray, Color
 from ..objects import Hit
+from ..rng import Rng
 
 
 class Scatter:
@@ -13,6 +14,17 @@ class Scatter:
         self.scattered = scattered
 
 
+# Not in book: material types, the wavefront integrator shades the hits of each type together
+other, lambertian, metal, dielectric = 0, 1, 2, 3
+
+
 class Material:
-    def scatter(self, r_in: Ray, hit: Hit) -> Optional[Scatter]:
+    def scatter(self, r_in: Ray, hit: Hit, rng: Rng) -> Optional[Scatter]:
         assert False, "Calling abstract"
+
+    def needs_uv(self) -> bool:
+        # Not in book: whether scatter reads the texture coordinates of the hit
+        return False
+
+    def kind(self) -> int:
+        return other
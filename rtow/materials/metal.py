@@ -2,7 +2,8 @@ from typing import Optional
 
 from .. import Ray, Color, Vec3
 from ..objects import Hit
-from .material import Material, Scatter
+from ..rng import Rng
+from .material import Material, Scatter, metal
 
 
 class Metal(Material):
@@ -13,9 +14,9 @@ class Metal(Material):
         self.albedo = albedo
         self.fuzz = fuzz
 
-    def scatter(self, r_in: Ray, hit: Hit) -> Optional[Scatter]:
+    def scatter(self, r_in: Ray, hit: Hit, rng: Rng) -> Optional[Scatter]:
         reflected = r_in.direction.reflect(hit.normal).unit()
-        reflected += self.fuzz * Vec3.random_unit()
+        reflected += self.fuzz * Vec3.random_unit(rng)
 
         if reflected.dot(hit.normal) <= 0:
             return None
@@ -24,3 +25,6 @@ class Metal(Material):
             scattered=Ray(hit.p, reflected, r_in.time),
             attenuation=self.albedo,
         )
+
+    def kind(self) -> int:
+        return metal
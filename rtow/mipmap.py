@@ -0,0 +1,320 @@
+from math import floor, log2
+from threading import Lock
+from typing import List, Optional, Tuple
+
+from .vec3 import Color
+from .image import Image, source_key, linearize
+from .binio import BinaryReader, BinaryWriter
+from .stats import RenderStats
+
+
+# Not in book: textures too large to hold in memory. The image is converted once to a mip
+# pyramid (the image, then halved again and again down to 1 texel) cut in square tiles of
+# 8-bit texels, written next to the image. Renders map that file and decode tiles to linear
+# colors on demand, keeping the recently used ones in a cache of bounded size.
+
+magic = "RTOWMIP1"
+tile_size = 64
+tile_bytes = 3 * tile_size * tile_size
+
+# Base width and height, count of levels, size and hash of the image (see image.source_key)
+header_ints = 5
+
+
+def to_byte(linear: float) -> UInt[8]:
+    # Inverse of linearize, rounded to the nearest byte
+    if linear <= 0:
+        return UInt[8](0)
+    return UInt[8](min(255, int(255.0 * linear ** (1 / 2.2) + 0.5)))
+
+
+def level_sizes(width: int, height: int) -> List[Tuple[int, int]]:
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width, height = max(1, width // 2), max(1, height // 2)
+        sizes.append((width, height))
+    return sizes
+
+
+def downsample(band: List[UInt[8]], w: int, h: int, y0: int, lut: List[float]) -> List[UInt[8]]:
+    """
+    Rows of the level below made from a band of a level of w x h texels, the rows y0 to
+    y0 + tile_size (or to the last row): every texel is the mean of 2 x 2 texels, in linear
+    colors. y0 is even, so every row below comes from a single band.
+    """
+    nw, nh = max(1, w // 2), max(1, h // 2)
+    out: List[UInt[8]] = []
+    for y in range(y0 // 2, min(nh, (y0 + tile_size) // 2)):
+        r0, r1 = (min(2 * y, h - 1) - y0) * w, (min(2 * y + 1, h - 1) - y0) * w
+        for x in range(nw):
+            x0, x1 = min(2 * x, w - 1), min(2 * x + 1, w - 1)
+            for c in range(3):
+                total = (
+                    lut[int(band[3 * (r0 + x0) + c])] + lut[int(band[3 * (r0 + x1) + c])] +
+                    lut[int(band[3 * (r1 + x0) + c])] + lut[int(band[3 * (r1 + x1) + c])]
+                )
+                out.append(to_byte(0.25 * total))
+    return out
+
+
+def cut_tiles(band: List[UInt[8]], w: int, rows: int) -> List[UInt[8]]:
+    """
+    Texels of a band of a level (rows of w texels, at most tile_size) reordered tile by tile,
+    tiles past the edges of the level padded with its edge texels.
+    """
+    out: List[UInt[8]] = []
+    for tx in range((w + tile_size - 1) // tile_size):
+        for y in range(tile_size):
+            row = min(y, rows - 1) * w
+            for x in range(tile_size):
+                k = 3 * (row + min(tx * tile_size + x, w - 1))
+                out.append(band[k])
+                out.append(band[k + 1])
+                out.append(band[k + 2])
+    return out
+
+
+class PyramidWriter:
+    """
+    Writes the tiles of every level of a mip pyramid in one pass over the image, band by band
+    of tile_size rows: each band is cut into tiles at the position of its level in the file,
+    and downsampled into the band of the level below, written once it is full. Besides the
+    image, what it holds is a band per level, not the levels.
+    """
+
+    writer: BinaryWriter
+    sizes: List[Tuple[int, int]]
+    positions: List[int]        # Offset in the file of the next tiles of each level
+    starts: List[int]           # First row of the next band of each level
+    pending: List[List[UInt[8]]]  # Rows of the next band of each level made so far
+    lut: List[float]
+
+    def __init__(self, path: str, width: int, height: int, size: int, h: int, lut: List[float]):
+        self.sizes = level_sizes(width, height)
+        self.lut = lut
+        self.writer = BinaryWriter(path)
+        self.writer.write_magic(magic)
+        self.writer.write_ints([width, height, len(self.sizes), size, h])
+
+        self.positions = []
+        position = 8 * (1 + header_ints)
+        for lw, lh in self.sizes:
+            self.positions.append(position)
+            position += tile_bytes * ((lw + tile_size - 1) // tile_size) * ((lh + tile_size - 1) // tile_size)
+        self.starts = [0 for _ in self.sizes]
+        self.pending = [[] for _ in self.sizes]
+
+    def add_band(self, level: int, band: List[UInt[8]]):
+        """Add the next band of a level, rows starts[level] to starts[level] + tile_size or to the last row."""
+        lw, lh = self.sizes[level]
+        y0 = self.starts[level]
+        tiles = cut_tiles(band, lw, min(tile_size, lh - y0))
+        self.writer.seek(self.positions[level])
+        self.writer.write_bytes(tiles)
+        self.positions[level] += len(tiles)
+        self.starts[level] += tile_size
+
+        if level + 1 == len(self.sizes):
+            return
+        below = self.pending[level + 1]
+        below.extend(downsample(band, lw, lh, y0, self.lut))
+        nw, nh = self.sizes[level + 1]
+        rows = min(tile_size, nh - self.starts[level + 1])
+        if rows > 0 and len(below) >= 3 * nw * rows:
+            self.pending[level + 1] = []
+            self.add_band(level + 1, below)
+
+    def close(self):
+        self.writer.close()
+
+
+def build_pyramid(image: Image, path: str, size: int, h: int):
+    """Write the mip pyramid of image to path, reading it band by band (see PyramidWriter)."""
+    pyramid = PyramidWriter(path, image.width, image.height, size, h, image.lut)
+    row_bytes = 3 * image.width
+    for y0 in range(0, image.height, tile_size):
+        y1 = min(image.height, y0 + tile_size)
+        pyramid.add_band(0, image.texels[y0 * row_bytes:y1 * row_bytes])
+    pyramid.close()
+
+
+class MipTexture:
+    """
+    Mip pyramid of an image, read tile by tile from its file. Decoded tiles are kept in a
+    cache of at most max_bytes, a tile not used recently is replaced on a miss (CLOCK: the
+    slots are swept in a ring, and tiles used since the last sweep get a second chance).
+
+    Render threads share the cache. A hit only reads the decoded tile of its index and marks
+    it used, without locking: a tile evicted meanwhile stays valid for the thread holding
+    it. Misses take the lock to insert the tile they decoded. Hits, misses and evictions are
+    counted in the RenderStats of the tile being rendered, not in shared counters.
+    """
+
+    path: str
+    width: int
+    height: int
+    widths: List[int]       # Size of each level
+    heights: List[int]      #
+    tiles_x: List[int]      # Tiles per row of each level
+    first_tile: List[int]   # Index of the first tile of each level
+    lut: List[float]
+    reader: BinaryReader
+    tiles: List[UInt[8]]    # Every tile of every level, mapped from the file
+    capacity: int           # Count of decoded tiles the cache holds
+    decoded: List[List[float]]  # Per tile: 3 linear floats per texel if cached, else empty
+    used: List[bool]            # Per tile: used since the clock hand last passed it
+    slot_tile: List[int]        # Tile held by each slot of the ring
+    hand: int                   # Next slot to consider for eviction
+    lock: Lock  # Held by misses only
+
+    def __init__(self, image_filename: str, max_bytes: int = 64 << 20):
+        self.path = f"{image_filename}.rtowmip"
+        self.lut = [linearize(x) for x in range(256)]
+        self.capacity = max(1, max_bytes // (8 * tile_bytes))
+        self.lock = Lock()
+
+        size, h = source_key(image_filename)
+        if not self.load(size, h):
+            build_pyramid(Image(image_filename), self.path, size, h)
+            assert self.load(size, h), f"Invalid mip pyramid: {self.path}"
+        self.reset()
+
+    def reset(self):
+        """Empty the cache."""
+        count = len(self.tiles) // tile_bytes
+        self.decoded = [[] for _ in range(count)]
+        self.used = [False for _ in range(count)]
+        self.slot_tile = []
+        self.hand = 0
+
+    def load(self, size: int, h: int) -> bool:
+        try:
+            self.reader = BinaryReader(self.path)
+        except IOError:
+            return False
+
+        if self.reader.size() < 8 * (1 + header_ints) or self.reader.read_magic() != magic:
+            return False
+        header = self.reader.read_ints(header_ints)
+        if header[3] != size or header[4] != h:
+            return False
+
+        self.width, self.height = header[0], header[1]
+        self.widths, self.heights, self.tiles_x, self.first_tile = [], [], [], []
+        count = 0
+        for lw, lh in level_sizes(self.width, self.height):
+            tx = (lw + tile_size - 1) // tile_size
+            self.widths.append(lw)
+            self.heights.append(lh)
+            self.tiles_x.append(tx)
+            self.first_tile.append(count)
+            count += tx * ((lh + tile_size - 1) // tile_size)
+
+        if len(self.widths) != header[2] or self.reader.size() != 8 * (1 + header_ints) + count * tile_bytes:
+            return False
+        self.tiles = self.reader.read_bytes(count * tile_bytes)
+        return True
+
+    def tile(self, index: int, stats: Optional[RenderStats] = None) -> List[float]:
+        """Decoded texels of a tile, from the cache or from the file, counted in stats."""
+        texels = self.decoded[index]
+        if len(texels) > 0:
+            # Written only when it changes, so that hits leave shared memory alone
+            if not self.used[index]:
+                self.used[index] = True
+            if stats:
+                stats.add_texture_tile(True)
+            return texels
+
+        # Decoded outside of the lock, another thread may insert the same tile meanwhile
+        start = index * tile_bytes
+        texels = [self.lut[int(self.tiles[start + k])] for k in range(tile_bytes)]
+        if stats:
+            stats.add_texture_tile(False)
+
+        with self.lock:
+            if len(self.decoded[index]) > 0:
+                return self.decoded[index]
+
+            if len(self.slot_tile) < self.capacity:
+                self.slot_tile.append(index)
+            else:
+                # Sweep the ring for a tile not used since the last sweep, clearing the marks
+                # of those that were
+                while self.used[self.slot_tile[self.hand]]:
+                    self.used[self.slot_tile[self.hand]] = False
+                    self.hand = (self.hand + 1) % self.capacity
+                self.decoded[self.slot_tile[self.hand]] = []
+                if stats:
+                    stats.add_texture_eviction()
+                self.slot_tile[self.hand] = index
+                self.hand = (self.hand + 1) % self.capacity
+
+            self.used[index] = True
+            self.decoded[index] = texels
+            return texels
+
+    def texel_offset(self, level: int, x: int, y: int, stats: Optional[RenderStats]) -> Tuple[List[float], int]:
+        """Decoded tile holding texel x, y of a level (clamped to its edges), and the offset of the texel in it."""
+        x = min(max(x, 0), self.widths[level] - 1)
+        y = min(max(y, 0), self.heights[level] - 1)
+        tile = self.first_tile[level] + (y // tile_size) * self.tiles_x[level] + x // tile_size
+        return self.tile(tile, stats), 3 * ((y % tile_size) * tile_size + x % tile_size)
+
+    def bilinear(self, level: int, u: float, v: float, stats: Optional[RenderStats]) -> Color:
+        x = u * self.widths[level] - 0.5
+        y = v * self.heights[level] - 0.5
+        x0, y0 = floor(x), floor(y)
+        fx, fy = x - x0, y - y0
+        ix, iy = int(x0), int(y0)
+
+        # A tile per tap, then the 3 channels of its texel
+        t00, k00 = self.texel_offset(level, ix, iy, stats)
+        t10, k10 = self.texel_offset(level, ix + 1, iy, stats)
+        t01, k01 = self.texel_offset(level, ix, iy + 1, stats)
+        t11, k11 = self.texel_offset(level, ix + 1, iy + 1, stats)
+
+        rgb = [0.0, 0.0, 0.0]
+        for c in range(3):
+            top = (1 - fx) * t00[k00 + c] + fx * t10[k10 + c]
+            bottom = (1 - fx) * t01[k01 + c] + fx * t11[k11 + c]
+            rgb[c] = (1 - fy) * top + fy * bottom
+        return Color(rgb[0], rgb[1], rgb[2])
+
+    def lookup(self, u: float, v: float, footprint: float, stats: Optional[RenderStats] = None) -> Color:
+        """
+        Filtered color at u, v (v going down the image) for a footprint as wide as footprint
+        in texture coordinates: bilinear in the two levels whose texels are closest to that
+        width, blended (trilinear filtering). The tiles read are counted in stats.
+        """
+
+        texels = footprint * self.height
+        last = len(self.widths) - 1
+        if texels <= 1:
+            return self.bilinear(0, u, v, stats)
+
+        level = log2(texels)
+        if level >= last:
+            return self.bilinear(last, u, v, stats)
+
+        l0 = int(level)
+        f = level - l0
+        return (1 - f) * self.bilinear(l0, u, v, stats) + f * self.bilinear(l0 + 1, u, v, stats)
+
+    # <python-only>
+    def __getstate__(self):
+        # Mapped files and locks can't be pickled and sent to worker processes, which map
+        # the file again and start with an empty cache
+        state = dict(self.__dict__)
+        for name in ["reader", "tiles", "lock", "decoded", "used", "slot_tile"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+        self.reader = BinaryReader(self.path)
+        self.reader.offset = 8 * (1 + header_ints)
+        self.tiles = self.reader.read_bytes(self.reader.size() - self.reader.offset)
+        self.reset()
+    # </python-only>
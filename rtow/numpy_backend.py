@@ -0,0 +1,355 @@
+# <python-only>
+from math import pi
+
+import numpy as np
+
+from .buffer import Buffer, pixel_floats
+from .flat_bvh import FlatBVH
+from .tiles import Tile, make_tiles
+from .vec3 import Point3, Vec3
+from .materials import Lambertian, Metal, Dielectric
+from .textures import Texture, SolidColor, Checker, NoiseTexture
+from .perlin import Perlin
+
+
+# Not in book: render backend for CPython and PyPy where every sample of a tile is traced at
+# once, as NumPy arrays of rays instead of Ray objects. Each bounce intersects all the paths
+# still alive, shades them by material, then drops the ones that ended before the next bounce.
+# The random sequences are NumPy's, the images match the scalar ones statistically, not bit
+# for bit. Solid, checker and noise textures are evaluated for all the hits at once.
+
+t_min = 0.001
+
+lambertian, metal, dielectric = 0, 1, 2
+
+
+def vec(v: Vec3) -> np.ndarray:
+    return np.array([v.x, v.y, v.z], dtype=np.float64)
+
+
+def dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1)
+
+
+def unit(v: np.ndarray) -> np.ndarray:
+    return v / np.sqrt(dot(v, v))[:, None]
+
+
+def random_unit(rng: np.random.Generator, n: int) -> np.ndarray:
+    # Normalized gaussian vectors are uniform on the sphere, without rejection
+    return unit(rng.standard_normal((n, 3)))
+
+
+class SceneArrays:
+    """Nodes, spheres and materials of a scene, as arrays indexed by node and primitive."""
+
+    def __init__(self, bvh: FlatBVH):
+        self.bounds = np.array(bvh.bounds, dtype=np.float64).reshape(-1, 6)
+        self.offsets = np.array(bvh.offsets, dtype=np.int64)
+        self.counts = np.array(bvh.counts, dtype=np.int64)
+
+        data = [p.sphere_data() for p in bvh.primitives]
+        assert all(len(d) == 7 for d in data), "The NumPy backend only renders spheres"
+        data = np.array(data, dtype=np.float64).reshape(-1, 7)
+        self.centers = data[:, 0:3]
+        self.radii = data[:, 3]
+        self.directions = data[:, 4:7]
+
+        # Every distinct material object gets an index
+        self.materials = []
+        indices = {}
+        material_ids = []
+        for p in bvh.primitives:
+            if id(p.mat) not in indices:
+                indices[id(p.mat)] = len(self.materials)
+                self.materials.append(p.mat)
+            material_ids.append(indices[id(p.mat)])
+        self.material_ids = np.array(material_ids, dtype=np.int64)
+
+        m = len(self.materials)
+        self.kinds = np.zeros(m, dtype=np.int64)
+        self.albedos = np.zeros((m, 3))
+        self.fuzz = np.zeros(m)
+        self.refractive_indices = np.ones(m)
+        self.textured = np.zeros(m, dtype=bool)  # Lambertian with a texture that is not a solid color
+
+        for k, mat in enumerate(self.materials):
+            if isinstance(mat, Lambertian):
+                self.kinds[k] = lambertian
+                if isinstance(mat.texture, SolidColor):
+                    self.albedos[k] = vec(mat.texture.albedo)
+                else:
+                    self.textured[k] = True
+            elif isinstance(mat, Metal):
+                self.kinds[k] = metal
+                self.albedos[k] = vec(mat.albedo)
+                self.fuzz[k] = mat.fuzz
+            elif isinstance(mat, Dielectric):
+                self.kinds[k] = dielectric
+                self.refractive_indices[k] = mat.refractive_index
+            else:
+                assert False, f"The NumPy backend can't render {type(mat).__name__} materials"
+
+    def sphere_hits(self, o, d, time, a, closest, rays, prims) -> np.ndarray:
+        """Distances of the hits of rays with the spheres prims, p_inf for misses."""
+        dd = d[rays]
+        oc = self.centers[prims] + time[rays, None] * self.directions[prims] - o[rays]
+        h = dot(dd, oc)
+        c = dot(oc, oc) - self.radii[prims] * self.radii[prims]
+        aa = a[rays]
+        limit = closest[rays]
+
+        discriminant = h * h - aa * c
+        found = discriminant >= 0
+        sqrtd = np.sqrt(np.where(found, discriminant, 0.0))
+
+        root = (h - sqrtd) / aa
+        near = found & (t_min < root) & (root < limit)
+        root2 = (h + sqrtd) / aa
+        far = found & ~near & (t_min < root2) & (root2 < limit)
+        return np.where(near, root, np.where(far, root2, np.inf))
+
+    def closest_hits(self, o, d, time):
+        """
+        Distance and primitive of the closest hit of every ray (-1 for misses). The BVH is
+        traversed breadth-first by all rays together: every step tests a list of (ray, node)
+        pairs, intersects the leaves and replaces interior nodes by their two children.
+        """
+
+        n = len(o)
+        with np.errstate(divide="ignore"):
+            inverse = np.where(d != 0, 1.0 / d, 1e300)
+        a = dot(d, d)
+        closest = np.full(n, np.inf)
+        prim = np.full(n, -1, dtype=np.int64)
+
+        rays = np.arange(n)
+        nodes = np.zeros(n, dtype=np.int64)
+
+        while len(rays) > 0:
+            b = self.bounds[nodes]
+            oo = o[rays]
+            ii = inverse[rays]
+            with np.errstate(over="ignore", invalid="ignore"):
+                t0 = (b[:, 0:3] - oo) * ii
+                t1 = (b[:, 3:6] - oo) * ii
+            entry = np.maximum(np.minimum(t0, t1).max(axis=1), t_min)
+            exit = np.minimum(np.maximum(t0, t1).min(axis=1), closest[rays])
+
+            inside = entry < exit
+            rays, nodes = rays[inside], nodes[inside]
+            counts = self.counts[nodes]
+            leaf = counts > 0
+
+            if leaf.any():
+                leaf_rays, leaf_nodes, leaf_counts = rays[leaf], nodes[leaf], counts[leaf]
+                total = int(leaf_counts.sum())
+                pair_rays = np.repeat(leaf_rays, leaf_counts)
+                starts = np.repeat(np.cumsum(leaf_counts) - leaf_counts, leaf_counts)
+                pair_prims = np.repeat(self.offsets[leaf_nodes], leaf_counts) + np.arange(total) - starts
+
+                t = self.sphere_hits(o, d, time, a, closest, pair_rays, pair_prims)
+                found = t < np.inf
+                pair_rays, pair_prims, t = pair_rays[found], pair_prims[found], t[found]
+                np.minimum.at(closest, pair_rays, t)
+                nearest = t == closest[pair_rays]
+                prim[pair_rays[nearest]] = pair_prims[nearest]
+
+            interior = ~leaf
+            rays, nodes = rays[interior], nodes[interior]
+            rays = np.concatenate([rays, rays])
+            nodes = np.concatenate([nodes + 1, self.offsets[nodes]])
+
+        return closest, prim
+
+
+def perlin_noise(perlin: Perlin, p: np.ndarray) -> np.ndarray:
+    """Same as Perlin.noise_at, for all the points of p at once."""
+    gradients = np.array(perlin.gradients).reshape(-1, 3)
+    perm_x, perm_y, perm_z = np.array(perlin.perm_x), np.array(perlin.perm_y), np.array(perlin.perm_z)
+
+    cell = np.floor(p)
+    d = p - cell
+    ix, iy, iz = cell.astype(np.int64).T
+    h = d * d * (3 - 2 * d)
+
+    accu = np.zeros(len(p))
+    for i in range(2):
+        for j in range(2):
+            for k in range(2):
+                g = gradients[perm_x[(ix + i) & 255] ^ perm_y[(iy + j) & 255] ^ perm_z[(iz + k) & 255]]
+                w = (
+                    (h[:, 0] if i else 1 - h[:, 0]) *
+                    (h[:, 1] if j else 1 - h[:, 1]) *
+                    (h[:, 2] if k else 1 - h[:, 2])
+                )
+                accu += w * dot(g, d - np.array([i, j, k]))
+    return accu
+
+
+def texture_values(texture: Texture, u, v, p) -> np.ndarray:
+    if isinstance(texture, SolidColor):
+        return np.broadcast_to(vec(texture.albedo), p.shape)
+    if isinstance(texture, Checker):
+        cells = np.floor(texture.inv_scale * p).astype(np.int64).sum(axis=1)
+        even = (cells % 2 == 0)[:, None]
+        return np.where(even, texture_values(texture.even, u, v, p), texture_values(texture.odd, u, v, p))
+    if isinstance(texture, NoiseTexture):
+        values = 0.5 * (1.0 + perlin_noise(texture.noise, texture.scale * p))
+        return np.repeat(values[:, None], 3, axis=1)
+
+    # Other textures are looked up one point at a time
+    values = np.empty(p.shape)
+    for k in range(len(p)):
+        c = texture.value(float(u[k]), float(v[k]), Point3(float(p[k, 0]), float(p[k, 1]), float(p[k, 2])))
+        values[k] = (c.x, c.y, c.z)
+    return values
+
+
+def camera_rays(tracer, tile: Tile, rng: np.random.Generator):
+    """Origins, directions and times of every sample of a tile, same as Tracer.get_ray."""
+    spp = tracer.samples_per_pixel
+    jj, ii = np.mgrid[tile.y0:tile.y1, tile.x0:tile.x1]
+    i = np.repeat(ii.ravel(), spp)
+    j = np.repeat(jj.ravel(), spp)
+    n = len(i)
+
+    offset = rng.random((n, 2)) - 0.5
+    pixel_sample = (
+        vec(tracer.pixel00_loc) +
+        (i + offset[:, 0])[:, None] * vec(tracer.pixel_delta_u) +
+        (j + offset[:, 1])[:, None] * vec(tracer.pixel_delta_v)
+    )
+
+    if tracer.camera_mode == "perspective":
+        origin = np.broadcast_to(vec(tracer.center), (n, 3)).copy()
+    else:
+        origin = pixel_sample + vec(tracer.w) * tracer.focus_dist
+
+    if tracer.defocus_angle > 0:
+        # Uniform point in the unit disk, without rejection
+        radius = np.sqrt(rng.random(n))
+        angle = 2 * pi * rng.random(n)
+        origin += (
+            (radius * np.cos(angle))[:, None] * vec(tracer.defocus_disk_u) +
+            (radius * np.sin(angle))[:, None] * vec(tracer.defocus_disk_v)
+        )
+
+    return origin, pixel_sample - origin, rng.random(n)
+
+
+def render_tile(tracer, scene: SceneArrays, tile: Tile) -> np.ndarray:
+    """Sum of the colors of the samples of every pixel of a tile, in row-major order."""
+    rng = np.random.default_rng(tile.seed)
+    pixel_count = tile.width() * tile.height()
+    colors = np.zeros((pixel_count, 3))
+
+    o, d, time = camera_rays(tracer, tile, rng)
+    pixels = np.repeat(np.arange(pixel_count), tracer.samples_per_pixel)
+    throughput = np.ones((len(o), 3))
+
+    for _ in range(tracer.max_depth):
+        if len(o) == 0:
+            break
+
+        t, prim = scene.closest_hits(o, d, time)
+
+        # Sky
+        miss = prim < 0
+        if miss.any():
+            a = 0.5 * (unit(d[miss])[:, 1] + 1.0)
+            sky = (1.0 - a)[:, None] + a[:, None] * np.array([0.5, 0.7, 1.0])
+            np.add.at(colors, pixels[miss], throughput[miss] * sky)
+
+        hit = ~miss
+        o, d, time, pixels, throughput, t, prim = o[hit], d[hit], time[hit], pixels[hit], throughput[hit], t[hit], prim[hit]
+        n = len(o)
+
+        p = o + t[:, None] * d
+        center = scene.centers[prim] + time[:, None] * scene.directions[prim]
+        outward_normal = (p - center) / scene.radii[prim][:, None]
+        front_face = dot(d, outward_normal) < 0
+        normal = np.where(front_face[:, None], outward_normal, -outward_normal)
+
+        if tracer.render_mode == "normals":
+            np.add.at(colors, pixels, 0.5 * (normal + 1.0))
+            break
+
+        mats = scene.material_ids[prim]
+        kinds = scene.kinds[mats]
+        direction = np.empty((n, 3))
+        attenuation = scene.albedos[mats]
+        alive = np.ones(n, dtype=bool)
+
+        # Lambertian
+        k = kinds == lambertian
+        if k.any():
+            scatter_direction = normal[k] + random_unit(rng, int(k.sum()))
+            near_zero = (np.abs(scatter_direction) < 1e-8).all(axis=1)
+            direction[k] = np.where(near_zero[:, None], normal[k], scatter_direction)
+
+            for m in np.unique(mats[k & scene.textured[mats]]):
+                texture = scene.materials[m].texture
+                km = mats == m
+                u = v = np.zeros(int(km.sum()))
+                if texture.needs_uv():
+                    # Same as Sphere.get_uv
+                    on = outward_normal[km]
+                    u = (np.arctan2(-on[:, 2], on[:, 0]) + pi) / (2 * pi)
+                    v = np.arccos(np.clip(-on[:, 1], -1.0, 1.0)) / pi
+                attenuation[km] = texture_values(texture, u, v, p[km])
+
+        # Metal
+        k = kinds == metal
+        if k.any():
+            dk, nk = d[k], normal[k]
+            reflected = unit(dk - 2 * dot(dk, nk)[:, None] * nk)
+            reflected += scene.fuzz[mats[k]][:, None] * random_unit(rng, int(k.sum()))
+            direction[k] = reflected
+            alive[k] = dot(reflected, nk) > 0
+
+        # Dielectric
+        k = kinds == dielectric
+        if k.any():
+            nk = normal[k]
+            ri = scene.refractive_indices[mats[k]]
+            index_ratio = np.where(front_face[k], 1.0 / ri, ri)
+            unit_direction = unit(d[k])
+            cos_theta = np.minimum(-dot(unit_direction, nk), 1.0)
+            sin_theta = np.sqrt(1.0 - cos_theta * cos_theta)
+
+            r0 = ((1 - index_ratio) / (1 + index_ratio)) ** 2
+            reflectance = r0 + (1 - r0) * (1 - cos_theta) ** 5
+            reflect = (index_ratio * sin_theta > 1.0) | (reflectance > rng.random(int(k.sum())))
+
+            reflected = unit_direction - 2 * dot(unit_direction, nk)[:, None] * nk
+            r_out_perp = index_ratio[:, None] * (unit_direction + cos_theta[:, None] * nk)
+            r_out_parallel = -np.sqrt(np.abs(1.0 - dot(r_out_perp, r_out_perp)))[:, None] * nk
+            direction[k] = np.where(reflect[:, None], reflected, r_out_perp + r_out_parallel)
+            attenuation[k] = 1.0
+
+        # Absorbed paths end here
+        o, d, time, pixels = p[alive], direction[alive], time[alive], pixels[alive]
+        throughput = throughput[alive] * attenuation[alive]
+
+    return colors
+
+
+def render_numpy(tracer, bvh: FlatBVH) -> Buffer:
+    """Render the scene of bvh with the settings of tracer, one tile at a time."""
+    scene = SceneArrays(bvh)
+    tiles = make_tiles(tracer.image_width, tracer.image_height, tracer.tile_size, tracer.seed)
+    b = tracer.new_buffer()
+    tracer.status(-1, len(tiles), "tiles")
+
+    for n, tile in enumerate(tiles):
+        colors = render_tile(tracer, scene, tile)
+        # In the layout of Buffer: sums of the colors then count of samples
+        pixels = np.empty((len(colors), pixel_floats))
+        pixels[:, :3] = colors
+        pixels[:, 3] = tracer.samples_per_pixel
+        b.paste(tile, pixels.ravel().tolist())
+        tracer.status(n, len(tiles), "tiles")
+
+    return b
+# </python-only>
@@ -1,4 +1,5 @@
 from .hit import Hit
 from .hittable import Hittable, HitRecord
 from .sphere import Sphere
+from .sphere_set import SphereSet
 from .hittable_list import HittableList
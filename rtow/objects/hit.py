@@ -7,9 +7,11 @@ class Hit:
     u: float
     v: float
     front_face: bool
+    footprint: float  # Not in book: width of the ray cone at the hit, in texture coordinates
 
-    def __init__(self, p: Point3, outward_normal: Vec3, t: float, u: float, v: float, r: Ray):
+    def __init__(self, p: Point3, outward_normal: Vec3, t: float, u: float, v: float, r: Ray, footprint: float = 0.0):
         self.p = p
+        self.footprint = footprint
         self.t = t
         self.u = u
         self.v = v
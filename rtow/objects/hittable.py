@@ -1,7 +1,8 @@
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from .. import Ray, Interval, AABB
 from .hit import Hit
+from ..util import p_inf
 from ..materials import Material
 
 
@@ -19,7 +20,31 @@ class HitRecord:
 
 class Hittable:
     def hit(self, r: Ray, interval: Interval) -> Optional[HitRecord]:
+        # Not in book: only the distance of the candidate hits is computed while looking for the
+        # closest one, the hit record is built once, for the closest hit
+        t, primitive = self.intersect(r, interval.min, interval.max)
+        if t == p_inf:
+            return None
+        return primitive.surface(r, t)
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        """
+        Not in book: returns the distance to the closest hit strictly between t_min and t_max
+        (p_inf if there is none), and the primitive that was hit.
+        """
+        assert False, "Calling abstract"
+
+    def surface(self, r: Ray, t: float) -> HitRecord:
+        """Not in book: hit record of a primitive hit by r at distance t."""
         assert False, "Calling abstract"
 
+    def sphere_data(self) -> List[float]:
+        """
+        Not in book: center at time 0, radius and motion of a sphere as 7 floats, for packing it
+        in a SphereSet. Empty for other objects.
+        """
+        data: List[float] = []
+        return data
+
     def bounding_box(self) -> AABB:
         assert False, "Calling abstract"
@@ -1,7 +1,8 @@
-from typing import List, Optional
+from typing import List, Tuple
 
-from .. import Ray, Interval, AABB
-from .hittable import Hittable, HitRecord
+from .. import Ray, AABB
+from .hittable import Hittable
+from ..util import p_inf
 
 
 class HittableList(Hittable):
@@ -21,17 +22,23 @@ class HittableList(Hittable):
         self.objects.append(object)
         self.bbox = AABB.from_aabbs(self.bbox, object.bounding_box())
 
+    def extend(self, objects: List[Hittable], bbox: AABB):
+        # Not in book: adds many objects at once, bbox being the union of their boxes, instead
+        # of building a new union box for every object
+        self.objects.extend(objects)
+        self.bbox = bbox if len(self.objects) == len(objects) else AABB.from_aabbs(self.bbox, bbox)
+
     def bounding_box(self) -> AABB:
         return self.bbox
 
-    def hit(self, r: Ray, interval: Interval) -> Optional[HitRecord]:
-        rec: Optional[HitRecord] = None
-        closest_so_far = interval.max
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        closest_so_far = p_inf
+        primitive: Hittable = self
 
         for hittable in self.objects:
-            candidate_rec = hittable.hit(r, Interval(interval.min, closest_so_far))
-            if candidate_rec:
-                closest_so_far = candidate_rec.hit.t
-                rec = candidate_rec
+            t, candidate = hittable.intersect(r, t_min, min(closest_so_far, t_max))
+            if t < closest_so_far:
+                closest_so_far = t
+                primitive = candidate
 
-        return rec
+        return closest_so_far, primitive
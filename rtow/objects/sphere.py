@@ -1,9 +1,10 @@
 from math import acos, atan2, pi, sqrt
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
-from .. import Point3, Ray, Interval, Vec3, AABB
+from .. import Point3, Ray, Vec3, AABB
 from .hit import Hit
 from .hittable import HitRecord, Hittable
+from ..util import p_inf
 from ..materials import Material
 
 
@@ -14,6 +15,7 @@ class Sphere(Hittable):
     is_moving: bool
     direction: Vec3
     bbox: AABB
+    needs_uv: bool  # Not in book: whether the material reads the texture coordinates of hits
 
     def __repr__(self):
         return f"<Sphere center={self.center0}>"
@@ -22,6 +24,7 @@ class Sphere(Hittable):
         self.center0 = center0
         self.radius = max(0, radius)
         self.mat = mat
+        self.needs_uv = mat.needs_uv()
 
         rvec = Vec3(radius, radius, radius)
 
@@ -46,38 +49,68 @@ class Sphere(Hittable):
     def bounding_box(self) -> AABB:
         return self.bbox
 
-    def hit(self, r: Ray, interval: Interval) -> Optional[HitRecord]:
-        center = self.center(r.time) if self.is_moving else self.center0
-        oc = center - r.origin
-        a = r.direction.length_squared()
-        h = r.direction.dot(oc)
-        c = oc.length_squared() - self.radius * self.radius
+    def sphere_data(self) -> List[float]:
+        d = self.direction if self.is_moving else Vec3(0, 0, 0)
+        return [self.center0.x, self.center0.y, self.center0.z, self.radius, d.x, d.y, d.z]
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        # Not in book: same computations as the book's hit, on floats so that testing a
+        # candidate allocates nothing
+        if r.stats:
+            r.stats.add_primitive_tests(1)
+
+        cx, cy, cz = self.center0.x, self.center0.y, self.center0.z
+        if self.is_moving:
+            cx += r.time * self.direction.x
+            cy += r.time * self.direction.y
+            cz += r.time * self.direction.z
+
+        d = r.direction
+        ox, oy, oz = cx - r.origin.x, cy - r.origin.y, cz - r.origin.z
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        h = d.x * ox + d.y * oy + d.z * oz
+        c = (ox * ox + oy * oy + oz * oz) - self.radius * self.radius
+
+        primitive: Hittable = self
 
         discriminant = h * h - a * c
         if discriminant < 0:
-            return None
+            return p_inf, primitive
 
         sqrtd = sqrt(discriminant)
 
         # Find the nearest root that lies in the acceptable range
         root = (h - sqrtd) / a
-        if not interval.surrounds(root):
+        if not (t_min < root < t_max):
             root = (h + sqrtd) / a
-            if not interval.surrounds(root):
-                return None
+            if not (t_min < root < t_max):
+                return p_inf, primitive
 
-        p = r.at(root)
+        return root, primitive
+
+    def surface(self, r: Ray, t: float) -> HitRecord:
+        center = self.center(r.time) if self.is_moving else self.center0
+        p = r.at(t)
         outward_normal = (p - center) / self.radius
-        u, v = Sphere.get_uv(outward_normal)
+
+        # Not in book: texture coordinates are only computed for the materials that use them
+        u, v = Sphere.get_uv(outward_normal) if self.needs_uv else (0.0, 0.0)
+
+        # Not in book: width of the ray cone where it hits, over the half circumference that v
+        # spans (ignores the slant of the surface, so it's the narrowest the footprint can be)
+        footprint = 0.0
+        if self.needs_uv and (r.width > 0 or r.spread > 0):
+            footprint = (r.width + r.spread * t * r.direction.length()) / (pi * self.radius)
 
         return HitRecord(
             hit=Hit(
                 p=p,
-                t=root,
+                t=t,
                 u=u,
                 v=v,
                 outward_normal=outward_normal,
                 r=r,
+                footprint=footprint,
             ),
             mat=self.mat
         )
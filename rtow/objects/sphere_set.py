@@ -0,0 +1,92 @@
+from math import sqrt
+from typing import List, Tuple
+
+from .. import Ray, AABB
+from .hittable import HitRecord, Hittable
+from ..util import p_inf
+
+
+class SphereSet(Hittable):
+    """
+    Not in book: a few spheres packed into arrays, intersected together in a single loop
+    instead of one call per sphere. Used for the leaves of the flat and wide BVHs.
+
+    Only the closest hit needs the materials, its hit record is built by the sphere itself.
+    """
+
+    centers: List[float]     # 3 per sphere: center at time 0
+    radii: List[float]
+    directions: List[float]  # 3 per sphere: motion between time 0 and 1, zero for static spheres
+    spheres: List[Hittable]  # The packed spheres, in the same order
+    bbox: AABB
+
+    def __init__(self, spheres: List[Hittable]):
+        self.centers = []
+        self.radii = []
+        self.directions = []
+        self.spheres = spheres
+        self.bbox = AABB()
+
+        for i, sphere in enumerate(spheres):
+            data = sphere.sphere_data()
+            assert len(data) == 7, "Only spheres can be packed in a SphereSet"
+            self.centers.extend(data[0:3])
+            self.radii.append(data[3])
+            self.directions.extend(data[4:7])
+            box = sphere.bounding_box()
+            self.bbox = box if i == 0 else AABB.from_aabbs(self.bbox, box)
+
+    @staticmethod
+    def can_pack(objects: List[Hittable]) -> bool:
+        for o in objects:
+            if len(o.sphere_data()) != 7:
+                return False
+        return True
+
+    def bounding_box(self) -> AABB:
+        return self.bbox
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        centers, radii, directions = self.centers, self.radii, self.directions
+        if r.stats:
+            r.stats.add_primitive_tests(len(radii))
+
+        rox, roy, roz = r.origin.x, r.origin.y, r.origin.z
+        dx, dy, dz = r.direction.x, r.direction.y, r.direction.z
+        time = r.time
+        a = dx * dx + dy * dy + dz * dz
+
+        closest = t_max
+        best = -1
+
+        # Same computations as Sphere.intersect
+        for k in range(len(radii)):
+            b = 3 * k
+            ox = centers[b] + time * directions[b] - rox
+            oy = centers[b + 1] + time * directions[b + 1] - roy
+            oz = centers[b + 2] + time * directions[b + 2] - roz
+            h = dx * ox + dy * oy + dz * oz
+            c = (ox * ox + oy * oy + oz * oz) - radii[k] * radii[k]
+
+            discriminant = h * h - a * c
+            if discriminant < 0:
+                continue
+
+            sqrtd = sqrt(discriminant)
+            root = (h - sqrtd) / a
+            if not (t_min < root < closest):
+                root = (h + sqrtd) / a
+                if not (t_min < root < closest):
+                    continue
+
+            closest = root
+            best = k
+
+        if best < 0:
+            primitive: Hittable = self
+            return p_inf, primitive
+        return closest, self.spheres[best]
+
+    def surface(self, r: Ray, t: float) -> HitRecord:
+        # The closest hit is returned with its sphere, which builds the record
+        assert False, "SphereSet hits are returned as their sphere"
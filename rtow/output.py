@@ -0,0 +1,293 @@
+from math import frexp, sqrt
+from typing import List, Tuple
+
+# <python-only>
+import sys
+import zlib
+from array import array
+# </python-only>
+
+from .binio import BinaryWriter
+
+
+# Not in book: writing images from flat lists of linear RGB floats (3 per pixel, row-major),
+# in 8-bit formats (binary PPM, PNG) after gamma correction, or in float formats (PFM,
+# Radiance HDR) that keep the linear colors, so that exposure and tonemapping can be changed
+# later without rendering again (see tonemap below).
+
+# 8-bit value of every linear value x in [0, 1), at index int(x * 65536). The book's
+# int(256 * sqrt(x)) only changes where x = (b / 256)² = b² / 65536, at the start of an
+# entry, so the table gives the same bytes for a lookup instead of a square root.
+gamma_lut_size = 65536
+gamma_lut = [UInt[8](min(255, int(256 * sqrt(i / gamma_lut_size)))) for i in range(gamma_lut_size)]
+
+
+def to_bytes(rgb: List[float], scale: float = 1.0) -> List[UInt[8]]:
+    """Gamma corrected 8-bit values of linear values multiplied by scale."""
+    lut = gamma_lut
+    top = lut[gamma_lut_size - 1]
+    zero = UInt[8](0)
+    out: List[UInt[8]] = []
+    for v in rgb:
+        x = v * scale
+        # NaNs fail both tests and are black
+        if x >= 1.0:
+            out.append(top)
+        elif x > 0.0:
+            out.append(lut[int(x * gamma_lut_size)])
+        else:
+            out.append(zero)
+    return out
+
+
+def ascii_bytes(text: str) -> List[UInt[8]]:
+    return [UInt[8](ord(c)) for c in text]
+
+
+def be32(x: int) -> List[UInt[8]]:
+    return [UInt[8]((x >> 24) & 0xff), UInt[8]((x >> 16) & 0xff), UInt[8]((x >> 8) & 0xff), UInt[8](x & 0xff)]
+
+
+def make_crc_table() -> List[int]:
+    table: List[int] = []
+    for n in range(256):
+        c = n
+        for _ in range(8):
+            c = (0xedb88320 ^ (c >> 1)) if c & 1 else (c >> 1)
+        table.append(c)
+    return table
+
+
+crc_table = make_crc_table()
+
+
+def crc32(data: List[UInt[8]], crc: int = 0) -> int:
+    # <python-only>
+    return zlib.crc32(bytes(data), crc)
+    # </python-only>
+    # <codon-only>
+    crc ^= 0xffffffff
+    for b in data:
+        crc = crc_table[(crc ^ int(b)) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+    # </codon-only>
+
+
+def write_chunk(writer: BinaryWriter, kind: str, data: List[UInt[8]]):
+    kind_bytes = ascii_bytes(kind)
+    writer.write_bytes(be32(len(data)))
+    writer.write_bytes(kind_bytes)
+    writer.write_bytes(data)
+    writer.write_bytes(be32(crc32(data, crc32(kind_bytes))))
+
+
+def rgbe(rgb: List[float]) -> List[UInt[8]]:
+    """Radiance RGBE pixels: a shared exponent and 3 8-bit mantissas per pixel."""
+    pixels: List[UInt[8]] = []
+    zero = UInt[8](0)
+    for k in range(0, len(rgb), 3):
+        r, g, b = rgb[k], rgb[k + 1], rgb[k + 2]
+        v = max(r, g, b)
+        if not v > 1e-32:
+            pixels.extend([zero, zero, zero, zero])
+            continue
+        m, e = frexp(v)
+        s = m * 256.0 / v
+        pixels.extend([UInt[8](int(max(0.0, r) * s)), UInt[8](int(max(0.0, g) * s)), UInt[8](int(max(0.0, b) * s)), UInt[8](e + 128)])
+    return pixels
+
+
+image_formats = ["ppm", "png", "pfm", "hdr"]
+
+
+class ImageWriter:
+    """
+    Writes an image row by row, in the format given by the extension of path, holding a
+    single row at a time:
+
+    - ppm: binary PPM (P6), a text header then the bytes as they are
+    - png: 8-bit RGB, every scanline unfiltered and compressed as it comes, in its own chunk
+    - pfm: portable float map, 32-bit floats, rows from the bottom up
+    - hdr: Radiance RGBE, scanlines not run-length encoded
+
+    Rows are given in the order of rows(), which is bottom-up for PFM.
+    """
+
+    path: str
+    format: str
+    w: int
+    h: int
+    writer: BinaryWriter
+    written: int  # Count of rows written
+    # <python-only>
+    compressor: object
+    # </python-only>
+    # <codon-only>
+    adler_a: int  # Adler-32 of the PNG scanlines written so far
+    adler_b: int  #
+    # </codon-only>
+
+    def __init__(self, path: str, w: int, h: int):
+        self.path = path
+        self.format = path.split(".")[-1]
+        assert self.format in image_formats, f"Unknown image format: {self.format}"
+        self.w = w
+        self.h = h
+        self.written = 0
+        self.writer = BinaryWriter(path)
+
+        if self.format == "ppm":
+            self.writer.write_bytes(ascii_bytes(f"P6\n{w} {h}\n255\n"))
+        elif self.format == "png":
+            self.writer.write_bytes([UInt[8](x) for x in [0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a]])
+            # 8 bits per channel, color type 2 (RGB), default compression, filters and no interlacing
+            write_chunk(self.writer, "IHDR", be32(w) + be32(h) + [UInt[8](8), UInt[8](2), UInt[8](0), UInt[8](0), UInt[8](0)])
+            # <python-only>
+            self.compressor = zlib.compressobj(6)
+            # </python-only>
+            # <codon-only>
+            # Codon has no zlib module, the zlib stream is made of stored (uncompressed)
+            # deflate blocks, which any PNG reader takes. First its header
+            self.adler_a, self.adler_b = 1, 0
+            write_chunk(self.writer, "IDAT", [UInt[8](0x78), UInt[8](0x01)])
+            # </codon-only>
+        elif self.format == "pfm":
+            # A negative scale stands for little-endian floats
+            # <python-only>
+            scale = "-1.0" if sys.byteorder == "little" else "1.0"
+            # </python-only>
+            # <codon-only>
+            scale = "-1.0"
+            # </codon-only>
+            self.writer.write_bytes(ascii_bytes(f"PF\n{w} {h}\n{scale}\n"))
+        else:
+            self.writer.write_bytes(ascii_bytes(f"#?RADIANCE\nFORMAT=32-bit_rle_rgbe\n\n-Y {h} +X {w}\n"))
+
+    def rows(self) -> range:
+        """Order in which rows are written."""
+        return range(self.h - 1, -1, -1) if self.format == "pfm" else range(self.h)
+
+    def write_row(self, rgb: List[float]):
+        """Write the next row, as linear colors (3 floats per pixel)."""
+        assert len(rgb) == 3 * self.w, f"{self.path}: rows are {self.w} pixels wide"
+        if self.format == "ppm":
+            self.writer.write_bytes(to_bytes(rgb))
+        elif self.format == "png":
+            # Filter type 0 (none), then the pixels
+            self.write_scanline([UInt[8](0)] + to_bytes(rgb))
+        elif self.format == "pfm":
+            self.writer.write_floats32(rgb)
+        else:
+            self.writer.write_bytes(rgbe(rgb))
+        self.written += 1
+
+    def write_scanline(self, data: List[UInt[8]]):
+        # <python-only>
+        compressed = self.compressor.compress(bytes(data))
+        if len(compressed) > 0:
+            write_chunk(self.writer, "IDAT", compressed)
+        # </python-only>
+        # <codon-only>
+        # Blocks of at most 65535 bytes, none of them final
+        out: List[UInt[8]] = []
+        start = 0
+        while start < len(data):
+            n = min(65535, len(data) - start)
+            out.extend([UInt[8](0), UInt[8](n & 0xff), UInt[8](n >> 8), UInt[8](~n & 0xff), UInt[8]((~n >> 8) & 0xff)])
+            out.extend(data[start:start + n])
+            start += n
+        write_chunk(self.writer, "IDAT", out)
+
+        a, b = self.adler_a, self.adler_b
+        for x in data:
+            a = (a + int(x)) % 65521
+            b = (b + a) % 65521
+        self.adler_a, self.adler_b = a, b
+        # </codon-only>
+
+    def close(self):
+        assert self.written == self.h, f"{self.path}: {self.written} of {self.h} rows written"
+        if self.format == "png":
+            # <python-only>
+            write_chunk(self.writer, "IDAT", self.compressor.flush())
+            # </python-only>
+            # <codon-only>
+            # An empty final block, then the Adler-32 of the data
+            end = [UInt[8](1), UInt[8](0), UInt[8](0), UInt[8](0xff), UInt[8](0xff)]
+            write_chunk(self.writer, "IDAT", end + be32((self.adler_b << 16) | self.adler_a))
+            # </codon-only>
+            write_chunk(self.writer, "IEND", [])
+        self.writer.close()
+
+
+def save_image(path: str, w: int, h: int, rgb: List[float]):
+    """Save linear colors (3 floats per pixel, row-major) in the format given by the extension of path."""
+    writer = ImageWriter(path, w, h)
+    for y in writer.rows():
+        writer.write_row(rgb[3 * w * y:3 * w * (y + 1)])
+    writer.close()
+
+
+def load_pfm(path: str) -> Tuple[int, int, List[float]]:
+    """Width, height and linear colors of a PFM file, rows from the top down."""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Three lines of text: "PF", the width and height, and the scale
+    end = 0
+    for _ in range(3):
+        # <python-only>
+        end = data.index(b"\n", end) + 1
+        # </python-only>
+        # <codon-only>
+        end = data.find("\n", end) + 1
+        # </codon-only>
+
+    # <python-only>
+    header = data[:end].decode("latin-1").split()
+    # </python-only>
+    # <codon-only>
+    header = data[:end].split()
+    # </codon-only>
+    assert len(header) == 4 and header[0] == "PF", f"Not an RGB PFM file: {path}"
+    w, h = int(header[1]), int(header[2])
+    n = 3 * w * h
+    assert len(data) >= end + 4 * n, f"Truncated file: {path}"
+
+    # <python-only>
+    floats = array("f")
+    floats.frombytes(data[end:end + 4 * n])
+    if (float(header[3]) < 0) != (sys.byteorder == "little"):
+        floats.byteswap()
+    values = floats.tolist()
+    # </python-only>
+    # <codon-only>
+    p = Ptr[float32]((data.ptr + end).as_byte())
+    values = [float(p[k]) for k in range(n)]
+    # </codon-only>
+
+    rgb: List[float] = []
+    for y in range(h - 1, -1, -1):
+        rgb.extend(values[3 * w * y:3 * w * (y + 1)])
+    return w, h, rgb
+
+
+def tonemap(rgb: List[float], exposure: float, operator: str) -> List[float]:
+    """Colors scaled by 2^exposure, then compressed to [0, 1) by Reinhard's x / (1 + x) if asked."""
+    scale = 2.0 ** exposure
+    out = [scale * v for v in rgb]
+    if operator == "reinhard":
+        out = [v / (1.0 + v) if v > 0 else 0.0 for v in out]
+    else:
+        assert operator == "clamp", f"Unknown tonemapping operator: {operator}"
+    return out
+
+
+if __name__ == "__main__":
+    # Tonemap a float render again: python3 -m rtow_python.output in.pfm out.png [exposure] [clamp|reinhard]
+    import sys
+
+    w, h, rgb = load_pfm(sys.argv[1])
+    exposure = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    operator = sys.argv[4] if len(sys.argv) > 4 else "clamp"
+    save_image(sys.argv[2], w, h, tonemap(rgb, exposure, operator))
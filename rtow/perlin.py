@@ -1,68 +1,72 @@
-from random import random, shuffle
 from typing import List
 
+from .rng import Rng
 from .vec3 import Point3, Vec3
 
 
 point_count: int = 256
 
 
-def generate_perm():
+def generate_perm(rng: Rng):
     p = [i for i in range(point_count)]
-    shuffle(p)
+    rng.shuffle(p)
     return p
 
 
-def trilinear(kernel: List[List[List[Vec3]]], dx: float, dy: float, dz: float) -> float:
-    # Hermite cubic smoothing
-    dx_h = dx * dx * (3 - 2 * dx)
-    dy_h = dy * dy * (3 - 2 * dy)
-    dz_h = dz * dz * (3 - 2 * dz)
-
-    accu = 0.0
-    for i in range(2):
-        for j in range(2):
-            for k in range(2):
-                weight_v = Vec3(dx - i, dy - j, dz - k)
-                accu += (
-                    (i * dx_h + (1 - i) * (1 - dx_h)) *
-                    (j * dy_h + (1 - j) * (1 - dy_h)) *
-                    (k * dz_h + (1 - k) * (1 - dz_h)) *
-                    kernel[i][j][k].dot(weight_v)
-                )
-    return accu
-
-
 class Perlin:
-    randvec: List[Vec3]
+    gradients: List[float]  # Not in book: 3 per lattice point, in one flat list instead of a list of Vec3
     perm_x: List[int]
     perm_y: List[int]
     perm_z: List[int]
 
-    def __init__(self):
-        self.randvec = [Vec3.random(-1, 1) for _ in range(point_count)]
-        self.perm_x = generate_perm()
-        self.perm_y = generate_perm()
-        self.perm_z = generate_perm()
+    def __init__(self, seed: int = 0):
+        # Not in book: the noise is the same every run for a given seed
+        rng = Rng(seed)
+        self.gradients = []
+        for _ in range(point_count):
+            v = Vec3.random(rng, -1, 1)
+            self.gradients.extend([v.x, v.y, v.z])
+        self.perm_x = generate_perm(rng)
+        self.perm_y = generate_perm(rng)
+        self.perm_z = generate_perm(rng)
 
     def noise(self, p: Point3) -> float:
-        xx, dx = divmod(p.x, 1)
-        yy, dy = divmod(p.y, 1)
-        zz, dz = divmod(p.z, 1)
+        return self.noise_at(p.x, p.y, p.z)
+
+    def noise_at(self, x: float, y: float, z: float) -> float:
+        """
+        Not in book: noise at x, y, z without allocating anything. The gradients of the 8
+        lattice corners are read from the flat list as they are needed, instead of being
+        gathered in nested lists of Vec3 and dotted with 8 new weight vectors (trilinear in
+        the book). The operations are the same, in the same order, so the values are too.
+        """
+
+        xx, dx = divmod(x, 1)
+        yy, dy = divmod(y, 1)
+        zz, dz = divmod(z, 1)
+        ix, iy, iz = int(xx), int(yy), int(zz)
+
+        # Hermite cubic smoothing
+        dx_h = dx * dx * (3 - 2 * dx)
+        dy_h = dy * dy * (3 - 2 * dy)
+        dz_h = dz * dz * (3 - 2 * dz)
 
-        kernel = [
-            [
-                [
-                    self.randvec[
-                        self.perm_x[int(xx + i) & 255] ^
-                        self.perm_y[int(yy + j) & 255] ^
-                        self.perm_z[int(zz + k) & 255]
-                    ]
-                    for k in range(2)
-                ]
-                for j in range(2)
-            ]
-            for i in range(2)
-        ]
+        gradients = self.gradients
+        accu = 0.0
+        for i in range(2):
+            px = self.perm_x[(ix + i) & 255]
+            wx = dx_h if i == 1 else 1 - dx_h
+            for j in range(2):
+                pxy = px ^ self.perm_y[(iy + j) & 255]
+                wxy = wx * (dy_h if j == 1 else 1 - dy_h)
+                for k in range(2):
+                    g = 3 * (pxy ^ self.perm_z[(iz + k) & 255])
+                    accu += (
+                        wxy * (dz_h if k == 1 else 1 - dz_h) *
+                        (gradients[g] * (dx - i) + gradients[g + 1] * (dy - j) + gradients[g + 2] * (dz - k))
+                    )
+        return accu
 
-        return trilinear(kernel, dx, dy, dz)
+    def noise_batch(self, points: List[float]) -> List[float]:
+        """Not in book: noise at many points at once, given as 3 floats per point."""
+        return [self.noise_at(points[3 * n], points[3 * n + 1], points[3 * n + 2]) for n in range(len(points) // 3)]
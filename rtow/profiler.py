@@ -0,0 +1,202 @@
+from time import time
+from typing import Dict, List
+
+# <python-only>
+import os
+import signal
+# </python-only>
+
+from .buffer import Buffer, heat
+from .tiles import Tile
+
+
+# Not in book: profiling built into the renderer, the same on Linux and macOS, with CPython,
+# PyPy and Codon:
+#
+# - phases: the time spent building the scene, loading textures, building the BVH, rendering
+#   and encoding images, counted where they happen and printed at the end of a run
+# - tile timings: the time taken by every tile of a render, see Tracer(profile=True)
+# - a sampling profiler (CPython and PyPy only): the stack of Python frames is recorded on a
+#   timer of CPU time and written as collapsed stacks, one line per stack with its count,
+#   which flamegraph.pl, inferno or speedscope turn into flame graphs. Codon code has no
+#   Python frames, its stacks are sampled by perf and collapsed by collapse_perf (profile.sh)
+
+phase_names = ["scene", "textures", "bvh", "render", "encode"]
+
+# Samples per second of CPU time, off the beat of periodic work like the 997 Hz of dtrace
+sampling_rate = 997
+
+
+class Phases:
+    """
+    Seconds spent in every phase of a run. Phases nest (textures are loaded while the scene
+    is built), time is counted in the innermost one only so that they add up to the run.
+    """
+
+    seconds: List[float]
+    running: List[int]  # Indices of the phases started and not stopped, innermost last
+    since: float        # Time of the last start or stop
+
+    def __init__(self):
+        self.seconds = [0.0 for _ in phase_names]
+        self.running = []
+        self.since = time()
+
+    def count(self):
+        now = time()
+        if len(self.running) > 0:
+            self.seconds[self.running[-1]] += now - self.since
+        self.since = now
+
+    def start(self, name: str):
+        self.count()
+        self.running.append(phase_names.index(name))
+
+    def stop(self, name: str):
+        assert len(self.running) > 0 and phase_names[self.running[-1]] == name, f"Phase {name} is not running"
+        self.count()
+        self.running.pop()
+
+    def report(self):
+        total = max(1e-9, sum(self.seconds))
+        for i in range(len(phase_names)):
+            label = f"Phase {phase_names[i]}:"
+            print(f"{label:19}{self.seconds[i]:13.3f}s {100 * self.seconds[i] / total:5.1f}%")
+        print(f"Phases total:      {total:13.3f}s")
+
+
+# Phases of the whole process
+phases = Phases()
+
+
+class TileTimes:
+    """Seconds taken by every tile rendered, in the order they were done."""
+
+    tiles: List[Tile]
+    seconds: List[float]
+
+    def __init__(self):
+        self.tiles = []
+        self.seconds = []
+
+    def add(self, tile: Tile, seconds: float):
+        self.tiles.append(tile)
+        self.seconds.append(seconds)
+
+    def report(self):
+        n = len(self.seconds)
+        if n == 0:
+            return
+        times = sorted(self.seconds)
+        mean = sum(times) / n
+        slowest = self.tiles[self.seconds.index(times[-1])]
+        print(f"Tiles timed:       {n:14d}")
+        print(f"Tile time min:     {1000 * times[0]:12.2f}ms")
+        print(f"Tile time median:  {1000 * times[n // 2]:12.2f}ms")
+        print(f"Tile time max:     {1000 * times[-1]:12.2f}ms ({times[-1] / max(1e-9, mean):.1f}x the mean)")
+        print(f"Slowest tile:      {slowest}")
+
+    def heatmap(self, w: int, h: int) -> Buffer:
+        """Image of the time taken by every pixel, from black for none to white for the slowest."""
+        per_pixel = [0.0 for _ in range(w * h)]
+        for tile, seconds in zip(self.tiles, self.seconds):
+            share = seconds / max(1, tile.width() * tile.height())
+            for y in range(tile.y0, tile.y1):
+                for x in range(tile.x0, tile.x1):
+                    per_pixel[y * w + x] += share
+
+        highest = max(per_pixel) if len(per_pixel) > 0 else 0.0
+        b = Buffer(w, h)
+        for y in range(h):
+            for x in range(w):
+                b.add(x, y, heat(per_pixel[y * w + x] / highest if highest > 0 else 0.0), 1)
+        return b
+
+
+# <python-only>
+class StackSampler:
+    """
+    Sampling profiler of the main thread of CPython and PyPy, with no other tool: every
+    1 / sampling_rate seconds of CPU time, SIGPROF interrupts the interpreter and the stack of
+    the frame it stopped in is counted. Processes started by the tracer's workers are not
+    sampled, profile with workers=0.
+    """
+
+    counts: Dict[str, int]  # Count of every stack, as frames from the outermost joined by ';'
+
+    def __init__(self):
+        self.counts = {}
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, 1 / sampling_rate, 1 / sampling_rate)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            # PyPy and CPython before 3.11 have no qualified names
+            names.append(f"{module}.{getattr(code, 'co_qualname', code.co_name)}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+        print(f"Stack samples:     {sum(self.counts.values()):14d} in {path}")
+# </python-only>
+
+
+def collapse_perf(lines: List[str]) -> Dict[str, int]:
+    """
+    Counts of the stacks of the output of `perf script`: samples separated by empty lines,
+    each a header line starting with the command name, then a line per frame from the
+    innermost, with an address, a symbol and a library.
+    """
+
+    counts: Dict[str, int] = {}
+    frames: List[str] = []
+    command = ""
+    for line in lines + [""]:
+        line = line.rstrip()
+        if line == "":
+            if command != "":
+                frames.append(command)
+                stack = ";".join(reversed(frames))
+                counts[stack] = counts.get(stack, 0) + 1
+            frames = []
+            command = ""
+        elif not line[0].isspace():
+            command = line.split()[0]
+        else:
+            # An address, then the symbol up to the library in parentheses: demangled symbols
+            # have spaces, like foo(int, float), so only the fields around it are split off
+            frame = line.strip()
+            space = frame.find(" ")
+            symbol = frame[space + 1:] if space >= 0 else ""
+            library = symbol.rfind(" (")
+            if library >= 0 and symbol.endswith(")"):
+                symbol = symbol[:library]
+            # Without the offset in the function, and ';' is the separator of frames
+            offset = symbol.rfind("+0x")
+            if offset >= 0 and all(c in "0123456789abcdef" for c in symbol[offset + 3:]):
+                symbol = symbol[:offset]
+            symbol = symbol.strip()
+            frames.append(symbol.replace(";", ":") if symbol != "" else "[unknown]")
+    return counts
+
+
+if __name__ == "__main__":
+    # Collapse the stacks sampled by perf: perf script | python3 -m rtow_python.profiler > out.folded
+    import sys
+
+    counts = collapse_perf([line for line in sys.stdin])
+    for stack in sorted(counts.keys()):
+        print(f"{stack} {counts[stack]}")
@@ -0,0 +1,95 @@
+import os
+from typing import List
+
+from .buffer import Buffer, pixel_floats
+from .binio import BinaryReader, BinaryWriter
+from .tiles import hash32
+
+# <codon-only>
+from C import rename(cobj, cobj) -> i32
+# </codon-only>
+
+
+# Not in book: state of a progressive render, the image is rendered in passes of a few
+# samples per pixel that are added up, and can be saved to a checkpoint file to continue later
+
+magic = "RTOWPRG3"
+
+# Image width and height, passes, samples, seed, max depth, scene hash (2 ints), settings hash
+header_ints = 9
+
+
+def settings_key(settings: str) -> int:
+    """Hash of the text of the other settings the passes depend on (see Tracer.pass_settings)."""
+    h = hash32(len(settings))
+    for c in settings:
+        h = hash32(h ^ ord(c))
+    return h
+
+
+class Accumulator:
+    w: int
+    h: int
+    buffer: Buffer      # Sums of the colors and counts of every sample taken
+    passes: int         # Count of passes added
+    samples: int        # Samples per pixel requested by the passes added so far
+
+    def __init__(self, w: int, h: int):
+        self.w = w
+        self.h = h
+        self.buffer = Buffer(w, h)
+        self.passes = 0
+        self.samples = 0
+
+    def add(self, b: Buffer, samples: int):
+        """Add a pass rendered with samples per pixel."""
+        self.buffer.merge(b)
+        self.passes += 1
+        self.samples += samples
+
+    def save(self, path: str, seed: int, max_depth: int, scene: str, settings: str):
+        # Written next to the checkpoint then moved over it, an interrupted write leaves the
+        # previous checkpoint intact
+        temp = f"{path}.tmp"
+        writer = BinaryWriter(temp)
+        writer.write_magic(magic)
+        writer.write_ints([
+            self.w, self.h, self.passes, self.samples, seed, max_depth,
+            int(scene[:8], 16), int(scene[8:], 16), settings_key(settings),
+        ])
+        writer.write_singles(self.buffer.data)
+        writer.close()
+        # <python-only>
+        os.replace(temp, path)
+        # </python-only>
+        # <codon-only>
+        assert rename(temp.c_str(), path.c_str()) == i32(0), f"Could not move {temp} to {path}"
+        # </codon-only>
+
+
+def resume(path: str, w: int, h: int, seed: int, max_depth: int, scene: str, settings: str) -> Accumulator:
+    """
+    Returns the passes accumulated in the checkpoint at path, or no passes if there is no
+    checkpoint or if it was made for another image or with other settings: its passes can't
+    be added to new ones.
+    """
+
+    acc = Accumulator(w, h)
+
+    try:
+        reader = BinaryReader(path)
+    except IOError:
+        return acc
+
+    if reader.size() != 8 * (1 + header_ints) + 4 * pixel_floats * w * h or reader.read_magic() != magic:
+        return acc
+
+    header = reader.read_ints(header_ints)
+    expected = [w, h, seed, max_depth, int(scene[:8], 16), int(scene[8:], 16), settings_key(settings)]
+    if [header[0], header[1], header[4], header[5], header[6], header[7], header[8]] != expected:
+        return acc
+
+    acc.passes = header[2]
+    acc.samples = header[3]
+    acc.buffer.load(reader.read_floats32(pixel_floats * w * h))
+    return acc
@@ -1,19 +1,31 @@
+from typing import Optional
+
 from .vec3 import Point3, Vec3
+from .stats import RenderStats
 
 class Ray:
     origin: Point3
     direction: Vec3
     time: float
+    width: float   # Not in book: ray cone, width of the footprint of the ray at its origin
+    spread: float  # and growth of that width per unit of distance along the ray
+    stats: Optional[RenderStats]  # Not in book: counters the ray adds its work to, None when they are off
 
     def __init__(self, orig: Point3, dir: Vec3):
         self.origin = orig
         self.direction = dir
         self.time = 0
+        self.width = 0.0
+        self.spread = 0.0
+        self.stats = None
 
-    def __init__(self, orig: Point3, dir: Vec3, time: float):
+    def __init__(self, orig: Point3, dir: Vec3, time: float, width: float = 0.0, spread: float = 0.0):
         self.origin = orig
         self.direction = dir
         self.time = time
+        self.width = width
+        self.spread = spread
+        self.stats = None
 
     def at(self, t: float):
         return self.origin + t * self.direction
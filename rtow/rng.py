@@ -0,0 +1,78 @@
+from random import Random
+from typing import List, Tuple
+
+from .tiles import hash32
+from .sampler import Sampler
+
+
+class Rng:
+    """
+    Not in book: random number generator owned by a single tile or thread. Passing it down to
+    every function that samples keeps the random sequences independent between workers.
+
+    In Codon, it is a counter hashed to 32 bits: the state moves by an odd step that depends on
+    the seed, so that streams with different seeds don't run into each other, and goes through
+    hash32, a few integer operations in the hot loop. In Python and PyPy, the Mersenne Twister
+    of the random module is faster than any generator written in Python.
+
+    The 2D samples of camera rays and bounces come from a sampler instead (next_2d), for the
+    sample and pixel set by start_sample.
+    """
+
+    # <codon-only>
+    state: int
+    step: int
+    # </codon-only>
+    # <python-only>
+    gen: Random
+    # </python-only>
+    sampler: Sampler  # Source of the 2D samples
+    pixel: int        # Seed of the pixel being sampled
+    index: int        # Index of the sample in the pixel
+    dimension: int    # Count of 2D samples taken for the current sample
+
+    def __init__(self, seed: int = 0, sampler: Sampler = Sampler()):
+        # <codon-only>
+        self.state = hash32(seed)
+        self.step = hash32(seed + 0x9e3779b9) | 1
+        # </codon-only>
+        # <python-only>
+        self.gen = Random(seed)
+        # The generator's method is bound to the object, which saves a call in the hot loop
+        self.random = self.gen.random
+        # </python-only>
+        self.sampler = sampler
+        self.pixel = 0
+        self.index = 0
+        self.dimension = 0
+
+    # <codon-only>
+    def random(self) -> float:
+        """Returns a float in [0, 1)."""
+        self.state = (self.state + self.step) & 0xffffffff
+        return hash32(self.state) * 2.3283064365386963e-10  # 2^-32
+    # </codon-only>
+
+    def start_sample(self, pixel: int, index: int, dimension: int = 0):
+        self.pixel = pixel
+        self.index = index
+        self.dimension = dimension
+
+    def next_2d(self) -> Tuple[float, float]:
+        """Returns the next 2D sample of the current sample, in [0, 1)²."""
+        u = self.sampler.sample_2d(self.pixel, self.index, self.dimension)
+        self.dimension += 1
+        return u
+
+    def uniform(self, min: float, max: float) -> float:
+        return min + (max - min) * self.random()
+
+    def randrange(self, n: int) -> int:
+        """Returns an int in [0, n)."""
+        return min(n - 1, int(n * self.random()))
+
+    def shuffle(self, values: List[int]):
+        # Fisher-Yates
+        for i in range(len(values) - 1, 0, -1):
+            j = self.randrange(i + 1)
+            values[i], values[j] = values[j], values[i]
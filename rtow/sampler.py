@@ -0,0 +1,178 @@
+from math import sqrt
+from typing import Tuple
+
+from .tiles import hash32
+
+
+# Not in book: samplers giving the 2D samples of the camera rays and of the bounces. Every
+# sample is a function of the pixel seed, of the index of the sample in the pixel and of its
+# dimension (0 for the position in the pixel, then the lens, then one per bounce), so low
+# discrepancy sequences can spread the samples of a pixel evenly in each dimension.
+
+# 2^-32, converts 32 bit ints to floats in [0, 1)
+to_unit = 2.3283064365386963e-10
+
+primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89]
+
+
+def independent_2d(seed: int, index: int, dimension: int) -> Tuple[float, float]:
+    h = hash32(hash32(hash32(seed) + index) + dimension)
+    return h * to_unit, hash32(h + 1) * to_unit
+
+
+def reverse_bits(x: int) -> int:
+    x = ((x >> 1) & 0x55555555) | ((x & 0x55555555) << 1)
+    x = ((x >> 2) & 0x33333333) | ((x & 0x33333333) << 2)
+    x = ((x >> 4) & 0x0f0f0f0f) | ((x & 0x0f0f0f0f) << 4)
+    x = ((x >> 8) & 0x00ff00ff) | ((x & 0x00ff00ff) << 8)
+    return ((x >> 16) | (x << 16)) & 0xffffffff
+
+
+def laine_karras_permutation(x: int, seed: int) -> int:
+    # Hash where every bit only depends on the bits below it, from "Practical Hash-based Owen
+    # Scrambling" (Burley, 2020)
+    x = (x + seed) & 0xffffffff
+    x ^= (x * 0x6c50b47c) & 0xffffffff
+    x ^= (x * 0xb82f1e52) & 0xffffffff
+    x ^= (x * 0xc7afe638) & 0xffffffff
+    x ^= (x * 0x8d22f6e6) & 0xffffffff
+    return x
+
+
+def nested_uniform_scramble(x: int, seed: int) -> int:
+    # Owen scrambling: every bit is flipped depending on the bits above it
+    return reverse_bits(laine_karras_permutation(reverse_bits(x), seed))
+
+
+def permute(i: int, n: int, p: int) -> int:
+    """
+    Element i of a random permutation of [0, n) chosen by p, from "Correlated Multi-Jittered
+    Sampling" (Kensler, 2013).
+    """
+
+    w = n - 1
+    w |= w >> 1
+    w |= w >> 2
+    w |= w >> 4
+    w |= w >> 8
+    w |= w >> 16
+    while True:
+        i ^= p
+        i = (i * 0xe170893d) & 0xffffffff
+        i ^= p >> 16
+        i ^= (i & w) >> 4
+        i ^= p >> 8
+        i = (i * 0x0929eb3f) & 0xffffffff
+        i ^= p >> 23
+        i ^= (i & w) >> 1
+        i = (i * (1 | p >> 27)) & 0xffffffff
+        i = (i * 0x6935fa69) & 0xffffffff
+        i ^= (i & w) >> 11
+        i = (i * 0x74dcb303) & 0xffffffff
+        i ^= (i & w) >> 2
+        i = (i * 0x9e501cc3) & 0xffffffff
+        i ^= (i & w) >> 2
+        i = (i * 0xc860a3df) & 0xffffffff
+        i &= w
+        i ^= i >> 5
+        if i < n:
+            return (i + p) % n
+
+
+def radical_inverse(base: int, i: int) -> float:
+    inverse = 1.0 / base
+    f = inverse
+    r = 0.0
+    while i > 0:
+        r += f * (i % base)
+        i //= base
+        f *= inverse
+    return r
+
+
+class Sampler:
+    """Independent samples: every pair of floats is a hash of the seed, index and dimension."""
+
+    def sample_2d(self, seed: int, index: int, dimension: int) -> Tuple[float, float]:
+        return independent_2d(seed, index, dimension)
+
+
+class StratifiedSampler(Sampler):
+    """
+    Jittered strata: the first m² samples of a pixel, with m² <= samples_per_pixel, each fall
+    in their own cell of an m x m grid, in an order shuffled per pixel and dimension. Further
+    samples are independent.
+    """
+
+    m: int
+
+    def __init__(self, samples_per_pixel: int):
+        self.m = max(1, int(sqrt(samples_per_pixel)))
+        while (self.m + 1) * (self.m + 1) <= samples_per_pixel:
+            self.m += 1
+
+    def sample_2d(self, seed: int, index: int, dimension: int) -> Tuple[float, float]:
+        m = self.m
+        jx, jy = independent_2d(seed, index, dimension)
+        if index >= m * m:
+            return jx, jy
+        cell = permute(index, m * m, hash32(hash32(seed) ^ hash32(dimension + 1)))
+        return ((cell % m) + jx) / m, ((cell // m) + jy) / m
+
+
+class HaltonSampler(Sampler):
+    """
+    Halton sequence, two prime bases per dimension, shifted by a random offset per pixel and
+    dimension (Cranley-Patterson rotation). Dimensions past the table of primes are
+    independent.
+    """
+
+    def sample_2d(self, seed: int, index: int, dimension: int) -> Tuple[float, float]:
+        if 2 * dimension + 1 >= len(primes):
+            return independent_2d(seed, index, dimension)
+        ox, oy = independent_2d(seed, 0x7fffffff, dimension)
+        x = radical_inverse(primes[2 * dimension], index) + ox
+        y = radical_inverse(primes[2 * dimension + 1], index) + oy
+        return x - int(x), y - int(y)
+
+
+class SobolSampler(Sampler):
+    """
+    Owen-scrambled Sobol sequence: the first two Sobol dimensions for every dimension, with
+    the order of the samples and the bits of the points scrambled with a seed per pixel and
+    dimension, so that dimensions are not correlated. Best with a power of 2 of samples.
+    """
+
+    def sample_2d(self, seed: int, index: int, dimension: int) -> Tuple[float, float]:
+        s = hash32(hash32(seed) ^ hash32(dimension + 1))
+        i = nested_uniform_scramble(index, s)
+
+        x = reverse_bits(i)
+        y = 0
+        v = 1 << 31
+        while i > 0:
+            if i & 1:
+                y ^= v
+            i >>= 1
+            v ^= v >> 1
+
+        x = nested_uniform_scramble(x, hash32(s + 1))
+        y = nested_uniform_scramble(y, hash32(s + 2))
+        return x * to_unit, y * to_unit
+
+
+sampler_names = ["independent", "stratified", "halton", "sobol"]
+
+
+def make_sampler(name: str, samples_per_pixel: int) -> Sampler:
+    if name == "stratified":
+        stratified: Sampler = StratifiedSampler(samples_per_pixel)
+        return stratified
+    if name == "halton":
+        halton: Sampler = HaltonSampler()
+        return halton
+    if name == "sobol":
+        sobol: Sampler = SobolSampler()
+        return sobol
+    assert name == "independent", f"Unknown sampler: {name}"
+    return Sampler()
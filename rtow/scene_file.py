@@ -0,0 +1,254 @@
+from typing import Dict, List, Tuple
+
+from .aabb import AABB
+from .interval import Interval
+from .camera import Camera
+from .vec3 import Vec3, Point3, Color
+from .objects import Hittable, Sphere, HittableList
+from .materials import Material, Lambertian, Metal, Dielectric
+from .textures import Checker, ImageTexture, MipmapTexture, NoiseTexture, SolidColor, Texture
+from .util import p_inf, m_inf
+from .binio import BinaryReader, BinaryWriter
+
+
+# Not in book: scenes described in files instead of Python functions. The text format has one
+# statement per line, '#' starts a comment:
+#
+#   camera vfov 20 lookfrom 13 2 3 lookat 0 0 0 vup 0 1 0 defocus_angle 0.6 focus_dist 10 mode perspective
+#   texture <name> solid <r> <g> <b>
+#   texture <name> checker <scale> <even texture> <odd texture>
+#   texture <name> image <path>
+#   texture <name> mipmap <path>
+#   texture <name> noise <scale> [seed]
+#   material <name> lambertian <texture> | <r> <g> <b>
+#   material <name> metal <r> <g> <b> [fuzz]
+#   material <name> dielectric <refractive index>
+#   sphere <material> <x> <y> <z> <radius>
+#   moving_sphere <material> <x0> <y0> <z0> <x1> <y1> <z1> <radius>
+#
+# Textures and materials are declared before use and shared by name. Spheres are streamed
+# into flat arrays as the file is read, the objects are only created once, at the end.
+#
+# The binary variant (.rtowscene) holds the same declarations as text, followed by the
+# sphere arrays, which are mapped from the file instead of parsed.
+
+magic = "RTOWSCN1"
+
+# Floats per sphere: center at time 0, radius, motion between time 0 and 1 (as in sphere_data)
+sphere_floats = 7
+
+
+class SceneFile:
+    """Declarations and spheres of a scene file, see above."""
+
+    path: str
+    camera: Camera
+    declarations: List[str]     # Camera, texture and material lines, kept for the binary variant
+    textures: Dict[str, Texture]
+    material_ids: Dict[str, int]
+    materials: List[Material]
+    spheres: List[float]        # sphere_floats per sphere
+    sphere_materials: List[int]  # Index of the material of each sphere
+
+    def __init__(self, path: str):
+        self.path = path
+        self.camera = Camera()
+        self.declarations = []
+        self.textures = {}
+        self.material_ids = {}
+        self.materials = []
+        self.spheres = []
+        self.sphere_materials = []
+
+    def error(self, line_number: int, message: str) -> str:
+        return f"{self.path}:{line_number}: {message}"
+
+    def texture(self, name: str, line_number: int) -> Texture:
+        assert name in self.textures, self.error(line_number, f"Unknown texture: {name}")
+        return self.textures[name]
+
+    def material(self, name: str, line_number: int) -> int:
+        assert name in self.material_ids, self.error(line_number, f"Unknown material: {name}")
+        return self.material_ids[name]
+
+    def parse_line(self, line: str, line_number: int):
+        tokens = line.split("#")[0].split()
+        if len(tokens) == 0:
+            return
+
+        statement = tokens[0]
+        if statement == "sphere":
+            assert len(tokens) == 6, self.error(line_number, "Expected: sphere <material> <x> <y> <z> <radius>")
+            self.sphere_materials.append(self.material(tokens[1], line_number))
+            self.spheres.extend([float(tokens[2]), float(tokens[3]), float(tokens[4]), float(tokens[5]), 0.0, 0.0, 0.0])
+        elif statement == "moving_sphere":
+            assert len(tokens) == 9, self.error(line_number, "Expected: moving_sphere <material> <x0> <y0> <z0> <x1> <y1> <z1> <radius>")
+            self.sphere_materials.append(self.material(tokens[1], line_number))
+            x, y, z = float(tokens[2]), float(tokens[3]), float(tokens[4])
+            self.spheres.extend([x, y, z, float(tokens[8]), float(tokens[5]) - x, float(tokens[6]) - y, float(tokens[7]) - z])
+        elif statement == "camera":
+            self.parse_camera(tokens, line_number)
+            self.declarations.append(line)
+        elif statement == "texture":
+            assert len(tokens) >= 4, self.error(line_number, "Expected: texture <name> <kind> <values>")
+            self.textures[tokens[1]] = self.parse_texture(tokens, line_number)
+            self.declarations.append(line)
+        elif statement == "material":
+            assert len(tokens) >= 4, self.error(line_number, "Expected: material <name> <kind> <values>")
+            self.material_ids[tokens[1]] = len(self.materials)
+            self.materials.append(self.parse_material(tokens, line_number))
+            self.declarations.append(line)
+        else:
+            assert False, self.error(line_number, f"Unknown statement: {statement}")
+
+    def parse_camera(self, tokens: List[str], line_number: int):
+        camera = self.camera
+        i = 1
+        while i < len(tokens):
+            key = tokens[i]
+            if key in ("lookfrom", "lookat", "vup"):
+                assert i + 3 < len(tokens), self.error(line_number, f"Expected 3 values for {key}")
+                v = Vec3(float(tokens[i + 1]), float(tokens[i + 2]), float(tokens[i + 3]))
+                if key == "lookfrom":
+                    camera.lookfrom = v
+                elif key == "lookat":
+                    camera.lookat = v
+                else:
+                    camera.vup = v
+                i += 4
+                continue
+
+            assert i + 1 < len(tokens), self.error(line_number, f"Expected a value for {key}")
+            value = tokens[i + 1]
+            if key == "vfov":
+                camera.vfov = float(value)
+            elif key == "defocus_angle":
+                camera.defocus_angle = float(value)
+            elif key == "focus_dist":
+                camera.focus_dist = float(value)
+            elif key == "mode":
+                assert value in ("perspective", "orthographic"), self.error(line_number, f"Unknown camera mode: {value}")
+                camera.mode = value
+            else:
+                assert False, self.error(line_number, f"Unknown camera setting: {key}")
+            i += 2
+
+    def parse_texture(self, tokens: List[str], line_number: int) -> Texture:
+        kind = tokens[2]
+        if kind == "solid":
+            assert len(tokens) == 6, self.error(line_number, "Expected: texture <name> solid <r> <g> <b>")
+            solid: Texture = SolidColor(Color(float(tokens[3]), float(tokens[4]), float(tokens[5])))
+            return solid
+        if kind == "checker":
+            assert len(tokens) == 6, self.error(line_number, "Expected: texture <name> checker <scale> <even> <odd>")
+            even = self.texture(tokens[4], line_number)
+            odd = self.texture(tokens[5], line_number)
+            checker: Texture = Checker(float(tokens[3]), even, odd)
+            return checker
+        if kind == "image":
+            image: Texture = ImageTexture(tokens[3])
+            return image
+        if kind == "mipmap":
+            mipmap: Texture = MipmapTexture(tokens[3])
+            return mipmap
+        if kind == "noise":
+            seed = int(tokens[4]) if len(tokens) > 4 else 0
+            noise: Texture = NoiseTexture(float(tokens[3]), seed)
+            return noise
+        assert False, self.error(line_number, f"Unknown texture kind: {kind}")
+
+    def parse_material(self, tokens: List[str], line_number: int) -> Material:
+        kind = tokens[2]
+        if kind == "lambertian":
+            if len(tokens) == 6:
+                color: Material = Lambertian.from_color(Color(float(tokens[3]), float(tokens[4]), float(tokens[5])))
+                return color
+            textured: Material = Lambertian(self.texture(tokens[3], line_number))
+            return textured
+        if kind == "metal":
+            assert len(tokens) >= 6, self.error(line_number, "Expected: material <name> metal <r> <g> <b> [fuzz]")
+            fuzz = float(tokens[6]) if len(tokens) > 6 else 0.0
+            metal: Material = Metal(Color(float(tokens[3]), float(tokens[4]), float(tokens[5])), fuzz)
+            return metal
+        if kind == "dielectric":
+            dielectric: Material = Dielectric(float(tokens[3]))
+            return dielectric
+        assert False, self.error(line_number, f"Unknown material kind: {kind}")
+
+    def world(self) -> HittableList:
+        """Create the spheres, and their bounding box in the same pass."""
+        spheres = self.spheres
+        objects: List[Hittable] = []
+        x0, y0, z0, x1, y1, z1 = p_inf, p_inf, p_inf, m_inf, m_inf, m_inf
+
+        for i in range(len(self.sphere_materials)):
+            b = sphere_floats * i
+            center = Point3(spheres[b], spheres[b + 1], spheres[b + 2])
+            radius = spheres[b + 3]
+            mat = self.materials[self.sphere_materials[i]]
+            dx, dy, dz = spheres[b + 4], spheres[b + 5], spheres[b + 6]
+            if dx == 0 and dy == 0 and dz == 0:
+                objects.append(Sphere(radius, mat, center))
+            else:
+                objects.append(Sphere(radius, mat, center, center + Vec3(dx, dy, dz)))
+
+            # Same box as the sphere's, swept along its motion
+            r = max(0.0, radius)
+            x0, x1 = min(x0, spheres[b] - r, spheres[b] + dx - r), max(x1, spheres[b] + r, spheres[b] + dx + r)
+            y0, y1 = min(y0, spheres[b + 1] - r, spheres[b + 1] + dy - r), max(y1, spheres[b + 1] + r, spheres[b + 1] + dy + r)
+            z0, z1 = min(z0, spheres[b + 2] - r, spheres[b + 2] + dz - r), max(z1, spheres[b + 2] + r, spheres[b + 2] + dz + r)
+
+        world = HittableList()
+        world.extend(objects, AABB(Interval(x0, x1), Interval(y0, y1), Interval(z0, z1)))
+        return world
+
+    def save_binary(self, path: str):
+        writer = BinaryWriter(path)
+        writer.write_magic(magic)
+        writer.write_ints([len(self.sphere_materials)])
+        writer.write_string("\n".join(self.declarations))
+        writer.write_floats(self.spheres)
+        writer.write_ints(self.sphere_materials)
+        writer.close()
+
+
+def read_text(path: str) -> SceneFile:
+    scene = SceneFile(path)
+    with open(path) as f:
+        line_number = 0
+        for line in f:
+            line_number += 1
+            scene.parse_line(line.rstrip(), line_number)
+    return scene
+
+
+def read_binary(path: str) -> SceneFile:
+    scene = SceneFile(path)
+    reader = BinaryReader(path)
+    assert reader.size() >= 16 and reader.read_magic() == magic, f"{path}: not a binary scene file"
+
+    count = reader.read_ints(1)[0]
+    line_number = 0
+    for line in reader.read_string().split("\n"):
+        line_number += 1
+        scene.parse_line(line, line_number)
+    scene.spheres = reader.read_floats(sphere_floats * count)
+    scene.sphere_materials = reader.read_ints(count)
+    return scene
+
+
+def read_scene(path: str) -> SceneFile:
+    return read_binary(path) if path.endswith(".rtowscene") else read_text(path)
+
+
+def load_scene_file(path: str) -> Tuple[HittableList, Camera]:
+    """Build the scene described in a text (.scene) or binary (.rtowscene) scene file."""
+    scene = read_scene(path)
+    return scene.world(), scene.camera
+
+
+if __name__ == "__main__":
+    # Convert a text scene file to the binary variant: python3 -m rtow_python.scene_file in.scene out.rtowscene
+    import sys
+
+    read_text(sys.argv[1]).save_binary(sys.argv[2])
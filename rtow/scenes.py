@@ -0,0 +1,196 @@
+from math import sqrt
+from typing import List, Tuple
+
+from .camera import Camera
+from .rng import Rng
+from .vec3 import Vec3, Point3, Color
+from .objects import Sphere, HittableList
+from .materials import Material, Lambertian, Metal, Dielectric
+from .textures import Checker, ImageTexture, MipmapTexture, NoiseTexture, Texture
+from .scene_file import load_scene_file
+
+
+def bouncing_spheres(seed: int = 0):
+    # Not in book: random choices come from a generator seeded with seed, the scene is the same
+    # every run
+    rng = Rng(seed)
+    world = HittableList()
+
+    checker = Checker.from_colors(0.32, Color(0.2, 0.3, 0.1), Color.all(0.9))
+    world.add(Sphere(1000, Lambertian(checker), Point3(0, -1000, 0)))
+
+    for a in range(-11, 11):
+        for b in range(-11, 11):
+            choose_mat = rng.random()
+            center = Point3(a + 0.9 * rng.random(), 0.2, b + 0.9 * rng.random())
+
+            if (center - Point3(4, 0.2, 0)).length() > 0.9:
+                if choose_mat < 0.8:
+                    # diffuse
+                    albedo = Color.random(rng) * Color.random(rng)
+                    sphere_material = Lambertian.from_color(albedo)
+                    center2 = center + Vec3(0, rng.uniform(0, 0.5), 0)
+                    world.add(Sphere(0.2, sphere_material, center, center2))
+                elif choose_mat < 0.95:
+                    # metal
+                    albedo = Color.random(rng, 0.5, 1)
+                    fuzz = rng.uniform(0, 0.5)
+                    sphere_material = Metal(albedo, fuzz)
+                    world.add(Sphere(0.2, sphere_material, center))
+                else:
+                    # glass
+                    sphere_material = Dielectric(1.5)
+                    world.add(Sphere(0.2, sphere_material, center))
+
+    material1 = Dielectric(1.5)
+    world.add(Sphere(1.0, material1, Point3(0, 1, 0)))
+
+    material2 = Lambertian.from_color(Color(0.4, 0.2, 0.1))
+    world.add(Sphere(1.0, material2, Point3(-4, 1, 0)))
+
+    material3 = Metal(Color(0.7, 0.6, 0.5), 0.0)
+    world.add(Sphere(1.0, material3, Point3(4, 1, 0)))
+
+    camera = Camera(
+        vfov=20,
+        lookfrom=Point3(13, 2, 3),
+        lookat=Point3(0, 0, 0),
+        vup=Vec3(0, 1, 0),
+
+        defocus_angle=0.6,
+        focus_dist=10.0,
+    )
+
+    return world, camera
+
+
+def bouncing_spheres_ortho():
+    world, camera = bouncing_spheres()
+    camera.mode = "orthographic"
+    return world, camera
+
+
+def checkered_spheres():
+    world = HittableList()
+
+    checker = Checker.from_colors(0.32, Color(0.2, 0.3, 0.1), Color.all(0.9))
+
+    world.add(Sphere(10, Lambertian(checker), Point3(0, -10, 0)))
+    world.add(Sphere(10, Lambertian(checker), Point3(0,  10, 0)))
+
+    camera = Camera(
+        vfov=20,
+        lookfrom=Point3(13, 2, 3),
+        lookat=Point3(0, 0, 0),
+        vup=Vec3(0, 1, 0),
+
+        defocus_angle=0,
+    )
+
+    return world, camera
+
+
+def earth(mipmap: bool = False):
+    world = HittableList()
+
+    # Not in book: the texture can be read from a mip pyramid and filtered, which matters when
+    # many texels fall in a pixel
+    earth_texture: Texture = ImageTexture("images/earthmap.jpg")
+    if mipmap:
+        earth_texture = MipmapTexture("images/earthmap.jpg")
+    earth_surface = Lambertian(earth_texture)
+    globe = Sphere(2, earth_surface, Point3(0, 0, 0))
+
+    world.add(globe)
+
+    camera = Camera(
+        vfov=20,
+        lookfrom=Point3(0, 0, 12),
+        lookat=Point3(0, 0, 0),
+        vup=Vec3(0, 1, 0),
+
+        defocus_angle=0,
+    )
+
+    return world, camera
+
+
+def perlin_spheres():
+    world = HittableList()
+
+    perlin_texture = Lambertian(NoiseTexture(4))
+    world.add(Sphere(1000, perlin_texture, Point3(0, -1000, 0)))
+    world.add(Sphere(2, perlin_texture, Point3(0, 2, 0)))
+
+    camera = Camera(
+        vfov=20,
+        lookfrom=Point3(13, 2, 3),
+        lookat=Point3(0, 0, 0),
+        vup=Vec3(0, 1, 0),
+
+        defocus_angle=0,
+    )
+
+    return world, camera
+
+
+def sphere_field(count: int = 10000, seed: int = 0):
+    # Not in book: a large field of small spheres, deep enough to stress the acceleration
+    # structures. Materials come from a small palette so that they don't dominate memory.
+    rng = Rng(seed)
+    world = HittableList()
+
+    checker = Checker.from_colors(0.32, Color(0.2, 0.3, 0.1), Color.all(0.9))
+    world.add(Sphere(1000, Lambertian(checker), Point3(0, -1000, 0)))
+
+    palette: List[Material] = []
+    for _ in range(12):
+        palette.append(Lambertian.from_color(Color.random(rng) * Color.random(rng)))
+    for _ in range(4):
+        palette.append(Metal(Color.random(rng, 0.5, 1), rng.uniform(0, 0.3)))
+
+    # The field grows with the count, so that the density of spheres stays the same
+    half_size = 0.5 * sqrt(count)
+    for _ in range(count):
+        center = Point3(rng.uniform(-half_size, half_size), rng.uniform(0.2, 3.0), rng.uniform(-half_size, half_size))
+        world.add(Sphere(0.2, palette[rng.randrange(len(palette))], center))
+
+    camera = Camera(
+        vfov=40,
+        lookfrom=Point3(half_size + 4, 6, half_size + 4),
+        lookat=Point3(0, 0, 0),
+        vup=Vec3(0, 1, 0),
+
+        defocus_angle=0,
+    )
+
+    return world, camera
+
+
+scene_names = [
+    "bouncing_spheres",
+    "bouncing_spheres_ortho",
+    "checkered_spheres",
+    "earth",
+    "perlin_spheres",
+    "sphere_field",
+]
+
+
+def load_scene(name: str) -> Tuple[HittableList, Camera]:
+    """Build one of the scenes above from its name, or the scene of a scene file from its path."""
+    if name.endswith(".scene") or name.endswith(".rtowscene"):
+        return load_scene_file(name)
+    if name == "bouncing_spheres":
+        return bouncing_spheres()
+    if name == "bouncing_spheres_ortho":
+        return bouncing_spheres_ortho()
+    if name == "checkered_spheres":
+        return checkered_spheres()
+    if name == "earth":
+        return earth()
+    if name == "perlin_spheres":
+        return perlin_spheres()
+    if name == "sphere_field":
+        return sphere_field()
+    assert False, f"Unknown scene: {name}"
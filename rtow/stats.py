@@ -0,0 +1,136 @@
+from typing import List
+
+from .buffer import Buffer, heat, pixel_floats
+
+
+# Not in book: counters of the work done by the rays of a render, to see why a scene is
+# slow. They are off unless Tracer(stats=True): every tile then gets its own
+# RenderStats, carried by its rays down to the BVH and the primitives, which add to it; the
+# counters of the tiles are added up once they are done. When off, rays carry None and the
+# cost is a test per intersection call. Materials pass the counters of their rays on to
+# mipmapped textures, which count the tiles they find in their cache or have to decode.
+#
+# The counts of every pixel are also kept, as sums over its samples in the layout of Buffer,
+# and saved as heatmaps of the mean per sample.
+
+# Per-pixel counts, in the order of the floats of a pixel of Buffer (the 4th is the samples)
+heatmap_names = ["nodes", "tests", "bounces"]
+
+
+class RenderStats:
+    camera_rays: int
+    rays: int                 # Rays traced, camera and secondary
+    node_visits: int          # BVH nodes visited
+    box_tests: int            # Slab tests of node boxes
+    primitive_tests: int      # Intersection tests of spheres
+    path_lengths: List[int]   # Count of paths of every length in rays, up to max_depth
+    texture_hits: int         # Tiles of mipmapped textures found decoded in their cache
+    texture_misses: int       # Tiles of mipmapped textures decoded from their file
+    texture_evictions: int    # Decoded tiles replaced in a cache by a miss
+    pixels: List[float]       # Per-pixel counts of the pixels rendered, see above
+    pixel_start: List[int]    # Counters at the start of the current pixel
+
+    def __init__(self, max_depth: int):
+        self.camera_rays = 0
+        self.rays = 0
+        self.node_visits = 0
+        self.box_tests = 0
+        self.primitive_tests = 0
+        self.path_lengths = [0 for _ in range(max_depth + 1)]
+        self.texture_hits = 0
+        self.texture_misses = 0
+        self.texture_evictions = 0
+        self.pixels = []
+        self.pixel_start = [0, 0, 0]
+
+    def add_ray(self):
+        self.rays += 1
+
+    def add_traversal(self, nodes: int, boxes: int):
+        self.node_visits += nodes
+        self.box_tests += boxes
+
+    def add_primitive_tests(self, tests: int):
+        self.primitive_tests += tests
+
+    def add_texture_tile(self, hit: bool):
+        if hit:
+            self.texture_hits += 1
+        else:
+            self.texture_misses += 1
+
+    def add_texture_eviction(self):
+        self.texture_evictions += 1
+
+    def add_path(self, rays: int):
+        """Count a camera ray and the rays of its path."""
+        self.camera_rays += 1
+        self.path_lengths[min(rays, len(self.path_lengths) - 1)] += 1
+
+    def start_pixel(self):
+        self.pixel_start = [self.node_visits, self.primitive_tests, self.rays - self.camera_rays]
+
+    def end_pixel(self, samples: int):
+        """Append the counts of the pixel since start_pixel to pixels."""
+        start = self.pixel_start
+        self.pixels.append(float(self.node_visits - start[0]))
+        self.pixels.append(float(self.primitive_tests - start[1]))
+        self.pixels.append(float(self.rays - self.camera_rays - start[2]))
+        self.pixels.append(float(samples))
+
+    def merge(self, other: RenderStats):
+        """Add the counters of other, but not its pixels."""
+        self.camera_rays += other.camera_rays
+        self.rays += other.rays
+        self.node_visits += other.node_visits
+        self.box_tests += other.box_tests
+        self.primitive_tests += other.primitive_tests
+        self.texture_hits += other.texture_hits
+        self.texture_misses += other.texture_misses
+        self.texture_evictions += other.texture_evictions
+        for i in range(min(len(self.path_lengths), len(other.path_lengths))):
+            self.path_lengths[i] += other.path_lengths[i]
+
+    def report(self):
+        rays = max(1, self.rays)
+        paths = max(1, self.camera_rays)
+        print(f"Camera rays:       {self.camera_rays:14d}")
+        print(f"Secondary rays:    {self.rays - self.camera_rays:14d}")
+        print(f"Nodes per ray:     {self.node_visits / rays:14.2f}")
+        print(f"Box tests per ray: {self.box_tests / rays:14.2f}")
+        print(f"Sphere tests/ray:  {self.primitive_tests / rays:14.2f}")
+        print(f"Rays per path:     {self.rays / paths:14.2f}")
+        tiles = self.texture_hits + self.texture_misses
+        if tiles > 0:
+            print(f"Texture tile hits: {self.texture_hits:14d} ({100 * self.texture_hits / tiles:.1f}%)")
+            print(f"Texture misses:    {self.texture_misses:14d}")
+            print(f"Texture evictions: {self.texture_evictions:14d}")
+        for length in range(1, len(self.path_lengths)):
+            count = self.path_lengths[length]
+            if count == 0:
+                continue
+            bar = "#" * int(round(40 * count / paths))
+            print(f"  {length:3d} rays:       {100 * count / paths:13.1f}% {bar}")
+
+
+def save_heatmaps(maps: Buffer, name: str):
+    """
+    Save the mean per sample of every count of maps as renders/<name>_<count>.ppm, from black
+    for none to white for the highest of the image, and print that highest mean.
+    """
+
+    for channel, count in enumerate(heatmap_names):
+        means: List[float] = []
+        for y in range(maps.h):
+            row = maps.row(y)
+            for k in range(0, len(row), pixel_floats):
+                n = float(row[k + 3])
+                means.append(float(row[k + channel]) / n if n > 0 else 0.0)
+
+        highest = max(means) if len(means) > 0 else 0.0
+        heatmap = Buffer(maps.w, maps.h)
+        for y in range(maps.h):
+            for x in range(maps.w):
+                heatmap.add(x, y, heat(means[y * maps.w + x] / highest if highest > 0 else 0.0), 1)
+        heatmap.save_ppm(f"{name}_{count}")
+        print(f"Heatmap {count + ':':10} {highest:14.1f} per sample at most, renders/{name}_{count}.ppm")
@@ -3,3 +3,4 @@ from .solid_color import SolidColor
 from .checker import Checker
 from .image_texture import ImageTexture
 from .noise import NoiseTexture
+from .mipmap_texture import MipmapTexture
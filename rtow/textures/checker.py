@@ -1,8 +1,10 @@
 from math import floor
+from typing import Optional
 
 from .texture import Texture
 from .solid_color import SolidColor
 from .. import Color, Point3
+from ..stats import RenderStats
 
 class Checker(Texture):
     inv_scale: float
@@ -18,11 +20,18 @@ class Checker(Texture):
     def from_colors(scale: float, even: Color, odd: Color):
         return Checker(scale, SolidColor(even), SolidColor(odd))
 
-    def value(self, u: float, v: float, p: Point3) -> Color:
+    def is_even(self, p: Point3) -> bool:
         x = floor(self.inv_scale * p.x)
         y = floor(self.inv_scale * p.y)
         z = floor(self.inv_scale * p.z)
 
-        is_even = (x + y + z) % 2 == 0
+        return (x + y + z) % 2 == 0
+
+    def value(self, u: float, v: float, p: Point3) -> Color:
+        return (self.even if self.is_even(p) else self.odd).value(u, v, p)
+
+    def filtered_value(self, u: float, v: float, p: Point3, footprint: float, stats: Optional[RenderStats]) -> Color:
+        return (self.even if self.is_even(p) else self.odd).filtered_value(u, v, p, footprint, stats)
 
-        return (self.even if is_even else self.odd).value(u, v, p)
+    def needs_uv(self) -> bool:
+        return self.even.needs_uv() or self.odd.needs_uv()
@@ -1,12 +1,15 @@
 from .texture import Texture
 from .. import Point3, Color, Image, Interval
+from ..profiler import phases
 
 
 class ImageTexture(Texture):
     image: Image
 
     def __init__(self, image_filename: str):
+        phases.start("textures")
         self.image = Image(image_filename)
+        phases.stop("textures")
 
     def value(self, u: float, v: float, p: Point3) -> Color:
         # If we have no texture data, then return solid cyan as a debugging aid
@@ -21,3 +24,6 @@ class ImageTexture(Texture):
         j = int(v * self.image.height)
 
         return self.image[i, j]
+
+    def needs_uv(self) -> bool:
+        return True
@@ -0,0 +1,32 @@
+from typing import Optional
+
+from .texture import Texture
+from .. import Point3, Color, MipTexture, Interval
+from ..profiler import phases
+from ..stats import RenderStats
+
+
+class MipmapTexture(Texture):
+    """
+    Not in book: image texture read from a tiled mip pyramid (see mipmap.py), filtered over
+    the footprint of the rays that hit it. Only the tiles that renders touch are decoded, in
+    a cache of at most cache_bytes.
+    """
+
+    mip: MipTexture
+
+    def __init__(self, image_filename: str, cache_bytes: int = 64 << 20):
+        phases.start("textures")
+        self.mip = MipTexture(image_filename, cache_bytes)
+        phases.stop("textures")
+
+    def value(self, u: float, v: float, p: Point3) -> Color:
+        return self.filtered_value(u, v, p, 0.0, None)
+
+    def filtered_value(self, u: float, v: float, p: Point3, footprint: float, stats: Optional[RenderStats]) -> Color:
+        u = Interval(0, 1).clamp(u)
+        v = 1.0 - Interval(0, 1).clamp(v)  # Flip V to image coordinates
+        return self.mip.lookup(u, v, footprint, stats)
+
+    def needs_uv(self) -> bool:
+        return True
@@ -6,9 +6,11 @@ class NoiseTexture(Texture):
     noise: Perlin
     scale: float
 
-    def __init__(self, scale = 1.0):
-        self.noise = Perlin()
+    def __init__(self, scale = 1.0, seed: int = 0):
+        self.noise = Perlin(seed)
         self.scale = scale
 
     def value(self, u: float, v: float, p: Point3) -> Color:
-        return Color(1, 1, 1) * 0.5 * (1.0 + self.noise.noise(self.scale * p))
+        # Not in book: the scaled point is not built as a Vec3
+        n = self.noise.noise_at(self.scale * p.x, self.scale * p.y, self.scale * p.z)
+        return Color.all(0.5 * (1.0 + n))
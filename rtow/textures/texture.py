@@ -1,6 +1,18 @@
+from typing import Optional
+
 from .. import Point3, Color
+from ..stats import RenderStats
 
 
 class Texture:
     def value(self, u: float, v: float, p: Point3) -> Color:
         assert False, "Calling abstract"
+
+    def filtered_value(self, u: float, v: float, p: Point3, footprint: float, stats: Optional[RenderStats]) -> Color:
+        # Not in book: value averaged over a footprint as wide as footprint in texture
+        # coordinates, only mipmapped textures filter (and count their tiles in stats)
+        return self.value(u, v, p)
+
+    def needs_uv(self) -> bool:
+        # Not in book: whether value reads u and v, most textures only use the hit point
+        return False
@@ -0,0 +1,142 @@
+from threading import Lock
+from typing import List
+
+
+# Not in book: the image is split into square tiles that can be rendered independently,
+# which is what lets the tracer hand them out to several workers
+
+
+class Tile:
+    index: int  # Position of the tile in render order
+    x0: int     # First column of the tile
+    y0: int     # First row of the tile
+    x1: int     # Column just after the tile
+    y1: int     # Row just after the tile
+    seed: int   # Seed for every random sample taken inside the tile
+
+    def __init__(self, index: int, x0: int, y0: int, x1: int, y1: int, seed: int):
+        self.index = index
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+        self.seed = seed
+
+    def width(self) -> int:
+        return self.x1 - self.x0
+
+    def height(self) -> int:
+        return self.y1 - self.y0
+
+    def __repr__(self):
+        return f"Tile(index={self.index}, x={self.x0}..{self.x1}, y={self.y0}..{self.y1})"
+
+
+def hash32(x: int) -> int:
+    # Integer finalizer from MurmurHash3, kept to 32 bits so that Codon's 64 bit ints
+    # and Python's big ints give the same result
+    x &= 0xffffffff
+    x ^= x >> 16
+    x = (x * 0x85ebca6b) & 0xffffffff
+    x ^= x >> 13
+    x = (x * 0xc2b2ae35) & 0xffffffff
+    x ^= x >> 16
+    return x
+
+
+def tile_seed(seed: int, tx: int, ty: int) -> int:
+    # Seeds depend on the tile position only, not on the order tiles are rendered in
+    return hash32(hash32(hash32(seed) + tx) + ty)
+
+
+def spread_bits(n: int) -> int:
+    # Insert a zero bit between each of the lower 16 bits of n
+    n &= 0x0000ffff
+    n = (n | (n << 8)) & 0x00ff00ff
+    n = (n | (n << 4)) & 0x0f0f0f0f
+    n = (n | (n << 2)) & 0x33333333
+    n = (n | (n << 1)) & 0x55555555
+    return n
+
+
+def morton(x: int, y: int) -> int:
+    """Returns the index of x, y along the Z-order curve."""
+    return spread_bits(x) | (spread_bits(y) << 1)
+
+
+def make_tiles(width: int, height: int, size: int, seed: int) -> List[Tile]:
+    """
+    Split a width x height image into tiles of size x size pixels (smaller at the right and
+    bottom edges), returned in Morton order so that consecutive tiles cover nearby parts of
+    the scene.
+    """
+
+    tiles_x = (width + size - 1) // size
+    tiles_y = (height + size - 1) // size
+
+    cells = [(morton(tx, ty), tx, ty) for ty in range(tiles_y) for tx in range(tiles_x)]
+    cells.sort()
+
+    tiles: List[Tile] = []
+    for index, cell in enumerate(cells):
+        _, tx, ty = cell
+        x0, y0 = tx * size, ty * size
+        tiles.append(Tile(
+            index=index,
+            x0=x0,
+            y0=y0,
+            x1=min(x0 + size, width),
+            y1=min(y0 + size, height),
+            seed=tile_seed(seed, tx, ty),
+        ))
+
+    return tiles
+
+
+class TileQueue:
+    """
+    Work-stealing queue of tile indices. Every worker gets a contiguous run of tiles, which
+    it takes from the front; a worker whose run is empty steals from the back of another's,
+    where the tiles are the furthest away from what its owner is rendering.
+    """
+
+    heads: List[int]    # Next tile at the front of each worker's run
+    tails: List[int]    # Tile just after the back of each worker's run
+    locks: List[Lock]   # One lock per run, so workers only contend when stealing
+    completed: int      # Count of tiles reported as done
+    completed_lock: Lock
+
+    def __init__(self, n_tiles: int, workers: int):
+        self.heads = [n_tiles * w // workers for w in range(workers)]
+        self.tails = [n_tiles * (w + 1) // workers for w in range(workers)]
+        self.locks = [Lock() for _ in range(workers)]
+        self.completed = 0
+        self.completed_lock = Lock()
+
+    def pop(self, worker: int) -> int:
+        """Returns the next tile index for worker, or -1 once every tile has been taken."""
+        with self.locks[worker]:
+            if self.heads[worker] < self.tails[worker]:
+                self.heads[worker] += 1
+                return self.heads[worker] - 1
+
+        workers = len(self.heads)
+        for k in range(1, workers):
+            victim = (worker + k) % workers
+            with self.locks[victim]:
+                if self.heads[victim] < self.tails[victim]:
+                    self.tails[victim] -= 1
+                    return self.tails[victim]
+
+        return -1
+
+    def complete(self) -> int:
+        """Mark a tile as done, returns how many are done so far."""
+        with self.completed_lock:
+            self.completed += 1
+            return self.completed
+
+
+if __name__ == "__main__":
+    for tile in make_tiles(100, 60, 32, 0):
+        print(tile, tile.seed)
@@ -1,15 +1,39 @@
-from random import random
 import sys
-from math import tan
+from math import sqrt, tan
+from time import time
+from threading import Lock
+from typing import List, Optional, Tuple
 
 from .util import degrees_to_radians, sample_square, p_inf
 from .buffer import Buffer
+# <python-only>
+from .mapped_buffer import MappedBuffer
+# </python-only>
 from .interval import Interval
-from .objects import Hittable, HittableList
+from .objects import Hittable, HitRecord, HittableList
 from .ray import Ray
 from .vec3 import Color, Point3, Vec3
-from .bvh import BVHNode
+from .bvh import BVHNode, BVHStats
+from .flat_bvh import FlatBVH
+from .wide_bvh import WideBVH
+from .bvh_cache import cached_build, scene_key
 from .camera import Camera
+from .tiles import Tile, TileQueue, make_tiles, hash32
+from .rng import Rng
+from .sampler import make_sampler
+from .progressive import Accumulator, resume
+from .wavefront import Path, sort_paths
+from .stats import RenderStats
+from .profiler import TileTimes, phases
+
+
+# Not in book: adaptive sampling compares errors to at least this luminance, so that nearly
+# black pixels do not take every sample
+min_luminance = 0.05
+
+
+def luminance(c: Color) -> float:
+    return 0.2126 * c.x + 0.7152 * c.y + 0.0722 * c.z
 
 
 class Tracer:
@@ -20,7 +44,6 @@ class Tracer:
     pixel_delta_u: Vec3         # Offset to pixel to the right
     pixel_delta_v: Vec3         # Offset to pixel below
     samples_per_pixel: int      # Count of random samples for each pixel (antialiasing)
-    pixel_samples_scale: float  # Color scale factor for a sum of pixel samples
     max_depth: int              # Maximum number of ray bounces into scene
     u: Vec3                     # Camera frame basis vectors
     v: Vec3                     #
@@ -29,8 +52,36 @@ class Tracer:
     defocus_angle: float        # Variation angle of rays through each pixel
     defocus_disk_u: Vec3        # Defocus disk horizontal radius
     defocus_disk_v: Vec3        # Defocus disk vertical radius
+    pixel_width: float          # Width of a pixel on the focal plane, the footprint of camera rays
     render_mode: str            # "full" | "normals"
     camera_mode: str            # "perspective" | "orthographic"
+    workers: int                # 0 or 1: render tiles in this process, N: render tiles on N workers (processes or threads)
+    tile_size: int              # Width and height of a tile in pixels
+    seed: int                   # Base seed of the random sequences
+    verbose: bool               # Print the render report and progress bar
+    bvh_layout: str             # "flat" | "wide" (4 children per node) | "tree" (objects linked together, for debugging)
+    bvh_strategy: str           # "median" | "sah"
+    bvh_leaf_size: int          # Maximum count of objects in a BVH leaf (SAH only)
+    bvh_quantized: bool         # Store the boxes of wide BVH nodes as 8-bit offsets
+    bvh_packed: bool            # Pack the spheres of flat and wide BVH leaves of up to bvh_leaf_size objects in SphereSets
+    bvh_cache: str              # "memory" | "disk" (memory and cache files in cache/) | "off", reuse of built flat and wide BVHs
+    backend: str                # "scalar" | "numpy" (CPython and PyPy with NumPy only: batches of rays traced as arrays)
+    integrator: str             # "recursive" | "iterative" | "wavefront" (tiles traced one bounce at a time)
+    sampler: str                # "independent" | "stratified" | "halton" | "sobol", source of the 2D samples of pixels, lens and bounces
+    roulette_depth: int         # Bounce from which iterative paths can end by Russian roulette, 0 to never end them early
+    adaptive: bool              # Stop sampling pixels whose estimated error is low, samples_per_pixel is then a maximum
+    min_samples: int            # Adaptive: samples taken for every pixel before estimating its error
+    adaptive_threshold: float   # Adaptive: standard error of a pixel's mean luminance, relative to it, below which it is done
+    progressive: bool           # Render the image in passes of pass_samples samples per pixel, added up
+    pass_samples: int           # Progressive: samples per pixel of every pass
+    checkpoint: str             # Progressive: name of the preview image and checkpoint file in renders/, "" for none
+    checkpoint_interval: float  # Progressive: minimum seconds between two checkpoints
+    framebuffer: str            # "" to render in memory, or path of a file the image is rendered into, for images larger than memory
+    stats: bool                 # Count rays, BVH nodes visited, box and sphere tests, for the whole render and every pixel (see stats.py)
+    ray_stats: RenderStats      # Stats: counters of the last render
+    stats_maps: Buffer          # Stats: counts of every pixel of the last render, in the order of heatmap_names
+    profile: bool               # Time every tile, and print rays per second and the spread of tile times
+    tile_times: TileTimes       # Profile: seconds taken by the tiles of the last render
 
     def __init__(
             self,
@@ -40,15 +91,86 @@ class Tracer:
             samples_per_pixel: int = 10,
             max_depth: int = 10,
             render_mode: str = "full",
+            workers: int = 0,
+            tile_size: int = 32,
+            seed: int = 0,
+            verbose: bool = True,
+            bvh_layout: str = "flat",
+            bvh_strategy: str = "median",
+            bvh_leaf_size: int = 4,
+            bvh_quantized: bool = False,
+            bvh_packed: bool = False,
+            bvh_cache: str = "memory",
+            backend: str = "scalar",
+            integrator: str = "recursive",
+            sampler: str = "independent",
+            roulette_depth: int = 3,
+            adaptive: bool = False,
+            min_samples: int = 16,
+            adaptive_threshold: float = 0.05,
+            progressive: bool = False,
+            pass_samples: int = 4,
+            checkpoint: str = "",
+            checkpoint_interval: float = 60.0,
+            framebuffer: str = "",
+            stats: bool = False,
+            profile: bool = False,
         ):
         self.image_width = image_width
         self.samples_per_pixel = samples_per_pixel
         self.render_mode = render_mode
         self.camera_mode = camera.mode
+        self.workers = workers
+        self.tile_size = tile_size
+        self.seed = seed
+        self.verbose = verbose
+        self.bvh_layout = bvh_layout
+        self.bvh_strategy = bvh_strategy
+        self.bvh_leaf_size = bvh_leaf_size
+        self.bvh_quantized = bvh_quantized
+        self.bvh_packed = bvh_packed
+        self.bvh_cache = bvh_cache
+        self.backend = backend
+        self.integrator = integrator
+        self.sampler = sampler
+        self.roulette_depth = roulette_depth
+        self.adaptive = adaptive
+        self.min_samples = min_samples
+        self.adaptive_threshold = adaptive_threshold
+        self.progressive = progressive
+        self.pass_samples = pass_samples
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.framebuffer = framebuffer
+        # Passes are added up in memory
+        assert framebuffer == "" or not progressive, "Progressive renders can't use a framebuffer file"
+        # <codon-only>
+        # The mmap bindings of MappedBuffer have not been compiled with Codon yet
+        assert framebuffer == "", "Codon builds can't render into a framebuffer file yet"
+        # </codon-only>
+        # Every pass samples its pixels from scratch, their errors are not carried over
+        assert not (adaptive and progressive), "Progressive renders can't sample adaptively"
+        self.stats = stats
+        self.ray_stats = RenderStats(max_depth)
+        self.stats_maps = Buffer(0, 0)
+        assert not stats or backend == "scalar", "Stats are only counted by the scalar backend"
+        assert not (adaptive and integrator == "wavefront"), "The wavefront integrator can't sample adaptively"
+        self.profile = profile
+        self.tile_times = TileTimes()
+
+        assert backend in ("scalar", "numpy"), f"Unknown backend: {backend}"
+        if backend == "numpy":
+            # It traces the tiles of a flat BVH one after the other, with the recursive
+            # integrator's bounces and NumPy's random numbers (see numpy_backend.py)
+            assert workers == 0, "The NumPy backend renders in a single process"
+            assert bvh_layout == "flat" and not bvh_packed, "The NumPy backend only traverses unpacked flat BVHs"
+            assert integrator == "recursive", "The NumPy backend has its own integrator, like the recursive one"
+            assert sampler == "independent", "The NumPy backend only takes independent samples"
+            assert not adaptive and not progressive, "The NumPy backend takes samples_per_pixel samples in one pass"
+            assert not profile, "The NumPy backend does not time its tiles"
 
         self.image_height = max(1, int(image_width / aspect_ratio))
         real_aspect_ratio = image_width / self.image_height
-        self.pixel_samples_scale = 1.0 / samples_per_pixel
 
         self.center = camera.lookfrom
         self.focus_dist = camera.focus_dist
@@ -74,6 +196,7 @@ class Tracer:
         # Calculate the horizontal and vertical delta vectors from pixel to pixel
         self.pixel_delta_u = viewport_u / self.image_width
         self.pixel_delta_v = viewport_v / self.image_height
+        self.pixel_width = self.pixel_delta_u.length()
 
         # Calculate the location of the upper left pixel
         viewport_upper_left = self.center - (camera.focus_dist * self.w) - viewport_u / 2 - viewport_v / 2
@@ -84,11 +207,25 @@ class Tracer:
         self.defocus_disk_u = self.u * defocus_radius
         self.defocus_disk_v = self.v * defocus_radius
 
-    def ray_color(self, r: Ray, depth: int, world: Hittable) -> Color:
+    # <python-only>
+    def __getstate__(self):
+        # Workers count the rays of their tiles in stats of their own, sent back with the
+        # tiles: the counters and maps of the render stay in the main process
+        state = dict(self.__dict__)
+        state["ray_stats"] = RenderStats(self.max_depth)
+        state["stats_maps"] = Buffer(0, 0)
+        state["tile_times"] = TileTimes()
+        return state
+    # </python-only>
+
+    def ray_color(self, r: Ray, depth: int, world: Hittable, rng: Rng) -> Color:
         # If we've exceeded the ray bounce limit, no more light is gathered
         if depth <= 0:
             return Color(0, 0, 0)
 
+        if r.stats:
+            r.stats.add_ray()
+
         # Min distance is 0.001 to avoid floating point precision errors
         # That way if the ray starts just below a surface,
         # that surface will be ignored and the ray can escape
@@ -98,9 +235,10 @@ class Tracer:
             if self.render_mode == "normals":
                 return 0.5 * (rec.hit.normal + Color(1, 1, 1))
 
-            scatter = rec.mat.scatter(r, rec.hit)
+            scatter = rec.mat.scatter(r, rec.hit, rng)
             if scatter:
-                return scatter.attenuation * self.ray_color(scatter.scattered, depth - 1, world)
+                scatter.scattered.stats = r.stats
+                return scatter.attenuation * self.ray_color(scatter.scattered, depth - 1, world, rng)
             return Color(0, 0, 0)
 
         # Sky
@@ -108,58 +246,565 @@ class Tracer:
         a = 0.5 * (unit_direction.y + 1.0)
         return (1.0 - a) * Color(1.0, 1.0, 1.0) + a * Color(0.5, 0.7, 1.0)
 
-    def report(self, bvh_depth: int):
+    def ray_color_iterative(self, r: Ray, world: Hittable, rng: Rng) -> Color:
+        """
+        Not in book: same estimate as ray_color, computed in a loop. The product of the
+        attenuations along the path (its throughput) is kept in three floats instead of
+        multiplying colors on the way back up the recursion.
+
+        After `roulette_depth` bounces, a path survives each bounce with a probability equal to
+        its brightest throughput channel, and survivors are divided by that probability: dim
+        paths end early, and the mean of the image stays the same (Russian roulette).
+        """
+
+        ray = r
+        tr, tg, tb = 1.0, 1.0, 1.0
+
+        for bounce in range(self.max_depth):
+            if ray.stats:
+                ray.stats.add_ray()
+
+            rec = world.hit(ray, Interval(0.001, p_inf))
+
+            if not rec:
+                # Sky
+                unit_direction = ray.direction.unit()
+                a = 0.5 * (unit_direction.y + 1.0)
+                sky = (1.0 - a) * Color(1.0, 1.0, 1.0) + a * Color(0.5, 0.7, 1.0)
+                return Color(tr * sky.x, tg * sky.y, tb * sky.z)
+
+            if self.render_mode == "normals":
+                return 0.5 * (rec.hit.normal + Color(1, 1, 1))
+
+            scatter = rec.mat.scatter(ray, rec.hit, rng)
+            if not scatter:
+                return Color(0, 0, 0)
+
+            attenuation = scatter.attenuation
+            tr *= attenuation.x
+            tg *= attenuation.y
+            tb *= attenuation.z
+            scatter.scattered.stats = ray.stats
+            ray = scatter.scattered
+
+            if self.roulette_depth > 0 and bounce + 1 >= self.roulette_depth:
+                survival = min(1.0, max(tr, tg, tb))
+                if rng.random() >= survival:
+                    return Color(0, 0, 0)
+                tr /= survival
+                tg /= survival
+                tb /= survival
+
+        # Exceeded the ray bounce limit
+        return Color(0, 0, 0)
+
+    def sample(self, r: Ray, world: Hittable, rng: Rng) -> Color:
+        """Not in book: color seen along a camera ray, with the selected integrator."""
+        stats = r.stats
+        rays = stats.rays if stats else 0
+
+        if self.integrator == "iterative":
+            c = self.ray_color_iterative(r, world, rng)
+        else:
+            c = self.ray_color(r, self.max_depth, world, rng)
+
+        if stats:
+            stats.add_path(stats.rays - rays)
+        return c
+
+    def report(self, bvh: BVHStats, build_time: float):
+        if not self.verbose:
+            return
+
         res1 = f"{self.image_width} x {self.image_height}"
         res2 = f"({self.image_width * self.image_height / 1e6:3.1f}MP)"
-        bvh_info1 = f"{bvh_depth}"
-        bvh_info2 = f"({2**bvh_depth} elems)"
+        bvh_info1 = f"{bvh.depth}"
+        bvh_info2 = f"({2**bvh.depth} elems)"
+        bvh_nodes1 = f"{bvh.nodes} + {bvh.leaves}"
+        workers = f"{self.workers}" if self.workers > 1 else "serial"
         print(f"Resolution:        {res1:>14} {res2}")
+        print(f"BVH layout:        {self.bvh_layout:>14}")
+        print(f"BVH strategy:      {self.bvh_strategy:>14}")
+        if self.bvh_packed:
+            print(f"BVH packed leaves: {self.bvh_leaf_size:14d}")
+        print(f"BVH cache:         {self.bvh_cache:>14}")
         print(f"BVH tree depth:    {bvh_info1:>14} {bvh_info2}")
+        print(f"BVH nodes+leaves:  {bvh_nodes1:>14}")
+        print(f"BVH SAH cost:      {bvh.cost:14.2f}")
+        print(f"BVH build time:    {build_time:13.2f}s")
         print(f"Samples per pixel: {self.samples_per_pixel:14d}")
+        if self.adaptive:
+            samples = f"{self.adaptive_min_samples()}..{self.samples_per_pixel}"
+            print(f"Adaptive sampling: {samples:>14} (error < {self.adaptive_threshold})")
+        if self.progressive:
+            print(f"Samples per pass:  {self.pass_samples:14d}")
         print(f"Max depth:         {self.max_depth:14d}")
+        print(f"Integrator:        {self.integrator:>14}")
+        print(f"Sampler:           {self.sampler:>14}")
         print(f"Mode:              {self.render_mode:>14}")
+        print(f"Workers:           {workers:>14}")
+        print(f"Backend:           {self.backend:>14}")
+        if self.framebuffer != "":
+            print(f"Framebuffer:       {self.framebuffer:>14}")
         print()
 
-    def status(self, i):
+    def status(self, i: int, n: int, unit: str = "tiles"):
+        if not self.verbose:
+            return
+
         i += 1
-        h = self.image_height
-        c = str(i).rjust(len(str(h)))
-        p = i / float(h)
-        pp = "100" if i == h else f"{100 * p:4.1f}"
+        c = str(i).rjust(len(str(n)))
+        p = i / float(n)
+        pp = "100" if i == n else f"{100 * p:4.1f}"
         b0 = "#" * int(p * 20)
         b1 = "-" * (20 - len(b0))
-        print(f"\rRendering rows: [{b0}{b1}] {c} / {h} ({pp}%) ", end="", flush=True, file=sys.stderr)
+        print(f"\rRendering {unit}: [{b0}{b1}] {c} / {n} ({pp}%) ", end="", flush=True, file=sys.stderr)
+
+    def build_flat(self, world: HittableList) -> Tuple[FlatBVH, BVHStats]:
+        # Subtrees of the flat and wide BVHs are built in parallel with the workers (Codon only)
+        workers = max(1, self.workers)
+        strategy, leaf_size, packed = self.bvh_strategy, self.bvh_leaf_size, self.bvh_packed
+        if self.bvh_cache == "off":
+            return FlatBVH.build(world, strategy, leaf_size, workers, packed)
+        return cached_build(world, strategy, leaf_size, workers, self.bvh_cache == "disk", packed)
+
+    def build_bvh(self, world: HittableList) -> Tuple[Hittable, BVHStats]:
+        if self.bvh_layout == "tree":
+            return BVHNode.from_list(world, self.bvh_strategy, self.bvh_leaf_size)
+
+        flat, stats = self.build_flat(world)
+        if self.bvh_packed:
+            flat = flat.pack()
+
+        root: Hittable = flat
+        if self.bvh_layout == "wide":
+            root = WideBVH.from_flat(flat, self.bvh_quantized)
+        return root, stats
 
     def render(self, world: HittableList) -> Buffer:
-        b = Buffer(self.image_width, self.image_height)
-        bvh, depth = BVHNode.from_list(world)
+        # <python-only>
+        if self.backend == "numpy":
+            return self.render_numpy(world)
+        # </python-only>
+
+        phases.start("bvh")
+        start = time()
+        bvh, stats = self.build_bvh(world)
+        build_time = time() - start
+        phases.stop("bvh")
+
+        self.report(stats, build_time)
+
+        if self.stats:
+            self.ray_stats = RenderStats(self.max_depth)
+            self.stats_maps = Buffer(self.image_width, self.image_height)
+        self.tile_times = TileTimes()
+
+        phases.start("render")
+        start = time()
+        if self.progressive:
+            scene = scene_key(world, self.bvh_strategy, self.bvh_leaf_size, self.bvh_packed)
+            b = self.render_progressive(bvh, scene)
+        else:
+            b = self.render_tiles(bvh)
+        render_time = time() - start
+        phases.stop("render")
+
+        if self.verbose:
+            print()
+            print(f"Render time:       {render_time:13.2f}s")
+            if self.adaptive:
+                print(f"Mean samples:      {b.mean_samples():14.1f}")
+            if self.profile:
+                # Camera rays are the samples, the others are only counted with stats
+                seconds = max(1e-9, render_time)
+                camera_rays = b.mean_samples() * self.image_width * self.image_height
+                print(f"Camera rays/s:     {camera_rays / seconds:14.0f}")
+                if self.stats:
+                    print(f"Rays/s:            {self.ray_stats.rays / seconds:14.0f}")
+                self.tile_times.report()
+            if self.stats:
+                print()
+                self.ray_stats.report()
+        return b
+
+    # <python-only>
+    def render_numpy(self, world: HittableList) -> Buffer:
+        """Not in book: render with the NumPy backend, see numpy_backend.py."""
+        from .numpy_backend import render_numpy
+
+        phases.start("bvh")
+        start = time()
+        bvh, stats = self.build_flat(world)
+        phases.stop("bvh")
+        self.report(stats, time() - start)
+
+        phases.start("render")
+        start = time()
+        b = render_numpy(self, bvh)
+        phases.stop("render")
+
+        if self.verbose:
+            print()
+            print(f"Render time:       {time() - start:13.2f}s")
+        return b
+    # </python-only>
 
-        self.report(depth)
-        self.status(-1)
+    def render_progressive(self, world: Hittable, scene: str) -> Buffer:
+        """
+        Not in book: render the image in passes of `pass_samples` samples per pixel, adding up
+        the colors and counts of the samples. With a `checkpoint` name, a preview image and a
+        checkpoint file are written every `checkpoint_interval` seconds and at the end.
+
+        An existing checkpoint for the same scene, image and pass settings is continued: after an
+        interruption, or with a higher `samples_per_pixel` to add samples to a finished render.
+        Every pass seeds its own random sequences, so the image does not depend on where it was
+        stopped, as long as passes are not cut short by `samples_per_pixel` (see below).
+        """
 
-        for j in range(self.image_height):
-            row = []
-            for i in range(self.image_width):
-                pixel_color = Color(0, 0, 0)
-                for _ in range(self.samples_per_pixel):
-                    r = self.get_ray(i, j)
-                    pixel_color += self.ray_color(r, self.max_depth, bvh)
+        samples_per_pixel, seed = self.samples_per_pixel, self.seed
+        path = f"renders/{self.checkpoint}.progress"
 
-                row.append(self.pixel_samples_scale * pixel_color)
+        acc = Accumulator(self.image_width, self.image_height)
+        if self.checkpoint != "":
+            acc = resume(path, self.image_width, self.image_height, seed, self.max_depth, scene, self.pass_settings())
+            if acc.passes > 0 and self.verbose:
+                print(f"Resuming after:    {acc.samples:14d} samples")
 
-            self.status(j)
-            b[j] = row
+        last_save = time()
+        while acc.samples < samples_per_pixel:
+            n = min(self.pass_samples, samples_per_pixel - acc.samples)
+            if self.verbose:
+                print(f"\rPass {acc.passes + 1}, samples {acc.samples + 1} to {acc.samples + n}", file=sys.stderr)
+
+            self.samples_per_pixel = n
+            self.seed = hash32(hash32(seed) + acc.passes)
+            b = self.render_tiles(world)
+            acc.add(b, n)
+
+            done = acc.samples >= samples_per_pixel
+            if self.checkpoint != "" and (done or time() - last_save >= self.checkpoint_interval):
+                acc.buffer.save_ppm(self.checkpoint)
+                acc.save(path, seed, self.max_depth, scene, self.pass_settings())
+                last_save = time()
+
+        self.samples_per_pixel, self.seed = samples_per_pixel, seed
+        return acc.buffer
+
+    def pass_settings(self) -> str:
+        """
+        Not in book: settings that change the samples of a pass, other than the seed and max
+        depth. Passes rendered with other settings are not added to a checkpoint.
+        """
+        return (
+            f"passes of {self.pass_samples}, {self.sampler} sampler, {self.integrator} integrator, "
+            f"roulette from {self.roulette_depth}, {self.render_mode} mode"
+        )
+
+    def new_buffer(self) -> Buffer:
+        """Not in book: buffer to render the image into, in memory or mapped from the framebuffer file."""
+        # <python-only>
+        if self.framebuffer != "":
+            mapped: Buffer = MappedBuffer(self.framebuffer, self.image_width, self.image_height)
+            return mapped
+        # </python-only>
+        return Buffer(self.image_width, self.image_height)
+
+    def new_stats(self) -> Optional[RenderStats]:
+        """Not in book: counters for the rays of a tile, None if stats are off."""
+        return RenderStats(self.max_depth) if self.stats else None
+
+    def add_stats(self, tile: Tile, stats: RenderStats):
+        """Not in book: add the counters of a tile to the render's, and its pixels to the maps."""
+        self.ray_stats.merge(stats)
+        self.stats_maps.paste(tile, stats.pixels)
+
+    def render_tiles(self, world: Hittable) -> Buffer:
+        """
+        Not in book: render the image tile by tile, spread over `workers` processes in Python
+        and PyPy, or threads in Codon, or in this process with 0 or 1 worker. Every tile seeds
+        its own random sequence, so the result does not depend on the number of workers or on
+        the order in which tiles are finished.
+        """
+
+        tiles = make_tiles(self.image_width, self.image_height, self.tile_size, self.seed)
+        self.status(-1, len(tiles), "tiles")
+
+        b = self.new_buffer()
+
+        # <codon-only>
+        if self.workers > 1:
+            self.render_tiles_threaded(tiles, world, b)
+            return b
+        # </codon-only>
+
+        # <python-only>
+        if self.workers > 1:
+            from multiprocessing import Pool
+
+            with Pool(self.workers, initializer=init_worker, initargs=(self, world)) as pool:
+                results = pool.imap_unordered(render_worker_tile, tiles)
+                for n, (index, pixels, stats, seconds) in enumerate(results):
+                    b.paste(tiles[index], pixels)
+                    if stats:
+                        self.add_stats(tiles[index], stats)
+                    if self.profile:
+                        self.tile_times.add(tiles[index], seconds)
+                    self.status(n, len(tiles), "tiles")
+            return b
+        # </python-only>
+
+        for n, tile in enumerate(tiles):
+            pixels: List[float] = []
+            start = time()
+            stats = self.new_stats()
+            self.render_tile(tile, world, pixels, stats)
+            seconds = time() - start
+            b.paste(tile, pixels)
+            if stats:
+                self.add_stats(tile, stats)
+            if self.profile:
+                self.tile_times.add(tile, seconds)
+            self.status(n, len(tiles), "tiles")
 
-        print()
         return b
 
-    def get_ray(self, i: int, j: int) -> Ray:
+    def render_tiles_threaded(self, tiles: List[Tile], world: Hittable, b: Buffer):
+        """
+        Not in book: render the tiles on `workers` threads. Each thread takes tiles from a
+        work-stealing queue and renders them into a list of pixels of its own, so the only
+        state shared in the hot loop is the read-only scene. Every tile is added to the buffer
+        as soon as it is done, under a lock, so that at most one tile per thread is held
+        outside of it.
+        """
+
+        workers = self.workers
+        queue = TileQueue(len(tiles), workers)
+        lock = Lock()
+
+        @par(schedule="static", chunk_size=1, num_threads=workers)
+        for worker in range(workers):
+            pixels: List[float] = []
+            index = queue.pop(worker)
+            while index >= 0:
+                start = time()
+                stats = self.new_stats()
+                self.render_tile(tiles[index], world, pixels, stats)
+                seconds = time() - start
+                with lock:
+                    b.paste(tiles[index], pixels)
+                    if stats:
+                        self.add_stats(tiles[index], stats)
+                    if self.profile:
+                        self.tile_times.add(tiles[index], seconds)
+                    # One progress line at a time
+                    self.status(queue.complete() - 1, len(tiles), "tiles")
+                pixels.clear()
+                index = queue.pop(worker)
+
+    def render_tile(self, tile: Tile, world: Hittable, pixels: List[float], stats: Optional[RenderStats] = None):
+        """
+        Render the pixels of a tile, appended to pixels in row-major order as the sums of their
+        RGB values followed by their count of samples (the layout of Buffer). With stats, the
+        rays of the tile are counted in it.
+        """
+
+        rng = Rng(tile.seed, make_sampler(self.sampler, self.samples_per_pixel))
+
+        if self.integrator == "wavefront":
+            self.render_tile_wavefront(tile, world, rng, pixels, stats)
+            return
+
+        for j in range(tile.y0, tile.y1):
+            for i in range(tile.x0, tile.x1):
+                if stats:
+                    stats.start_pixel()
+                pixel_color, samples = self.render_pixel(i, j, world, rng, stats)
+                pixels.append(pixel_color.x)
+                pixels.append(pixel_color.y)
+                pixels.append(pixel_color.z)
+                pixels.append(float(samples))
+                if stats:
+                    stats.end_pixel(samples)
+
+    def render_tile_wavefront(self, tile: Tile, world: Hittable, rng: Rng, pixels: List[float], stats: Optional[RenderStats] = None):
+        """
+        Not in book: render a tile with the wavefront integrator. The camera rays of every
+        sample of the tile are queued, then each bounce intersects the whole queue, shades the
+        hits grouped by material type and queues the scattered rays sorted by origin and
+        direction, so that consecutive rays go through the same BVH nodes and materials.
+        Paths end like in ray_color_iterative, Russian roulette included. Every pixel takes
+        samples_per_pixel samples, adaptive sampling is rejected by the constructor.
+        """
+
+        count = tile.width() * tile.height()
+        sums = [0.0 for _ in range(3 * count)]
+        # Stats: node visits, sphere tests and secondary rays of every pixel
+        counts = [0 for _ in range(3 * count if stats else 0)]
+
+        paths: List[Path] = []
+        k = 0
+        for j in range(tile.y0, tile.y1):
+            for i in range(tile.x0, tile.x1):
+                seed = self.pixel_seed(i, j)
+                for s in range(self.samples_per_pixel):
+                    rng.start_sample(seed, s)
+                    r = self.get_ray(i, j, rng)
+                    r.stats = stats
+                    paths.append(Path(r, k, seed, s, rng.dimension))
+                k += 1
+
+        for bounce in range(self.max_depth):
+            if len(paths) == 0:
+                break
+
+            # Intersect the whole queue, then order the hits by material type
+            records: List[Optional[HitRecord]] = []
+            hits: List[Tuple[int, int]] = []
+            for n, path in enumerate(paths):
+                p = 3 * path.pixel
+                if stats:
+                    stats.add_ray()
+                    counts[p] -= stats.node_visits
+                    counts[p + 1] -= stats.primitive_tests
+                    counts[p + 2] += 1 if bounce > 0 else 0
+
+                rec = world.hit(path.ray, Interval(0.001, p_inf))
+                records.append(rec)
+
+                if stats:
+                    counts[p] += stats.node_visits
+                    counts[p + 1] += stats.primitive_tests
+                    # Paths that end here are as long as the bounces so far
+                    if not rec or self.render_mode == "normals":
+                        stats.add_path(bounce + 1)
+
+                if rec:
+                    hits.append((rec.mat.kind(), n))
+                else:
+                    # Sky
+                    unit_direction = path.ray.direction.unit()
+                    a = 0.5 * (unit_direction.y + 1.0)
+                    sky = (1.0 - a) * Color(1.0, 1.0, 1.0) + a * Color(0.5, 0.7, 1.0)
+                    sums[p] += path.tr * sky.x
+                    sums[p + 1] += path.tg * sky.y
+                    sums[p + 2] += path.tb * sky.z
+            hits.sort()
+
+            scattered: List[Path] = []
+            for _, n in hits:
+                path = paths[n]
+                rec = records[n]
+                if rec:
+                    if self.render_mode == "normals":
+                        p = 3 * path.pixel
+                        sums[p] += 0.5 * (rec.hit.normal.x + 1)
+                        sums[p + 1] += 0.5 * (rec.hit.normal.y + 1)
+                        sums[p + 2] += 0.5 * (rec.hit.normal.z + 1)
+                        continue
+
+                    # The samples of each path continue where they were
+                    rng.start_sample(path.seed, path.sample, path.dimension)
+                    scatter = rec.mat.scatter(path.ray, rec.hit, rng)
+                    if not scatter:
+                        if stats:
+                            stats.add_path(bounce + 1)
+                        continue
+
+                    attenuation = scatter.attenuation
+                    tr = path.tr * attenuation.x
+                    tg = path.tg * attenuation.y
+                    tb = path.tb * attenuation.z
+
+                    if self.roulette_depth > 0 and bounce + 1 >= self.roulette_depth:
+                        survival = min(1.0, max(tr, tg, tb))
+                        if rng.random() >= survival:
+                            if stats:
+                                stats.add_path(bounce + 1)
+                            continue
+                        tr /= survival
+                        tg /= survival
+                        tb /= survival
+
+                    scatter.scattered.stats = stats
+                    scattered.append(Path(
+                        scatter.scattered, path.pixel, path.seed, path.sample, rng.dimension, tr, tg, tb
+                    ))
+
+            paths = sort_paths(scattered)
+
+        # Paths still going after max_depth bounces
+        if stats:
+            for _ in paths:
+                stats.add_path(self.max_depth)
+
+        for k in range(count):
+            pixels.append(sums[3 * k])
+            pixels.append(sums[3 * k + 1])
+            pixels.append(sums[3 * k + 2])
+            pixels.append(float(self.samples_per_pixel))
+            if stats:
+                stats.pixels.extend([float(counts[3 * k]), float(counts[3 * k + 1]), float(counts[3 * k + 2]), float(self.samples_per_pixel)])
+
+    def render_pixel(self, i: int, j: int, world: Hittable, rng: Rng, stats: Optional[RenderStats] = None) -> Tuple[Color, int]:
+        """Returns the sum of the colors of the samples taken for pixel i, j, and their count."""
+
+        pixel_color = Color(0, 0, 0)
+        seed = self.pixel_seed(i, j)
+
+        if not self.adaptive:
+            for s in range(self.samples_per_pixel):
+                rng.start_sample(seed, s)
+                r = self.get_ray(i, j, rng)
+                r.stats = stats
+                pixel_color += self.sample(r, world, rng)
+            return pixel_color, self.samples_per_pixel
+
+        # Not in book: adaptive sampling, with the running mean and variance of the luminance
+        # of the samples (Welford's algorithm). Once there are enough samples, the pixel is
+        # done when the standard error of its mean is small relative to the mean itself
+        min_samples = self.adaptive_min_samples()
+        n = 0
+        mean = 0.0
+        m2 = 0.0
+        while n < self.samples_per_pixel:
+            rng.start_sample(seed, n)
+            r = self.get_ray(i, j, rng)
+            r.stats = stats
+            c = self.sample(r, world, rng)
+            pixel_color += c
+            n += 1
+
+            y = luminance(c)
+            delta = y - mean
+            mean += delta / n
+            m2 += delta * (y - mean)
+
+            if n >= min_samples:
+                error = sqrt(m2 / ((n - 1) * n))
+                if error <= self.adaptive_threshold * max(mean, min_luminance):
+                    break
+
+        return pixel_color, n
+
+    def adaptive_min_samples(self) -> int:
+        """
+        Not in book: samples taken before estimating the error of a pixel, within the current
+        samples_per_pixel and at least 2 for a variance.
+        """
+        return max(2, min(self.min_samples, self.samples_per_pixel))
+
+    def pixel_seed(self, i: int, j: int) -> int:
+        """Not in book: seed of the samples of pixel i, j, for the sampler."""
+        return hash32(hash32(hash32(self.seed) + i) + j)
+
+    def get_ray(self, i: int, j: int, rng: Rng) -> Ray:
         """
         Construct a camera ray originating from the defocus disk and directed at a randomly
         sampled point around the pixel location i, j.
         """
 
-        offset = sample_square()
+        offset = sample_square(rng)
         pixel_sample = (
             self.pixel00_loc +
             ((i + offset.x) * self.pixel_delta_u) +
@@ -175,19 +820,50 @@ class Tracer:
             ray_origin = pixel_sample + (self.w * self.focus_dist)
 
         if self.defocus_angle > 0:
-            ray_origin += self.defocus_disk_sample()
+            ray_origin += self.defocus_disk_sample(rng)
 
         ray_direction = pixel_sample - ray_origin
 
-        ray_time = random()
+        ray_time = rng.random()
+
+        # Not in book: camera rays are cones one pixel wide, which picks how much textures are
+        # filtered where they hit. Perspective rays start from a point and widen with distance,
+        # orthographic rays are parallel and keep the width of a pixel
+        if self.camera_mode == "perspective":
+            width, spread = 0.0, self.pixel_width / self.focus_dist
+        else:
+            width, spread = self.pixel_width, 0.0
 
         return Ray(
             orig=ray_origin,
             dir=ray_direction,
             time=ray_time,
+            width=width,
+            spread=spread,
         )
 
-    def defocus_disk_sample(self):
+    def defocus_disk_sample(self, rng: Rng):
         """Returns a random point in the camera defocus disk."""
-        p = Vec3.random_in_unit_disk()
+        p = Vec3.random_in_unit_disk(rng)
         return (p.x * self.defocus_disk_u) + (p.y * self.defocus_disk_v)
+
+
+# <python-only>
+# State of a multiprocessing worker: the tracer and the scene are sent once when the worker
+# starts rather than with every tile
+worker_state = {}
+
+
+def init_worker(tracer, world):
+    worker_state["tracer"] = tracer
+    worker_state["world"] = world
+
+
+def render_worker_tile(tile):
+    tracer = worker_state["tracer"]
+    pixels = []
+    start = time()
+    stats = tracer.new_stats()
+    tracer.render_tile(tile, worker_state["world"], pixels, stats)
+    return tile.index, pixels, stats, time() - start
+# </python-only>
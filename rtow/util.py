@@ -1,6 +1,5 @@
 from math import pi
-from random import random
-
+from .rng import Rng
 from .vec3 import Vec3
 
 
@@ -12,6 +11,7 @@ def degrees_to_radians(degrees: float):
     return degrees * pi / 180.0
 
 
-def sample_square() -> Vec3:
+def sample_square(rng: Rng) -> Vec3:
     """Returns the vector to a random point in the [-.5,-.5]-[+.5,+.5] unit square."""
-    return Vec3(random() - 0.5, random() - 0.5, 0)
+    u, v = rng.next_2d()
+    return Vec3(u - 0.5, v - 0.5, 0)
@@ -1,5 +1,6 @@
-from math import sqrt
-from random import random, uniform
+from math import cos, pi, sin, sqrt
+
+from .rng import Rng
 
 s: float = 1e-8
 
@@ -87,34 +88,74 @@ class Vec3:
         return r_out_perp + r_out_parallel
 
     @staticmethod
-    def random():
-        return Vec3(random(), random(), random())
-
-    @staticmethod
-    def random(min: float = 0, max: float = 1):
-        return Vec3(uniform(min, max), uniform(min, max), uniform(min, max))
+    def random(rng: Rng, min: float = 0, max: float = 1):
+        return Vec3(rng.uniform(min, max), rng.uniform(min, max), rng.uniform(min, max))
 
     @staticmethod
-    def random_in_unit_sphere():
+    def random_in_unit_sphere(rng: Rng):
         while True:
-            p = Vec3.random(-1.0, 1.0)
+            p = Vec3(rng.uniform(-1.0, 1.0), rng.uniform(-1.0, 1.0), rng.uniform(-1.0, 1.0))
             if p.length_squared() < 1:
                 return p
 
     @staticmethod
-    def random_in_unit_disk():
-        while True:
-            p = Vec3(uniform(-1.0, 1.0), uniform(-1.0, 1.0), 0)
-            if p.length_squared() < 1:
-                return p
+    def random_in_unit_disk(rng: Rng):
+        # Not in book: the next 2D sample mapped to the disk (concentric mapping), instead of
+        # drawing points in the square until one falls in the disk
+        u, v = rng.next_2d()
+        return Vec3.disk_from_square(u, v)
+
+    @staticmethod
+    def random_unit(rng: Rng):
+        # Not in book: the next 2D sample mapped to the sphere, instead of drawing points in
+        # the cube until one falls in the ball
+        u, v = rng.next_2d()
+        return Vec3.sphere_from_square(u, v)
+
+    @staticmethod
+    def random_cosine_direction(normal: Vec3, rng: Rng):
+        """
+        Not in book: unit vector in the hemisphere around the unit vector normal, with a density
+        proportional to the cosine to the normal: the same distribution as normal + random_unit,
+        normalized. The disk is lifted to the hemisphere, then turned to face the normal with a
+        basis built without branches ("Building an Orthonormal Basis, Revisited", Duff et al.).
+        """
+        u, v = rng.next_2d()
+        d = Vec3.disk_from_square(u, v)
+        z = sqrt(max(0.0, 1.0 - d.x * d.x - d.y * d.y))
+
+        sign = 1.0 if normal.z >= 0 else -1.0
+        a = -1.0 / (sign + normal.z)
+        b = normal.x * normal.y * a
+        t = Vec3(1.0 + sign * normal.x * normal.x * a, sign * b, -sign * normal.x)
+        bt = Vec3(b, sign + normal.y * normal.y * a, -normal.y)
+        return d.x * t + d.y * bt + z * normal
+
+    @staticmethod
+    def disk_from_square(u: float, v: float):
+        # Concentric mapping (Shirley and Chiu), keeps the strata of the square apart
+        a = 2.0 * u - 1.0
+        b = 2.0 * v - 1.0
+        if a == 0 and b == 0:
+            return Vec3(0, 0, 0)
+        if abs(a) > abs(b):
+            r = a
+            phi = (pi / 4) * (b / a)
+        else:
+            r = b
+            phi = pi / 2 - (pi / 4) * (a / b)
+        return Vec3(r * cos(phi), r * sin(phi), 0)
 
     @staticmethod
-    def random_unit():
-        return Vec3.random_in_unit_sphere().unit()
+    def sphere_from_square(u: float, v: float):
+        z = 1.0 - 2.0 * u
+        r = sqrt(max(0.0, 1.0 - z * z))
+        phi = 2 * pi * v
+        return Vec3(r * cos(phi), r * sin(phi), z)
 
     @staticmethod
-    def random_on_hemisphere(normal: Vec3):
-        on_unit_sphere = Vec3.random_unit()
+    def random_on_hemisphere(normal: Vec3, rng: Rng):
+        on_unit_sphere = Vec3.random_unit(rng)
         if on_unit_sphere.dot(normal) > 0.0:  # In the same hemisphere as the normal
             return on_unit_sphere
         return -on_unit_sphere
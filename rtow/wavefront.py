@@ -0,0 +1,89 @@
+from typing import List
+
+from .aabb import AABB
+from .interval import Interval
+from .ray import Ray
+
+
+# Not in book: state of the paths traced by the wavefront integrator, which moves all the
+# paths of a tile one bounce at a time instead of following each path to its end
+
+# Cells per axis of the grid used to sort rays by origin
+grid_size = 32
+
+
+class Path:
+    ray: Ray        # Next ray of the path
+    pixel: int      # Index of the pixel in its tile
+    seed: int       # Sampler state of the path: pixel seed, index of the sample and 2D samples taken
+    sample: int     #
+    dimension: int  #
+    tr: float       # Throughput: product of the attenuations along the path so far
+    tg: float       #
+    tb: float       #
+
+    def __init__(
+            self, ray: Ray, pixel: int, seed: int, sample: int, dimension: int,
+            tr: float = 1.0, tg: float = 1.0, tb: float = 1.0,
+        ):
+        self.ray = ray
+        self.pixel = pixel
+        self.seed = seed
+        self.sample = sample
+        self.dimension = dimension
+        self.tr = tr
+        self.tg = tg
+        self.tb = tb
+
+
+def spread_bits(x: int) -> int:
+    # Puts two zero bits between each of the 5 bits of x, for interleaving 3 coordinates
+    x &= 0x1f
+    x = (x | (x << 8)) & 0x100f
+    x = (x | (x << 4)) & 0x10c3
+    x = (x | (x << 2)) & 0x9249
+    return x
+
+
+def grid_cell(v: float, start: float, size: float) -> int:
+    if size <= 0:
+        return 0
+    return max(0, min(grid_size - 1, int(grid_size * (v - start) / size)))
+
+
+def ray_key(r: Ray, box: AABB) -> int:
+    """
+    Sort key of a ray: the cell of its origin in a grid over box, in Morton order so that
+    neighbouring cells stay close, then the octant of its direction.
+    """
+
+    o, d = r.origin, r.direction
+    x = grid_cell(o.x, box.x.min, box.x.size())
+    y = grid_cell(o.y, box.y.min, box.y.size())
+    z = grid_cell(o.z, box.z.min, box.z.size())
+    cell = spread_bits(x) | (spread_bits(y) << 1) | (spread_bits(z) << 2)
+    octant = (1 if d.x < 0 else 0) | (2 if d.y < 0 else 0) | (4 if d.z < 0 else 0)
+    return 8 * cell + octant
+
+
+def sort_paths(paths: List[Path]) -> List[Path]:
+    """
+    Paths sorted by ray_key, over the bounds of their origins: scenes like a sphere standing
+    for the ground have bounds much larger than where the rays are.
+    """
+
+    if len(paths) == 0:
+        return paths
+
+    first = paths[0].ray.origin
+    x0, y0, z0 = first.x, first.y, first.z
+    x1, y1, z1 = x0, y0, z0
+    for path in paths:
+        o = path.ray.origin
+        x0, y0, z0 = min(x0, o.x), min(y0, o.y), min(z0, o.z)
+        x1, y1, z1 = max(x1, o.x), max(y1, o.y), max(z1, o.z)
+    box = AABB(Interval(x0, x1), Interval(y0, y1), Interval(z0, z1))
+
+    keys = [(ray_key(paths[k].ray, box), k) for k in range(len(paths))]
+    keys.sort()
+    return [paths[k] for _, k in keys]
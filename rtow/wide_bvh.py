@@ -0,0 +1,250 @@
+from math import ceil, floor
+from typing import List, Tuple
+
+from .aabb import AABB
+from .ray import Ray
+from .util import p_inf, m_inf
+from .objects import Hittable, HittableList
+from .bvh import BVHStats
+from .flat_bvh import FlatBVH, inverse
+
+
+# Children per node
+width = 4
+
+# Quantized bounds are stored as this many steps across the node box
+quantization_steps = 255
+
+
+class WideBVH(Hittable):
+    """
+    Not in book: 4-wide BVH, made by collapsing the binary FlatBVH so that every node holds
+    up to 4 children. The boxes of the children are stored structure-of-arrays (the 4 min x,
+    then the 4 min y, ...) and tested together in a single slab test.
+
+    When quantized, the children boxes are stored as 8-bit offsets from the corner of their
+    node box instead of floats, rounded outwards so that they still enclose the children.
+    """
+
+    bounds: List[float]        # 24 per node: min x, y, z then max x, y, z of each child
+    children: List[int]        # 4 per node: index of a node, or of the first primitive of a leaf
+    counts: List[int]          # 4 per node: 0 for a node, count of primitives for a leaf, -1 if empty
+    quantized: bool
+    origins: List[float]       # Quantized only, 3 per node: min corner of the node box
+    scales: List[float]        # Quantized only, 3 per node: size of a quantization step
+    qbounds: List[UInt[8]]     # Quantized only, replaces bounds
+    primitives: List[Hittable]
+    bbox: AABB
+    stack_size: int            # Most nodes the traversal stack holds, width per level of the binary tree
+
+    def __init__(self, quantized: bool = False):
+        self.bounds = []
+        self.children = []
+        self.counts = []
+        self.quantized = quantized
+        self.origins = []
+        self.scales = []
+        self.qbounds = []
+        self.primitives = []
+        self.bbox = AABB()
+        self.stack_size = width
+
+    @staticmethod
+    def from_list(
+            list: HittableList,
+            strategy: str = "median",
+            leaf_size: int = 4,
+            quantized: bool = False,
+            workers: int = 1,
+        ) -> Tuple[Hittable, BVHStats]:
+
+        flat, stats = FlatBVH.build(list, strategy, leaf_size, workers)
+        bvh = WideBVH.from_flat(flat, quantized)
+        root: Hittable = bvh
+        return root, stats
+
+    @staticmethod
+    def from_flat(flat: FlatBVH, quantized: bool):
+        bvh = WideBVH(quantized)
+        bvh.primitives = flat.primitives
+        bvh.bbox = flat.bbox
+        # Wide nodes are never deeper than the binary ones, and push at most width children each
+        bvh.stack_size = width * flat.stack_size
+        bvh.collapse(flat, [0])
+        return bvh
+
+    def collapse(self, flat: FlatBVH, lanes: List[int]) -> int:
+        """
+        Write a node for the given binary nodes, after opening the interior ones with the
+        largest boxes until there are 4 of them. Returns the index of the new node.
+        """
+
+        while len(lanes) < width:
+            best, best_area = -1, -1.0
+            for k, lane in enumerate(lanes):
+                if flat.counts[lane] == 0:
+                    area = node_area(flat, lane)
+                    if area > best_area:
+                        best, best_area = k, area
+            if best < 0:
+                break
+
+            lane = lanes[best]
+            lanes[best] = lane + 1
+            lanes.insert(best + 1, flat.offsets[lane])
+
+        node = len(self.counts) // width
+        self.children.extend([0 for _ in range(width)])
+        self.counts.extend([-1 for _ in range(width)])
+
+        box = [0.0 for _ in range(6 * width)]
+        for k in range(width):
+            for axis in range(6):
+                box[width * axis + k] = (
+                    flat.bounds[6 * lanes[k] + axis] if k < len(lanes) else (p_inf if axis < 3 else m_inf)
+                )
+
+        if self.quantized:
+            self.origins.extend([0.0, 0.0, 0.0])
+            self.scales.extend([0.0, 0.0, 0.0])
+            self.qbounds.extend([UInt[8](0) for _ in range(6 * width)])
+            self.quantize(node, box, len(lanes))
+        else:
+            self.bounds.extend(box)
+
+        for k, lane in enumerate(lanes):
+            count = flat.counts[lane]
+            self.counts[width * node + k] = count
+            if count > 0:
+                self.children[width * node + k] = flat.offsets[lane]
+            else:
+                self.children[width * node + k] = self.collapse(flat, [lane])
+
+        return node
+
+    def quantize(self, node: int, box: List[float], n_lanes: int):
+        b = 6 * width * node
+
+        for axis in range(3):
+            lo, hi = p_inf, m_inf
+            for k in range(n_lanes):
+                lo = min(lo, box[width * axis + k])
+                hi = max(hi, box[width * (axis + 3) + k])
+            scale = max(hi - lo, 1e-30) / quantization_steps
+            self.origins[3 * node + axis] = lo
+            self.scales[3 * node + axis] = scale
+
+            for k in range(width):
+                q_min, q_max = quantization_steps, 0  # Empty lane, never tested
+                if k < n_lanes:
+                    q_min = int(floor((box[width * axis + k] - lo) / scale))
+                    q_max = int(ceil((box[width * (axis + 3) + k] - lo) / scale))
+                self.qbounds[b + width * axis + k] = UInt[8](max(0, min(q_min, quantization_steps)))
+                self.qbounds[b + width * (axis + 3) + k] = UInt[8](max(0, min(q_max, quantization_steps)))
+
+    def intersect(self, r: Ray, t_min: float, t_max: float) -> Tuple[float, Hittable]:
+        counts = self.counts
+        children = self.children
+        bounds = self.bounds
+        qbounds = self.qbounds
+
+        ox, oy, oz = r.origin.x, r.origin.y, r.origin.z
+        ix, iy, iz = inverse(r.direction.x), inverse(r.direction.y), inverse(r.direction.z)
+
+        # Offsets of the near and far planes of the children boxes along each axis
+        nx = 3 * width if ix < 0 else 0
+        ny = 4 * width if iy < 0 else width
+        nz = 5 * width if iz < 0 else 2 * width
+        fx, fy, fz = 3 * width - nx, 5 * width - ny, 7 * width - nz
+
+        closest = t_max
+        primitive: Hittable = self
+        found = False
+
+        # Nodes still to visit, with the distance at which the ray enters them
+        stack = [0 for _ in range(self.stack_size)]
+        entries = [0.0 for _ in range(self.stack_size)]
+        stack[0], entries[0] = 0, t_min
+        sp = 1
+        visits = 0
+        boxes = 0
+
+        hit_children = [0 for _ in range(width)]
+        hit_entries = [0.0 for _ in range(width)]
+
+        while sp > 0:
+            sp -= 1
+            if entries[sp] >= closest:
+                continue
+
+            node = stack[sp]
+            visits += 1
+
+            b = 6 * width * node
+            c = width * node
+
+            # Quantized planes are at origin + scale * q, dequantized in the slab test rather than
+            # into a list of floats per node. The inverse is applied last: folded into the scale, it
+            # could overflow to infinity and give NaNs for rays parallel to an axis
+            lx, ly, lz, sx, sy, sz = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+            if self.quantized:
+                o = 3 * node
+                lx, ly, lz = self.origins[o] - ox, self.origins[o + 1] - oy, self.origins[o + 2] - oz
+                sx, sy, sz = self.scales[o], self.scales[o + 1], self.scales[o + 2]
+
+            # Slab test of the 4 children at once
+            n_hits = 0
+            for k in range(width):
+                count = counts[c + k]
+                if count < 0:
+                    continue
+
+                boxes += 1
+                if self.quantized:
+                    t0 = max(t_min, (lx + sx * int(qbounds[b + nx + k])) * ix, (ly + sy * int(qbounds[b + ny + k])) * iy, (lz + sz * int(qbounds[b + nz + k])) * iz)
+                    t1 = min(closest, (lx + sx * int(qbounds[b + fx + k])) * ix, (ly + sy * int(qbounds[b + fy + k])) * iy, (lz + sz * int(qbounds[b + fz + k])) * iz)
+                else:
+                    t0 = max(t_min, (bounds[b + nx + k] - ox) * ix, (bounds[b + ny + k] - oy) * iy, (bounds[b + nz + k] - oz) * iz)
+                    t1 = min(closest, (bounds[b + fx + k] - ox) * ix, (bounds[b + fy + k] - oy) * iy, (bounds[b + fz + k] - oz) * iz)
+                if t0 >= t1:
+                    continue
+
+                if count > 0:
+                    first = children[c + k]
+                    for i in range(first, first + count):
+                        t, candidate = self.primitives[i].intersect(r, t_min, closest)
+                        if t < closest:
+                            closest = t
+                            primitive = candidate
+                            found = True
+                else:
+                    # Insertion sort on the entry distance, furthest first
+                    j = n_hits
+                    while j > 0 and hit_entries[j - 1] < t0:
+                        hit_children[j] = hit_children[j - 1]
+                        hit_entries[j] = hit_entries[j - 1]
+                        j -= 1
+                    hit_children[j] = children[c + k]
+                    hit_entries[j] = t0
+                    n_hits += 1
+
+            # Push the furthest child first so that the nearest one is visited next
+            for j in range(n_hits):
+                stack[sp] = hit_children[j]
+                entries[sp] = hit_entries[j]
+                sp += 1
+
+        if r.stats:
+            r.stats.add_traversal(visits, boxes)
+        return (closest if found else p_inf), primitive
+
+    def bounding_box(self) -> AABB:
+        return self.bbox
+
+
+def node_area(flat: FlatBVH, node: int) -> float:
+    b = 6 * node
+    dx = flat.bounds[b + 3] - flat.bounds[b]
+    dy = flat.bounds[b + 4] - flat.bounds[b + 1]
+    dz = flat.bounds[b + 5] - flat.bounds[b + 2]
+    return 2 * (dx * dy + dy * dz + dz * dx)
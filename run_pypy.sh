@@ -2,4 +2,4 @@
 set -e
 
 python preprocess.py python
-time pypy3 -m rtow_python
+time pypy3 -m rtow_python "$@"
@@ -2,4 +2,4 @@
 set -e
 
 python preprocess.py python
-time python3 -m rtow_python
+time python3 -m rtow_python "$@"